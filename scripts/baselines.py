@@ -0,0 +1,156 @@
+"""Forecasting baselines for many series at once, in plain NumPy.
+
+Fitting darts baselines through cross_validate builds TimeSeries objects and
+model instances for every column and fold, which dominates the cost on short
+quarterly series. Here every series is a row of one (series x quarters) matrix,
+and the drift, seasonal naive and least-squares AR forecasts, together with
+their scores over TimeSeriesSplit folds, are computed for all rows at once. Use
+it to screen every issue code or stock group and only run the expensive models
+on the promising ones.
+
+The drift and seasonal naive forecasts match darts' NaiveDrift and
+NaiveSeasonal. AR models are fit by ordinary least squares (with an intercept),
+so they approximate, rather than reproduce, darts' ARIMA(p, d, 0).
+"""
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+
+def drift_forecast(Y, horizon):
+    """Extend the line through the first and last value of each row.
+
+    Args:
+      Y (np.ndarray): (series, time) matrix.
+      horizon (int): Number of steps to forecast.
+
+    Returns:
+      (series, horizon) matrix of forecasts.
+    """
+    slope = (Y[:, -1] - Y[:, 0]) / max(Y.shape[1] - 1, 1)
+    steps = np.arange(1, horizon + 1)
+    return Y[:, -1:] + slope[:, None] * steps
+
+
+def seasonal_naive_forecast(Y, horizon, K=4):
+    """Repeat the last K values of each row."""
+    steps = np.arange(horizon) % K
+    return Y[:, Y.shape[1] - K + steps]
+
+
+def ar_forecast(Y, horizon, p=1, d=0):
+    """Fit an AR(p) model with intercept to each row by least squares, on the
+    d-times differenced data, and forecast recursively.
+
+    Args:
+      Y (np.ndarray): (series, time) matrix.
+      horizon (int): Number of steps to forecast.
+      p (int, default 1): Autoregressive order.
+      d (int, default 0): Order of differencing.
+
+    Returns:
+      (series, horizon) matrix of forecasts.
+    """
+    Z = np.diff(Y, n=d, axis=1)
+    num_series, length = Z.shape
+    # Design tensor: for every series, rows [1, z_{t-1}, ..., z_{t-p}]
+    lags = np.stack([Z[:, p - i - 1:length - i - 1] for i in range(p)], axis=2)
+    X = np.concatenate([np.ones((num_series, length - p, 1)), lags], axis=2)
+    coef = np.einsum("skt,st->sk", np.linalg.pinv(X), Z[:, p:])
+
+    history = Z[:, length - p:][:, ::-1]
+    forecast = np.empty((num_series, horizon))
+    for h in range(horizon):
+        forecast[:, h] = coef[:, 0] + np.einsum("sk,sk->s", coef[:, 1:], history)
+        history = np.concatenate([forecast[:, h:h + 1], history[:, :-1]], axis=1)
+
+    # Undo the differencing, one order at a time
+    for order in range(d, 0, -1):
+        last = np.diff(Y, n=order - 1, axis=1)[:, -1:]
+        forecast = last + np.cumsum(forecast, axis=1)
+    return forecast
+
+
+# Name -> forecaster(Y, horizon)
+BASELINES = {
+    "drift": drift_forecast,
+    "seasonal_naive": seasonal_naive_forecast,
+    "AR(1)": partial(ar_forecast, p=1),
+    "AR(2)": partial(ar_forecast, p=2),
+    "ARI(1, 1)": partial(ar_forecast, p=1, d=1),
+}
+
+
+def split_folds(length, n_cv=5, test_size=4):
+    """Train and validation indices, as given by
+    sklearn's TimeSeriesSplit(n_cv, test_size=test_size).split."""
+    folds = []
+    for k in range(n_cv):
+        valid_start = length - (n_cv - k) * test_size
+        folds.append((np.arange(valid_start), np.arange(valid_start, valid_start + test_size)))
+    return folds
+
+
+def mse(actual, pred):
+    """Mean squared error of each row."""
+    return ((actual - pred) ** 2).mean(axis=1)
+
+
+def msse(actual, pred, insample, m=1):
+    """Mean squared scaled error of each row, as darts.metrics.msse: the MSE
+    scaled by the MSE of the m-step naive forecast on the training data."""
+    scale = ((insample[:, m:] - insample[:, :-m]) ** 2).mean(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return mse(actual, pred) / scale
+
+
+def fold_scores(Y, forecasters=None, n_cv=5, test_size=4, metric="msse"):
+    """Score baselines on every series and fold.
+
+    Args:
+      Y (np.ndarray): (series, time) matrix. Rows with missing values are
+        scored NaN.
+      forecasters (dict, optional): Name -> forecaster(Y, horizon). Defaults
+        to BASELINES.
+      n_cv (int, default 5): Number of validation sets to use.
+      test_size (int, default 4): Number of quarters in each validation set.
+      metric (str, default "msse"): "mse" or "msse".
+
+    Returns:
+      (forecasters, folds, series) array of scores.
+    """
+    forecasters = BASELINES if forecasters is None else forecasters
+    Y = np.asarray(Y, dtype=np.float64)
+    scores = np.full((len(forecasters), n_cv, Y.shape[0]), np.nan)
+    # Series with missing values are left out (and scored NaN)
+    complete = np.isfinite(Y).all(axis=1)
+    Y = Y[complete]
+    for k, (train_idx, valid_idx) in enumerate(split_folds(Y.shape[1], n_cv, test_size)):
+        train, valid = Y[:, train_idx], Y[:, valid_idx]
+        for i, forecaster in enumerate(forecasters.values()):
+            pred = forecaster(train, len(valid_idx))
+            scores[i, k, complete] = mse(valid, pred) if metric == "mse" else msse(valid, pred, train)
+    return scores
+
+
+def baseline_scores(table, forecasters=None, n_cv=5, test_size=4, metric="msse"):
+    """Cross-validate baselines on every column of a table of quarterly series.
+
+    Args:
+      table (pd.DataFrame): Quarters as index, one series per column, e.g.
+        all_lobbying_totals() or a pivot of all_stock_totals().
+      forecasters (dict, optional): Name -> forecaster(Y, horizon). Defaults
+        to BASELINES.
+      n_cv (int, default 5): Number of validation sets to use.
+      test_size (int, default 4): Number of quarters in each validation set.
+      metric (str, default "msse"): "mse" or "msse".
+
+    Returns:
+      DataFrame indexed by the columns of table, with the mean score over the
+      folds of each baseline (as cross_validate reports it). Series with
+      missing values get NaN.
+    """
+    forecasters = BASELINES if forecasters is None else forecasters
+    scores = fold_scores(table.to_numpy().T, forecasters, n_cv, test_size, metric)
+    return pd.DataFrame(scores.mean(axis=1).T, index=table.columns, columns=list(forecasters))
@@ -0,0 +1,470 @@
+"""Benchmarks of the data extraction functions on synthetic data.
+
+The real inputs are Git LFS files that aren't always checked out, and they only
+come in one size. make_fixture writes synthetic inputs of the same layout at a
+given scale: a filings_all.csv split into by_quarter and by_issue_code files
+with split_filings (and optionally the Parquet store), and a raw congress
+trading table cleaned into stocks_cleaned.csv with preprocess_stocks. At scale
+1 there are FILINGS_PER_QUARTER filings per quarter and TRADES trades.
+
+Each benchmark is timed cold (with every cache cleared) and warm (run again
+straight after). Its memory is measured in two more cold runs: under
+tracemalloc, which sees Python and NumPy allocations, and in a fresh process,
+whose peak resident set size also counts pyarrow buffers, the interpreter and
+the imported libraries. Results can be saved as a baseline, and later runs are compared
+against it to flag regressions. Run it from the repository root with
+
+    python -m scripts.benchmark --scales 1 10 --save-baseline
+    python -m scripts.benchmark --scales 1 10
+"""
+import argparse
+import gc
+import json
+import multiprocessing
+import os
+import shutil
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from scripts import data_extraction
+from scripts.data_extraction import (
+    get_all_lobbying_data, invalidate_lobbying_caches, issue_codes_for_company, lobbying_totals,
+    stock_and_lobbying_totals, stock_totals,
+)
+from scripts.instrumentation import peak_rss_mb
+from scripts.lobbying_store import build_store, pyarrow_available
+from scripts.preprocess_stocks import all_codes, preprocess_stock_data
+from scripts.split_filings import split_filings
+
+BENCHMARK_PATH = Path("benchmarks")
+FIXTURE_PATH = BENCHMARK_PATH / "fixtures"
+BASELINE_PATH = BENCHMARK_PATH / "baseline.json"
+SECTORS_PATH = Path("trading_data") / "sector2lobbyingcode.csv"
+FILINGS_PER_QUARTER = 1000
+# preprocess_stock_data drops a few rows by label, the largest being 44837
+TRADES = 50000
+YEARS = range(2013, 2025)
+# Relative slowdown or memory growth flagged as a regression
+TOLERANCE = 0.25
+# Differences smaller than these are noise
+MIN_SECONDS = 0.05
+MIN_MB = 1.0
+# Columns identifying a benchmark result, and the measurements
+KEY = ["layout", "scale", "benchmark"]
+MEASURES = ["cold_s", "warm_s", "peak_mb", "peak_rss_mb", "rss_delta_mb"]
+
+ISSUE_CODES = [
+    "ACC", "ADV", "AER", "AGR", "ALC", "ANI", "APP", "ART", "AUT", "AVI", "BAN", "BEV", "BNK",
+    "BUD", "CAW", "CDT", "CHM", "CIV", "COM", "CON", "CPI", "CPT", "CSP", "DEF", "DIS", "DOC",
+    "ECN", "EDU", "ENG", "ENV", "FAM", "FIN", "FIR", "FOO", "FOR", "FUE", "GAM", "GOV", "HCR",
+    "HOM", "HOU", "IMM", "IND", "INS", "INT", "LAW", "LBR", "MAN", "MAR", "MED", "MIA", "MMM",
+    "MON", "NAT", "PHA", "POS", "RES", "RET", "ROD", "RRR", "SCI", "SMB", "SPO", "TAX", "TEC",
+    "TOB", "TOR", "TRA", "TRD", "TRU", "UNM", "URB", "UTI", "VET", "WAS", "WEL",
+]
+# Clients looked up by the issue_codes_for_company benchmark
+KNOWN_CLIENTS = ["APPLE INC.", "Apple, Inc", "EXXON MOBIL CORPORATION", "BOEING COMPANY", "WALMART INC."]
+TRADE_SIZES = [
+    "$1,001 - $15,000", "$15,001 - $50,000", "$50,001 - $100,000", "$100,001 - $250,000",
+    "$250,001 - $500,000", "$500,001 - $1,000,000", "$1,000,001 - $5,000,000",
+]
+TICKER_TYPES = ["ST", "Stock", "OP", "Stock Option", "Other Securities", "CS", "PS"]
+
+
+def _pool(rng, size, fmt):
+    """A pool of size distinct made-up names, from a format with one field."""
+    return np.array([fmt.format(i) for i in rng.permutation(size)], dtype=object)
+
+
+def make_filings(num_filings, rng):
+    """Synthetic filings in the layout of filings_all.csv.
+
+    Most filings are quarterly reports or their amendments, the rest are
+    registrations that split_filings drops. Issue codes, descriptions and
+    names are drawn from pools, with a few well-known clients mixed in.
+    """
+    codes = []
+    for _ in range(2000):
+        k = rng.choice([0, 1, 1, 2, 2, 3, 4, 6])
+        codes.append(str(rng.choice(ISSUE_CODES, k, replace=False).tolist()))
+    codes = np.array(codes, dtype=object)
+    descriptions = np.array([
+        str([f"H.R. {rng.integers(1, 9999)} and issues affecting {ticker}" for ticker in pair])
+        for pair in rng.choice(["AAPL", "XOM", "BA", "WMT", "MSFT", "tax policy", "appropriations"], (500, 2))
+    ], dtype=object)
+    clients = np.concatenate([KNOWN_CLIENTS, _pool(rng, max(num_filings // 20, 50), "CLIENT {} INC.")])
+    registrants = _pool(rng, max(num_filings // 100, 20), "REGISTRANT {} LLC")
+    filing_types = np.array(
+        ["Q1", "Q2", "Q3", "Q4", "1A", "2A", "3A", "4A", "RR", "MM"], dtype=object
+    )
+
+    client_ids = rng.integers(0, len(clients), num_filings)
+    registrant_ids = rng.integers(0, len(registrants), num_filings)
+    years = rng.choice(np.array(YEARS), num_filings)
+    type_ids = rng.choice(len(filing_types), num_filings, p=[0.21] * 4 + [0.02] * 4 + [0.04] * 2)
+    quarter_ends = pd.PeriodIndex.from_fields(year=years, quarter=type_ids % 4 + 1, freq="Q").end_time
+    amounts = rng.choice([0.0, 1.0, 10000.0, 20000.0, 50000.0, 120000.0, 500000.0], num_filings)
+    is_income = rng.random(num_filings) < 0.6
+    return pd.DataFrame({
+        "filing_uuid": [f"{i:08x}-0000-4000-8000-{i:012x}" for i in range(num_filings)],
+        "filing_type": filing_types[type_ids],
+        "filing_year": years,
+        "income": np.where(is_income, amounts, 0.0),
+        "expenses": np.where(is_income, 0.0, amounts),
+        "dt_posted": (quarter_ends + pd.to_timedelta(rng.integers(1, 40 * 86400, num_filings), "s")).floor("s"),
+        "registrant": registrants[registrant_ids],
+        "client": clients[client_ids],
+        "reg_id": registrant_ids + 1,
+        "cl_id": client_ids + 1,
+        "issue_codes": codes[rng.integers(0, len(codes), num_filings)],
+        "lobbying_description": descriptions[rng.integers(0, len(descriptions), num_filings)],
+    })
+
+
+def make_symbol_sectors(num_symbols, rng, industries):
+    """Synthetic symbol2sector.csv table over made-up ticker symbols."""
+    return pd.DataFrame({
+        "Ticker": [f"T{i:04d}" for i in range(num_symbols)],
+        "Sector": "Synthetic",
+        "Industry": rng.choice(industries, num_symbols),
+        "YFQuoteType": rng.choice(["EQUITY", "EQUITY", "EQUITY", "ETF"], num_symbols),
+    })
+
+
+def make_trades(num_trades, rng, tickers):
+    """Synthetic congress trading table, as read from congress-trading-all.xlsx."""
+    num_trades = max(num_trades, TRADES)
+    names = _pool(rng, 500, "Member{}, Firstname").tolist() + ["Mr. John Smith", "Pelosi, Nancy"]
+    tickers = np.concatenate([tickers, [f"{t}.B" for t in tickers[:50]], [f"{t}$A" for t in tickers[:50]]])
+    traded = pd.Timestamp("2012-07-01") + pd.to_timedelta(rng.integers(0, 4380, num_trades), "D")
+    filed = traded + pd.to_timedelta(rng.integers(0, 45, num_trades), "D")
+    return pd.DataFrame({
+        "Ticker": rng.choice(tickers, num_trades),
+        "TickerType": rng.choice(TICKER_TYPES, num_trades),
+        "Name": rng.choice(names, num_trades),
+        "Trade_Size_USD": rng.choice(TRADE_SIZES, num_trades),
+        "Transaction": rng.choice(["Purchase", "Sale", "Sale (Partial)", "Sale (Full)", "Exchange"], num_trades),
+        "Traded": traded,
+        "Filed": filed,
+        "Quiver_Upload_Time": filed + pd.Timedelta("1D"),
+        "last_modified": (filed + pd.Timedelta("2D")).strftime("%Y-%m-%d"),
+        "Status": "New",
+        "excess_return": rng.normal(size=num_trades),
+        "House": rng.choice(["Senate", "Representatives"], num_trades),
+    })
+
+
+def clean_trades(trades, symbol_sectors, sectors):
+    """Form stocks_cleaned.csv from raw trades, as merge_and_clean_stock_data
+    does, with the mean and variance of each trade size range."""
+    stocks = preprocess_stock_data(trades.copy())
+    stocks = pd.merge(stocks, symbol_sectors, on="Ticker", how="left")
+    stocks = stocks[stocks.YFQuoteType == "EQUITY"]
+    stocks = pd.merge(stocks, sectors, on="Industry", how="left")
+    stocks["Codes"] = all_codes(stocks)
+    stocks["Mean_Trade_Size"] = (stocks.Min_Trade_Size + stocks.Max_Trade_Size) / 2
+    stocks["Variance"] = (stocks.Max_Trade_Size - stocks.Min_Trade_Size) ** 2 / 12
+    stocks["Quarter"] = stocks["Quarter"].dt.start_time
+    return stocks
+
+
+def make_fixture(root, scale=1, seed=0, store=False, max_workers=None):
+    """Write synthetic lobbying_data and trading_data directories under root.
+
+    A fixture that was already written with the same parameters is reused.
+
+    Args:
+      root (str or pathlike): Directory to write the fixture into.
+      scale (int, default 1): Size multiplier of the data.
+      seed (int, default 0): Seed of the random generator.
+      store (bool, default False): Whether to also build the Parquet store.
+      max_workers (int, optional): Size of the process pool of split_filings.
+
+    Returns:
+      Path of the fixture.
+    """
+    root = Path(root)
+    params = {"scale": scale, "seed": seed, "store": store,
+              "filings_per_quarter": FILINGS_PER_QUARTER, "trades": TRADES}
+    marker = root / "fixture.json"
+    if marker.exists():
+        with open(marker) as f:
+            if json.load(f) == params:
+                return root
+    shutil.rmtree(root, ignore_errors=True)
+    rng = np.random.default_rng(seed)
+    lobbying_path = root / "lobbying_data"
+    trading_path = root / "trading_data"
+    lobbying_path.mkdir(parents=True)
+    trading_path.mkdir(parents=True)
+
+    num_filings = FILINGS_PER_QUARTER * scale * 4 * len(YEARS)
+    make_filings(num_filings, rng).to_csv(lobbying_path / "filings_all.csv", index=False)
+    split_filings(lobbying_path / "filings_all.csv", lobbying_path, max_workers=max_workers)
+    if store:
+        build_store(lobbying_path, lobbying_path / "store")
+
+    sectors = pd.read_csv(SECTORS_PATH)
+    symbol_sectors = make_symbol_sectors(4000, rng, sectors["Industry"].unique())
+    trades = make_trades(TRADES * scale, rng, symbol_sectors["Ticker"].to_numpy())
+    sectors.to_csv(trading_path / "sector2lobbyingcode.csv", index=False)
+    symbol_sectors.to_csv(trading_path / "symbol2sector.csv", index=False)
+    trades.to_pickle(trading_path / "congress-trading-all.pkl")
+    clean_trades(trades, symbol_sectors, sectors).to_csv(trading_path / "stocks_cleaned.csv", index=False)
+
+    with open(marker, "w") as f:
+        json.dump(params, f)
+    return root
+
+
+def _raw_trades():
+    return (pd.read_pickle(Path("trading_data") / "congress-trading-all.pkl"),)
+
+
+# Name -> (setup, function). setup (untimed) returns the arguments of
+# function; both run in the fixture directory.
+BENCHMARKS = {
+    "get_all_lobbying_data": (None, get_all_lobbying_data),
+    "get_all_lobbying_data (compact)": (None, lambda: get_all_lobbying_data(compact=True)),
+    "issue_codes_for_company": (None, lambda: issue_codes_for_company("APPLE")),
+    "issue_codes_for_company (uncached)": (None, lambda: issue_codes_for_company("APPLE", cache=False)),
+    "lobbying_totals": (None, lambda: lobbying_totals("TAX")),
+    "lobbying_totals (3 codes)": (None, lambda: lobbying_totals(["TAX", "BUD", "DEF"])),
+    "stock_totals": (None, lambda: stock_totals("Aerospace & Defense")),
+    "stock_and_lobbying_totals": (None, lambda: stock_and_lobbying_totals("DEF", "Aerospace & Defense")),
+    "preprocess_stock_data": (_raw_trades, preprocess_stock_data),
+}
+
+
+@contextmanager
+def working_directory(path):
+    """Temporarily change the working directory (the data paths are relative)."""
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def reset_caches():
+    """Drop every cached result of data_extraction, on disk and in memory."""
+    shutil.rmtree(Path("lobbying_data") / "cache", ignore_errors=True)
+    shutil.rmtree(Path("trading_data") / "cache", ignore_errors=True)
+    invalidate_lobbying_caches([])
+    data_extraction.totals_cube_pieces.clear()
+    data_extraction.stocks_cube = None
+
+
+def measure(function, setup=None):
+    """Time a function cold and warm, and measure its peak memory.
+
+    Memory is measured by tracemalloc, which sees the allocations of Python
+    and NumPy (and so pandas), but not those of pyarrow's memory pool (see
+    measure_rss).
+
+    Returns:
+      Dict with "cold_s", "warm_s" and "peak_mb".
+    """
+    def arguments():
+        return setup() if setup is not None else ()
+
+    result = {}
+    reset_caches()
+    for key in ["cold_s", "warm_s"]:
+        args = arguments()
+        start = time.perf_counter()
+        function(*args)
+        result[key] = time.perf_counter() - start
+
+    reset_caches()
+    args = arguments()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        function(*args)
+        result["peak_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+    finally:
+        tracemalloc.stop()
+    return result
+
+
+def _proc_status_mb(field):
+    """A memory field of /proc/self/status (e.g. "VmRSS") in MB, or None
+    where there is no /proc (outside Linux)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(f"{field}:"):
+                    return int(line.split()[1]) / 2**10
+    except OSError:
+        pass
+    return None
+
+
+def _reset_peak_rss():
+    """Reset the VmHWM high-water mark of this process (Linux only)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _rss_worker(root, name, conn):
+    """Run one benchmark cold in this (fresh) process and send back its peak
+    RSS and the RSS before the call."""
+    with working_directory(root):
+        reset_caches()
+        setup, function = BENCHMARKS[name]
+        args = setup() if setup is not None else ()
+        gc.collect()
+        # ru_maxrss can't be reset, and imports may already have set it above
+        # the current RSS; VmHWM can, where available
+        if _reset_peak_rss():
+            before = _proc_status_mb("VmRSS")
+            function(*args)
+            peak = _proc_status_mb("VmHWM")
+        else:
+            before = peak_rss_mb()
+            function(*args)
+            peak = peak_rss_mb()
+        conn.send((max(peak, before), before))
+    conn.close()
+
+
+def measure_rss(root, name):
+    """Measure the peak resident set size of a cold run of a benchmark, in a
+    fresh process so that earlier runs don't raise the high-water mark.
+
+    Args:
+      root (pathlike): Fixture directory.
+      name (str): Benchmark name, a key of BENCHMARKS.
+
+    Returns:
+      Dict with "peak_rss_mb", the peak RSS of the process (including the
+      interpreter and imports), and "rss_delta_mb", its growth during the
+      call. Both are None where RSS can't be measured.
+    """
+    if peak_rss_mb() is None:
+        return {"peak_rss_mb": None, "rss_delta_mb": None}
+    context = multiprocessing.get_context("spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_rss_worker, args=(str(root), name, sender))
+    process.start()
+    sender.close()
+    try:
+        peak, before = receiver.recv()
+    except EOFError:
+        raise RuntimeError(f"Benchmark {name!r} failed in the RSS measuring process") from None
+    finally:
+        process.join()
+    return {"peak_rss_mb": peak, "rss_delta_mb": peak - before}
+
+
+def run_benchmarks(scales=(1,), names=None, fixture_path=None, store=False, seed=0):
+    """Run benchmarks on fixtures of some scales.
+
+    Args:
+      scales (list of int, default (1,)): Fixture scales.
+      names (list of str, optional): Benchmarks to run. Defaults to all of
+        BENCHMARKS.
+      fixture_path (str or pathlike, optional): Where to keep the fixtures.
+        Defaults to FIXTURE_PATH.
+      store (bool, default False): Whether to read through the Parquet store.
+      seed (int, default 0): Seed of the fixtures.
+
+    Returns:
+      DataFrame with one row per (scale, benchmark), with the input "layout"
+      ("store" or "csv").
+    """
+    if store and not pyarrow_available():
+        raise ImportError("Benchmarking the lobbying store requires pyarrow.")
+    fixture_path = Path(FIXTURE_PATH if fixture_path is None else fixture_path).resolve()
+    names = list(BENCHMARKS) if names is None else names
+    layout = "store" if store else "csv"
+    rows = []
+    for scale in scales:
+        root = make_fixture(fixture_path / f"{layout}-{scale}", scale, seed, store)
+        with working_directory(root):
+            for name in names:
+                setup, function = BENCHMARKS[name]
+                rows.append({
+                    "layout": layout, "scale": scale, "benchmark": name,
+                    **measure(function, setup), **measure_rss(root, name),
+                })
+                rss = rows[-1]["peak_rss_mb"]
+                print(f"scale {scale}: {name}: {rows[-1]['cold_s']:.3f}s cold, "
+                      f"{rows[-1]['warm_s']:.3f}s warm, {rows[-1]['peak_mb']:.1f} MB traced"
+                      + ("" if rss is None else f", {rss:.1f} MB peak RSS"))
+            reset_caches()
+    return pd.DataFrame(rows)
+
+
+def load_baseline(path=None):
+    """Load saved benchmark results (an empty frame if there are none)."""
+    path = BASELINE_PATH if path is None else Path(path)
+    if not path.exists():
+        return pd.DataFrame(columns=KEY + MEASURES)
+    with open(path) as f:
+        return pd.DataFrame(json.load(f))
+
+
+def save_baseline(results, path=None):
+    """Save benchmark results as the baseline, replacing the rows of the same
+    (layout, scale, benchmark) and keeping the others."""
+    path = BASELINE_PATH if path is None else Path(path)
+    baseline = pd.concat([load_baseline(path), results]).drop_duplicates(KEY, keep="last").sort_values(KEY)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(baseline.to_dict(orient="records"), f, indent=1)
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """Compare benchmark results with a baseline.
+
+    A benchmark regressed if its cold time, traced peak memory or RSS growth
+    grew by more than tolerance (relative), and by more than MIN_SECONDS or
+    MIN_MB.
+
+    Returns:
+      results with the baseline values ("base_cold_s", "base_peak_mb", ...),
+      their ratios and a "regression" column.
+    """
+    base = baseline.reindex(columns=KEY + MEASURES).rename(columns={col: f"base_{col}" for col in MEASURES})
+    out = results.merge(base, on=KEY, how="left")
+    out["time_ratio"] = out["cold_s"] / out["base_cold_s"]
+    out["memory_ratio"] = out["peak_mb"] / out["base_peak_mb"]
+    out["rss_ratio"] = out["rss_delta_mb"].astype(float) / out["base_rss_delta_mb"].astype(float)
+    slower = (out["time_ratio"] > 1 + tolerance) & (out["cold_s"] - out["base_cold_s"] > MIN_SECONDS)
+    larger = (out["memory_ratio"] > 1 + tolerance) & (out["peak_mb"] - out["base_peak_mb"] > MIN_MB)
+    rss_growth = out["rss_delta_mb"].astype(float) - out["base_rss_delta_mb"].astype(float)
+    larger |= (out["rss_ratio"] > 1 + tolerance) & (rss_growth > MIN_MB)
+    out["regression"] = slower | larger
+    return out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scales", type=int, nargs="+", default=[1])
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), default=None)
+    parser.add_argument("--store", action="store_true", help="read through the Parquet store")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args()
+    results = run_benchmarks(args.scales, args.only, store=args.store)
+    if args.save_baseline:
+        save_baseline(results, args.baseline)
+        print(f"Saved baseline to {args.baseline}")
+    else:
+        compared = compare(results, load_baseline(args.baseline), args.tolerance)
+        with pd.option_context("display.width", 200, "display.max_columns", None):
+            print(compared.round(3).to_string(index=False))
+        if compared["regression"].any():
+            raise SystemExit(f"{compared['regression'].sum()} benchmarks regressed")
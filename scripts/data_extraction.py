@@ -1,26 +1,323 @@
 """Tools for extracting and filtering lobbying and stocks data."""
+import ast
+import hashlib
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
-from collections import defaultdict
 
 import numpy as np
 import pandas as pd
 
+from scripts.descriptions import DescriptionStore, DescriptionWriter
+from scripts.instrumentation import cache_hit, cache_miss, enabled, file_sizes, instrumented, record, stage
+from scripts.issue_codes import IssueCodeIndex, parse_code_list
+from scripts.lobbying_store import (
+    LOBBYING_DTYPES, TRAIN_END_QUARTER, list_quarters, open_store, pyarrow_available, quarter_of_file,
+    read_filings, store_exists,
+)
+from scripts.name_index import NameIndex
+
 LOBBYING_PATH = Path("lobbying_data")
 TRADING_PATH = Path("trading_data")
+TOTALS_CACHE_PATH = LOBBYING_PATH / "cache" / "totals"
 lobbying_data = None
+lobbying_code_index = None
+lobbying_name_index = None
+lobbying_name_code_counts = None
+lobbying_descriptions = None
+totals_cube_pieces = {}
+stocks_cube = None
+
+COMPACT_COLUMNS = [
+    "filing_uuid", "filing_type", "registrant", "client", "reg_id", "cl_id", "income",
+    "expenses", "spending_variance", "issue_codes", "dt_posted", "period_start",
+]
+CATEGORICAL_COLUMNS = ["registrant", "client", "filing_type", "issue_codes"]
+# Compact dtypes, the same for every quarter: ids fit in 32 bits, and amounts
+# stay float64 as they can exceed what float32 holds exactly (2**24)
+COMPACT_DTYPES = {
+    "reg_id": "Int32", "cl_id": "Int32",
+    "income": "float64", "expenses": "float64", "spending_variance": "float64",
+}
+POOLS = {"thread": ThreadPoolExecutor, "process": ProcessPoolExecutor}
+
+@instrumented()
+def get_all_lobbying_data(train_only=True, columns=None, compact=False):
+    """Get all lobbying filings, one row per filing.
+    
+    Reads from the Parquet store (see scripts/lobbying_store.py) if it has been
+    built, and from the by_quarter CSV files otherwise.
+    
+    Args:
+      train_only (bool, default True): Whether to only get training data (data
+        from before 2023).
+      columns (list of str, optional): Only read these columns. "period_start"
+        may always be requested. Defaults to all columns.
+      compact (bool, default False): Whether to load a memory-compact frame:
+        names, filing types and issue codes become categoricals, ids are
+        downcast (see COMPACT_DTYPES), and period_start is a datetime64
+        column. Columns default to COMPACT_COLUMNS; in particular the
+        description text is left out (see get_description).
+        
+    Returns:
+      DataFrame of filings with a "period_start" column for the quarter.
+      Columns have the dtypes of LOBBYING_DTYPES, so reg_id and cl_id are
+      nullable Int64 (a few filings lack them) rather than int64.
+    """
+    if compact:
+        return _compact_lobbying_data(train_only, columns)
+    
+    if store_exists():
+        df = read_filings(columns=columns, train_only=train_only)
+        if "period_start" in df:
+            df["period_start"] = df["period_start"].dt.date
+        return df
+    
+    chunks = [chunk for _, chunk in iter_lobbying_data(train_only=train_only, columns=columns)]
+    if not chunks:
+        return pd.DataFrame(columns=columns)
+    # A single concat at the end; growing the frame quarter by quarter would
+    # copy everything read so far on every quarter
+    df = pd.concat(chunks)
+    if "period_start" in df:
+        df["period_start"] = df["period_start"].dt.date
+    return df
+
+
+def iter_lobbying_data(train_only=True, columns=None, start=None, end=None,
+                       compact=False, parallel=None, max_workers=None):
+    """Iterate over the lobbying filings one quarter at a time, in order.
+    
+    Only one quarter (or, in parallel mode, max_workers quarters) is held in
+    memory at a time, so callers that aggregate can stream through all of the
+    data. Chunks have the same dtypes for every quarter (see LOBBYING_DTYPES,
+    and COMPACT_DTYPES with compact=True), with period_start as a datetime64
+    column. Compact categorical columns have the categories of their own
+    quarter.
+    
+    Args:
+      train_only (bool, default True): Whether to only get training data (data
+        from before 2023).
+      columns (list of str, optional): Only read these columns. "period_start"
+        may always be requested. Defaults to all columns.
+      start, end (date-like, optional): Only read the quarters overlapping
+        [start, end].
+      compact (bool, default False): Whether to shrink each chunk as in
+        get_all_lobbying_data(compact=True).
+      parallel (str, optional): "thread" or "process" to read the quarters in
+        a thread or process pool. Chunks are still yielded in quarter order.
+      max_workers (int, optional): Size of the pool.
+        
+    Yields:
+      (quarter, DataFrame) pairs, e.g. ("2013Q1", filings of 2013Q1).
+    """
+    sources = [
+        (quarter, files) for quarter, files in lobbying_sources(train_only)
+        if quarter_overlaps(quarter, start, end)
+    ]
+    read = partial(_read_quarter_chunk, columns=columns, compact=compact)
+    if parallel is None:
+        for quarter, files in sources:
+            yield quarter, read(quarter, files)
+        return
+    if parallel not in POOLS:
+        raise ValueError(f"parallel must be one of {sorted(POOLS)}, got {parallel!r}")
+    max_workers = max_workers or os.cpu_count() or 1
+    with POOLS[parallel](max_workers=max_workers) as pool:
+        pending = deque()
+        for quarter, files in sources:
+            pending.append((quarter, pool.submit(read, quarter, files)))
+            # Keep at most one pending read per worker to bound memory
+            if len(pending) >= max_workers:
+                quarter, future = pending.popleft()
+                yield quarter, future.result()
+        while pending:
+            quarter, future = pending.popleft()
+            yield quarter, future.result()
 
-def get_all_lobbying_data(train_only=True):
-    df = pd.DataFrame()
-    for fname in (LOBBYING_PATH / "by_quarter").glob("*.csv"):
-        if train_only and ("2023" in fname.name or "2024" in fname.name):
-            continue
-        this_quarter = pd.read_csv(fname)
-        # Attach a column for the quarter
-        this_quarter["period_start"] = pd.to_datetime(fname.stem[8:]).date()
-        df = pd.concat([df, this_quarter])
+
+def lobbying_sources(train_only):
+    """List the quarters of lobbying data with the files holding each one."""
+    if store_exists():
+        sources = list_quarters().items()
+    else:
+        sources = [
+            (quarter_of_file(fname), [fname])
+            for fname in sorted((LOBBYING_PATH / "by_quarter").glob("*.csv"))
+        ]
+    return [(quarter, files) for quarter, files in sources
+            if not (train_only and quarter > TRAIN_END_QUARTER)]
+
+
+def _available_columns():
+    """Columns stored for each filing (besides the derived period columns)."""
+    if store_exists():
+        return open_store().schema.names
+    fname = next((LOBBYING_PATH / "by_quarter").glob("*.csv"))
+    return list(pd.read_csv(fname, nrows=0).columns) + ["period_start"]
+
+
+@instrumented("read_quarter")
+def read_quarter(quarter, files, columns):
+    """Read some columns (default all) of one quarter of lobbying data."""
+    if enabled():
+        record(bytes_read=file_sizes(files))
+    if store_exists():
+        df = read_filings(columns=columns, train_only=False, quarters=[quarter])
+        record(rows=len(df))
+        return df
+    usecols = None if columns is None else [col for col in columns if col != "period_start"]
+    dtypes = {col: dtype for col, dtype in LOBBYING_DTYPES.items() if usecols is None or col in usecols}
+    df = pd.read_csv(files[0], usecols=usecols, dtype=dtypes)
+    if columns is None or "period_start" in columns:
+        df["period_start"] = pd.Period(quarter, freq="Q").start_time
+    record(rows=len(df))
+    return df
+
+
+def _read_quarter_chunk(quarter, files, columns, compact=False):
+    """Read one quarter for iter_lobbying_data (module level so that it can be
+    sent to a process pool)."""
+    df = read_quarter(quarter, files, columns)
+    if compact:
+        df = _compact(df)
     return df
 
-def issue_codes_for_company(company_name, regex=True, cache=True, train_only=True):
+
+def quarter_overlaps(quarter, start=None, end=None):
+    """Whether a quarter label overlaps the date range [start, end]."""
+    period = pd.Period(quarter, freq="Q")
+    if start is not None and period.end_time < pd.Timestamp(start):
+        return False
+    if end is not None and period.start_time > pd.Timestamp(end):
+        return False
+    return True
+
+
+@instrumented("compact")
+def _compact(df):
+    """Shrink a chunk of filings: categoricals for repeated strings and the
+    COMPACT_DTYPES for the numbers."""
+    for col in CATEGORICAL_COLUMNS:
+        if col in df:
+            df[col] = df[col].astype("category")
+    df = df.astype({col: dtype for col, dtype in COMPACT_DTYPES.items() if col in df})
+    if "filing_uuid" in df and pyarrow_available():
+        df["filing_uuid"] = df["filing_uuid"].astype("string[pyarrow]")
+    if "dt_posted" in df:
+        df["dt_posted"] = pd.to_datetime(df["dt_posted"])
+    return df
+
+
+def _compact_lobbying_data(train_only=True, columns=None):
+    """Load the lobbying data quarter by quarter in compact form."""
+    available = _available_columns()
+    if columns is None:
+        columns = [col for col in COMPACT_COLUMNS if col in available]
+    cat_cols = [col for col in CATEGORICAL_COLUMNS if col in columns]
+    # The categories of every quarter so far, each mapped to its code; only
+    # the codes of each quarter are kept, so its strings can be freed
+    categories = {col: {} for col in cat_cols}
+    codes = {col: [] for col in cat_cols}
+    category_dtypes = {}
+    pieces = []
+    for _, chunk in iter_lobbying_data(train_only, columns, compact=True):
+        for col in cat_cols:
+            values = chunk[col].cat
+            seen = categories[col]
+            category_dtypes[col] = values.categories.dtype
+            recode = np.array([seen.setdefault(value, len(seen)) for value in values.categories] + [-1])
+            # Missing values have code -1, the last entry of recode
+            codes[col].append(recode[values.codes.to_numpy()].astype(np.int32))
+        pieces.append(chunk.drop(columns=cat_cols))
+        order = list(chunk.columns)
+        del chunk
+    if not pieces:
+        return pd.DataFrame(columns=columns)
+    out = pd.concat(pieces, ignore_index=True)
+    del pieces
+    for col in cat_cols:
+        out[col] = pd.Categorical.from_codes(
+            np.concatenate(codes[col]), categories=pd.Index(list(categories[col]), dtype=category_dtypes[col])
+        )
+        del codes[col]
+    return out[order]
+
+
+def description_store(train_only=True):
+    """Open the memory-mapped store of lobbying descriptions, building it first
+    if the lobbying data changed since it was last built.
+    
+    Args:
+      train_only (bool, default True): Whether to only cover training data
+        (data from before 2023).
+        
+    Returns:
+      A DescriptionStore keyed by filing_uuid.
+    """
+    global lobbying_descriptions
+    sources = lobbying_sources(train_only)
+    signature = file_signature([fname for _, files in sources for fname in files])
+    path = LOBBYING_PATH / "cache" / f"descriptions-{'train' if train_only else 'all'}-{signature}"
+    if lobbying_descriptions is not None and lobbying_descriptions[0] == path:
+        cache_hit("descriptions")
+        return lobbying_descriptions[1]
+    if DescriptionStore.exists(path):
+        cache_hit("descriptions")
+    else:
+        cache_miss("descriptions")
+        writer = DescriptionWriter(path)
+        for _, chunk in iter_lobbying_data(train_only, ["filing_uuid", "lobbying_description"]):
+            writer.add(chunk["filing_uuid"], chunk["lobbying_description"])
+        writer.close()
+    lobbying_descriptions = (path, DescriptionStore(path))
+    return lobbying_descriptions[1]
+
+
+def get_description(filing_uuid, train_only=True):
+    """Get the lobbying description of a filing as a list of strings, without
+    loading the description text of every filing.
+    
+    Args:
+      filing_uuid (str): Id of the filing.
+      train_only (bool, default True): Whether the filing is in the training
+        data (data from before 2023).
+    """
+    return description_store(train_only).get(filing_uuid)
+
+
+def _load_lobbying_cache(train_only=True):
+    """Load the client names and issue codes of all filings into memory once,
+    indexed by client name and issue code."""
+    global lobbying_data, lobbying_code_index, lobbying_name_index
+    if lobbying_data is not None:
+        cache_hit("lobbying_names_codes")
+        return
+    cache_miss("lobbying_names_codes")
+    lobbying_data = get_all_lobbying_data(
+        train_only=train_only, columns=["client", "issue_codes"], compact=True
+    )
+    # Decode the issue codes once; the string column isn't needed after
+    with stage("parse_issue_codes") as s:
+        lobbying_code_index = IssueCodeIndex.from_strings(lobbying_data.pop("issue_codes"))
+        s.add(rows=len(lobbying_data))
+    with stage("index_names") as s:
+        lobbying_name_index = NameIndex.from_series(lobbying_data["client"])
+        s.add(rows=len(lobbying_data))
+
+
+def _match_names(name_index, company_name, regex, fuzzy):
+    """Find the ids of the names in name_index matching company_name."""
+    if fuzzy:
+        return name_index.fuzzy_search(company_name)["name_id"].to_numpy()
+    return name_index.search(company_name, regex=regex)
+
+
+@instrumented()
+def issue_codes_for_company(company_name, regex=True, cache=True, train_only=True,
+                            fuzzy=False):
     """Get a DataFrame counting issue codes lobbied by a client company.
     
     Names can differ in filings, so it makes sense to search broadly. By
@@ -29,37 +326,197 @@ def issue_codes_for_company(company_name, regex=True, cache=True, train_only=Tru
     Args:
       company_name (str): Name of company to search for.
       regex (bool, default True): Whether to perform a regex search.
-      cache (bool, default True): Whether to cache all lobbying data in memory.
-        This is faster, but uses about 3GB of memory.
+      cache (bool, default True): Whether to cache the client names and issue
+        codes of all filings in memory, with a client name index. This is
+        much faster for repeated searches.
       train_only (bool, default True): Whether to only get training data (data
         from before 2023).
+      fuzzy (bool, default False): Whether to match client names approximately
+        (see NameIndex.fuzzy_search) rather than by substring.
       
     Returns:
       DataFrame with columns "issue_code" and "count".
     """
-    codes_counts = defaultdict(int)
+    counts = []
     if cache:
-        global lobbying_data
-        if lobbying_data is None:
-            lobbying_data = get_all_lobbying_data(train_only=train_only)
-        df = lobbying_data[
-            lobbying_data.client.str.contains(company_name, case=False, regex=regex)
-        ]
-        for codes in df.issue_codes.apply(eval):
-            for code in codes:
-                codes_counts[code] += 1
+        _load_lobbying_cache(train_only)
+        name_ids = _match_names(lobbying_name_index, company_name, regex, fuzzy)
+        counts.append(lobbying_code_index.code_counts(lobbying_name_index.row_mask(name_ids)))
     else:
-        for fname in (LOBBYING_PATH / "by_quarter").glob("*.csv"):
-            if train_only and ("2023" in fname.name or "2024" in fname.name):
-                continue
-            df = pd.read_csv(fname)
-            df = df[df.client.str.contains(company_name, case=False, regex=regex)]
-            for codes in df.issue_codes.apply(eval):
-                for code in codes:
-                    codes_counts[code] += 1
-    return pd.DataFrame(codes_counts.items(), columns=["issue_code", "count"]).sort_values(by="issue_code")
+        for _, df in iter_lobbying_data(train_only, columns=["client", "issue_codes"]):
+            name_index = NameIndex.from_series(df.client)
+            mask = name_index.row_mask(_match_names(name_index, company_name, regex, fuzzy))
+            counts.append(IssueCodeIndex.from_strings(df.issue_codes[mask]).code_counts())
+    codes_counts = pd.concat(counts).groupby(level=0).sum() if counts else pd.Series(dtype="int64")
+    return pd.DataFrame(
+        {"issue_code": codes_counts.index, "count": codes_counts.to_numpy()}
+    ).sort_values(by="issue_code")
+
+
+@instrumented()
+def issue_codes_for_companies(company_names, regex=True, train_only=True, fuzzy=False):
+    """Count issue codes lobbied by each of many client companies.
+    
+    Uses the in-memory cache of issue_codes_for_company. Codes are counted
+    once per distinct client name, so each lookup only sums a few rows.
+    
+    Args:
+      company_names (iterable of str): Names of companies to search for.
+      regex (bool, default True): Whether to perform regex searches.
+      train_only (bool, default True): Whether to only get training data (data
+        from before 2023).
+      fuzzy (bool, default False): Whether to match client names approximately.
+      
+    Returns:
+      DataFrame with columns "company", "issue_code" and "count".
+    """
+    global lobbying_name_code_counts
+    _load_lobbying_cache(train_only)
+    vocabulary = lobbying_code_index.vocabulary
+    if lobbying_name_code_counts is None:
+        names = lobbying_name_index.codes[lobbying_code_index.row_ids()]
+        keep = names >= 0
+        lobbying_name_code_counts = np.bincount(
+            names[keep].astype(np.int64) * len(vocabulary) + lobbying_code_index.indices[keep],
+            minlength=len(lobbying_name_index) * len(vocabulary),
+        ).reshape(len(lobbying_name_index), len(vocabulary))
+        
+    matches = lobbying_name_index.search_many(company_names, regex=regex, fuzzy=fuzzy)
+    out = []
+    for company, name_ids in matches.items():
+        counts = lobbying_name_code_counts[name_ids].sum(axis=0)
+        nonzero = np.flatnonzero(counts)
+        out.append(pd.DataFrame({
+            "company": company, "issue_code": vocabulary[nonzero], "count": counts[nonzero]
+        }))
+    if not out:
+        return pd.DataFrame(columns=["company", "issue_code", "count"])
+    return pd.concat(out, ignore_index=True)
+
+
+TRANSACTION_CLASSES = ["purchase", "sale", "other"]
+STOCK_CUBE_FIELDS = ["amount", "variance", "count", "rows"]
+
+
+def _stock_quarters(train_only):
+    """Quarters covered by the stock totals tables."""
+    end_date = "2022-12-31" if train_only else "2024-03-31"
+    return pd.period_range(start=2013, end=end_date, freq="Q").to_timestamp()
+
+
+def _build_stock_cube(stocks):
+    """Aggregate cleaned trades by (Industry, Quarter, transaction class).
+    
+    Args:
+      stocks (pd.DataFrame): Cleaned stock trades.
+      
+    Returns:
+      A dict with "industries" (pd.Index), "quarters" (pd.DatetimeIndex),
+      "cube" (array of shape (industry, quarter, class, field), where the
+      classes are TRANSACTION_CLASSES and the fields are STOCK_CUBE_FIELDS)
+      and "quarter_totals" (total Mean_Trade_Size over all industries per
+      quarter, NaN for quarters without trades).
+    """
+    quarters = _stock_quarters(train_only=False)
+    quarter_ids = quarters.get_indexer(stocks["Quarter"])
+    industry_ids, industries = pd.factorize(stocks["Industry"])
+    transaction = stocks["Transaction"]
+    class_ids = np.select(
+        [transaction == "Purchase", transaction.str.startswith("Sale", na=False)], [0, 1], 2
+    )
+    amounts = stocks["Mean_Trade_Size"].to_numpy(dtype=np.float64)
+    variances = stocks["Variance"].to_numpy(dtype=np.float64)
+    
+    in_range = quarter_ids >= 0
+    total_rows = np.bincount(quarter_ids[in_range], minlength=len(quarters))
+    quarter_totals = np.bincount(
+        quarter_ids[in_range], weights=np.nan_to_num(amounts[in_range]), minlength=len(quarters)
+    )
+    quarter_totals[total_rows == 0] = np.nan
+    
+    keep = in_range & (industry_ids >= 0)
+    shape = (len(industries), len(quarters), len(TRANSACTION_CLASSES))
+    flat = np.ravel_multi_index((industry_ids[keep], quarter_ids[keep], class_ids[keep]), shape)
+    size = int(np.prod(shape))
+    cube = np.stack([
+        np.bincount(flat, weights=np.nan_to_num(amounts[keep]), minlength=size),
+        np.bincount(flat, weights=np.nan_to_num(variances[keep]), minlength=size),
+        np.bincount(flat, weights=~np.isnan(amounts[keep]), minlength=size),
+        np.bincount(flat, minlength=size).astype(np.float64),
+    ], axis=-1).reshape(shape + (len(STOCK_CUBE_FIELDS),))
+    return {
+        "industries": pd.Index(industries),
+        "quarters": quarters,
+        "cube": cube,
+        "quarter_totals": quarter_totals,
+    }
+
+
+def stock_cube():
+    """Load the cleaned trades once and aggregate them for stock_totals.
+    
+    The aggregate is memoized in memory and pickled under trading_data/cache,
+    keyed on a fingerprint of stocks_cleaned.csv.
+    
+    Returns:
+      The dict described in _build_stock_cube.
+    """
+    global stocks_cube
+    fname = TRADING_PATH / "stocks_cleaned.csv"
+    signature = file_signature([fname])
+    if stocks_cube is not None and stocks_cube["signature"] == signature:
+        cache_hit("stock_cube")
+        return stocks_cube
+    cache_file = TRADING_PATH / "cache" / f"stock_cube-{signature}.pkl"
+    if cache_file.exists():
+        cache_hit("stock_cube")
+        stocks_cube = pd.read_pickle(cache_file)
+        return stocks_cube
+    cache_miss("stock_cube")
+    with stage("read_stocks_csv") as s:
+        stocks = pd.read_csv(
+            fname, usecols=["Quarter", "Industry", "Transaction", "Mean_Trade_Size", "Variance"],
+            parse_dates=["Quarter"]
+        )
+        if enabled():
+            s.add(rows=len(stocks), bytes_read=file_sizes([fname]))
+    with stage("aggregate_stocks"):
+        stocks_cube = _build_stock_cube(stocks)
+    stocks_cube["signature"] = signature
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    pd.to_pickle(stocks_cube, cache_file)
+    return stocks_cube
+
+
+def _stock_columns(group_cube, quarter_totals, index):
+    """Form the stock_totals columns from a (quarter, class, field) array."""
+    amount, variance, count, rows = np.moveaxis(group_cube, -1, 0)
+    any_rows = rows.sum(axis=-1) > 0
+    
+    def present(values, mask, counts=False):
+        # Quarters without matching trades are missing (NaN) until the final
+        # fillna, just as in a groupby over the trades
+        if counts and mask.all():
+            return pd.Series(values.astype(np.int64), index=index)
+        return pd.Series(np.where(mask, values, np.nan), index=index)
+    
+    out = pd.DataFrame(index=index, dtype=np.float64)
+    out["stocks_purchase"] = present(amount[:, 0], rows[:, 0] > 0)
+    out["stocks_sale"] = present(amount[:, 1], rows[:, 1] > 0)
+    out["stocks_gross"] = present(amount.sum(axis=-1), any_rows)
+    out["stocks_net"] = out["stocks_purchase"] - out["stocks_sale"]
+    out["stocks_gross_frac"] = out["stocks_gross"] / quarter_totals
+    out["stocks_purchase_variance"] = present(variance[:, 0], rows[:, 0] > 0)
+    out["stocks_sale_variance"] = present(variance[:, 1], rows[:, 1] > 0)
+    out["stocks_gross_variance"] = present(variance.sum(axis=-1), any_rows)
+    out["stocks_num_purchase"] = present(count[:, 0], rows[:, 0] > 0, counts=True)
+    out["stocks_num_sale"] = present(count[:, 1], rows[:, 1] > 0, counts=True)
+    out["stocks_num"] = out["stocks_num_purchase"] + out["stocks_num_sale"]
+    out.fillna(0, inplace=True)
+    return out
 
 
+@instrumented()
 def stock_totals(stock_industries, train_only=True):
     """Form DataFrame with quarterly stock trading totals for a given set of
     industries.
@@ -67,6 +524,9 @@ def stock_totals(stock_industries, train_only=True):
     Monetary totals reported in stock data are coarse. We use the minimum reported
     trade size for every trade, and treat partial sales as equal to full sales.
     
+    Totals are summed from the cached (Industry, Quarter, transaction class)
+    aggregate (see stock_cube), so the trades are only read once.
+    
     Args:
       stock_industries (str or list of str): One or more stock industries to look up.
       train_only (bool, default True): Whether to only use training data (data
@@ -78,38 +538,72 @@ def stock_totals(stock_industries, train_only=True):
     """
     if isinstance(stock_industries, str):
         stock_industries = [stock_industries]
+    return _industry_set_totals([stock_industries], train_only)[0]
+
+
+def cognate_industries():
+    """Map each lobbying issue code to the stock industries associated with it
+    in sector2lobbyingcode.csv.
+    
+    Returns:
+      Dict from issue code to a list of industries.
+    """
+    sector2code = pd.read_csv(TRADING_PATH / "sector2lobbyingcode.csv")
+    pairs = sector2code.melt(
+        id_vars="Industry", value_vars=["Category1", "Category2", "Category3"], value_name="code"
+    ).dropna(subset=["code"])
+    return {code: list(group.Industry) for code, group in pairs.groupby("code")}
+
+
+@instrumented()
+def all_stock_totals(groups=None, train_only=True):
+    """Form quarterly stock trading totals for many sets of industries at once.
+    
+    Args:
+      groups (dict, optional): Map from a group name to a list of industries.
+        Defaults to the cognate industries of every issue code (see
+        cognate_industries).
+      train_only (bool, default True): Whether to only use training data (data
+        from before 2023).
         
-    end_date = "2022-12-31" if train_only else "2024-03-31"
-    out = pd.DataFrame(
-        index=pd.period_range(start=2013, end=end_date, freq="Q").to_timestamp(),
-        dtype=np.float64
+    Returns:
+      A DataFrame indexed by (group, quarter), with the columns of stock_totals.
+    """
+    if groups is None:
+        groups = cognate_industries()
+    return pd.concat(
+        _industry_set_totals(list(groups.values()), train_only),
+        keys=list(groups),
+        names=["group", "Quarter"],
     )
-    
-    stocks = pd.read_csv(TRADING_PATH / "stocks_cleaned.csv", parse_dates=["Traded", "Filed", "Quarter"])
-    if train_only:
-        stocks = stocks[stocks.Quarter < pd.to_datetime("2023-01-01", format="%Y-%m-%d")]
-    stock_total_trading = stocks.groupby("Quarter")["Mean_Trade_Size"].sum() #Rahul: I changed Min here to Mean
-    filtered = stocks[stocks.Industry.isin(stock_industries)]
 
-    out["stocks_purchase"] = filtered[filtered["Transaction"] == "Purchase"].groupby("Quarter").Mean_Trade_Size.sum() #Rahul: Changed Min to Mean
-    out["stocks_sale"] = filtered[filtered["Transaction"].str.startswith("Sale")].groupby("Quarter").Mean_Trade_Size.sum() #Rahul: Changed Min to Mean
-    out["stocks_gross"] = filtered.groupby("Quarter").Mean_Trade_Size.sum() #Rahul: Changed Min to Mean
-    out["stocks_net"] = out["stocks_purchase"] - out["stocks_sale"]
-    out["stocks_gross_frac"] = out["stocks_gross"] / stock_total_trading
-    out["stocks_purchase_variance"]=filtered[filtered["Transaction"] == "Purchase"].groupby("Quarter").Variance.sum() #Rahul: added purchase variance
-    out["stocks_sale_variance"]=filtered[filtered["Transaction"].str.startswith("Sale")].groupby("Quarter").Variance.sum() #Rahul: added sale variance
-    out["stocks_gross_variance"]=filtered.groupby("Quarter").Variance.sum() #Rahul: added gross variance (note this should be the same as for net)
-    out["stocks_num_purchase"] = filtered[filtered["Transaction"] == "Purchase"].groupby("Quarter").Mean_Trade_Size.count()
-    out["stocks_num_sale"]=filtered[filtered["Transaction"].str.startswith("Sale")].groupby("Quarter").Mean_Trade_Size.count()
-    out["stocks_num"]=out["stocks_num_purchase"]+out["stocks_num_sale"]
-    out.fillna(0, inplace=True)
-    return out
+
+def _industry_set_totals(industry_sets, train_only):
+    """Sum the cached stock aggregate over each of several sets of industries."""
+    cube = stock_cube()
+    quarters = _stock_quarters(train_only)
+    num_quarters = len(quarters)
+    
+    membership = np.zeros((len(industry_sets), len(cube["industries"])))
+    for i, industries in enumerate(industry_sets):
+        if isinstance(industries, str):
+            industries = [industries]
+        membership[i, cube["industries"].isin(industries)] = 1
+    set_cubes = np.einsum("si,iqcf->sqcf", membership, cube["cube"][:, :num_quarters])
+    quarter_totals = pd.Series(cube["quarter_totals"][:num_quarters], index=quarters)
+    return [_stock_columns(set_cube, quarter_totals, quarters) for set_cube in set_cubes]
 
 
+@instrumented()
 def lobbying_totals(issue_codes, train_only=True, adjust_for_num_codes=False):
     """Form DataFrame with quarterly totals for a given set of lobbying issue
     codes.
     
+    A single code is sliced out of the cached totals cube (see
+    lobbying_totals_cube). Totals over several codes aren't sums of per-code
+    totals (filings listing several of the codes count once), so they are
+    computed directly.
+    
     Args:
       issue_codes (str or list of str): One or more issue codes to look up.
       train_only (bool, default True): Whether to only use training data (data
@@ -126,26 +620,44 @@ def lobbying_totals(issue_codes, train_only=True, adjust_for_num_codes=False):
     if isinstance(issue_codes, str):
         issue_codes = [issue_codes]
         
-    single_issues = []
-    for code in issue_codes:
-        one_issue = pd.read_csv(LOBBYING_PATH / f"by_issue_code/filings_{code}.csv",
-                                parse_dates=["dt_posted", "period_start", "period_end"])
-        if train_only:
-            one_issue = one_issue[one_issue.period_start.dt.year < 2023]
-        single_issues.append(one_issue)
+    if len(issue_codes) == 1:
+        # Single codes are sliced out of the precomputed cube
+        out = lobbying_totals_cube(train_only, adjust_for_num_codes).xs(
+            issue_codes[0], level="issue_code"
+        ).reindex(_lobbying_quarters(train_only))
+        for col in ["lobbying_num_income", "lobbying_num_expenses", "lobbying_num"]:
+            if out[col].notna().all():
+                out[col] = out[col].astype("int64")
+        return out
         
-    all_issues = pd.concat(single_issues, axis=0)
-    all_issues.drop_duplicates(inplace=True)
+    if store_exists():
+        # Each filing is stored once, so there is nothing to de-duplicate
+        all_issues = read_filings(
+            columns=["period_start", "issue_codes", "income", "expenses", "spending_variance"],
+            train_only=train_only,
+            issue_codes=issue_codes,
+        )
+    else:
+        single_issues = []
+        for code in issue_codes:
+            fname = LOBBYING_PATH / f"by_issue_code/filings_{code}.csv"
+            with stage("read_issue_code_csv") as s:
+                one_issue = pd.read_csv(fname, parse_dates=["dt_posted", "period_start", "period_end"])
+                if enabled():
+                    s.add(rows=len(one_issue), bytes_read=file_sizes([fname]))
+            if train_only:
+                one_issue = one_issue[one_issue.period_start.dt.year < 2023]
+            single_issues.append(one_issue)
+            
+        all_issues = pd.concat(single_issues, axis=0)
+        all_issues.drop_duplicates(inplace=True)
     
     # optionally, normalize for number of codes
     if adjust_for_num_codes:
-        # convert issue codes column from str to list
-        all_issues["issue_codes"] = all_issues["issue_codes"].map(eval)
-        # count codes
-        all_issues["num_codes"] = all_issues["issue_codes"].map(len)
-        all_issues["num_relevant_codes"] = all_issues["issue_codes"].map(
-            lambda these_codes: len(set(these_codes).intersection(issue_codes))
-        )
+        # decode issue codes once, then count codes
+        code_index = IssueCodeIndex.from_strings(all_issues["issue_codes"])
+        all_issues["num_codes"] = code_index.num_codes()
+        all_issues["num_relevant_codes"] = code_index.num_relevant(issue_codes)
         all_issues["income"] = (all_issues["income"] 
                                 * all_issues["num_relevant_codes"]
                                 / all_issues["num_codes"])
@@ -156,23 +668,231 @@ def lobbying_totals(issue_codes, train_only=True, adjust_for_num_codes=False):
                                 * all_issues["num_relevant_codes"]
                                 / all_issues["num_codes"])
         
-    out = all_issues.groupby("period_start")[["income", "expenses"]].sum()
-    out["income_variance"]=all_issues[all_issues.income>0].groupby("period_start")["spending_variance"].sum() #Rahul: added these columns to compute sums of variances
-    out["expenses_variance"]=all_issues[all_issues.expenses>0].groupby("period_start")["spending_variance"].sum()
-    out["spending_variance"]=all_issues.groupby("period_start")["spending_variance"].sum()
-    out["num_income"]=all_issues[all_issues.income>0].groupby("period_start")["income"].count() #Rahul: added counts for numbers of filings
-    out["num_expenses"]=all_issues[all_issues.expenses>0].groupby("period_start")["expenses"].count()
-    out["num"]=out["num_income"]+out["num_expenses"]
-    # Set index to relevant quarters
+    out = _lobbying_metrics(all_issues, "period_start")
+    # Set index to relevant quarters (quarters without filings are missing, as
+    # with a single code)
+    return out.reindex(_lobbying_quarters(train_only))
+
+
+def _lobbying_quarters(train_only):
+    """Quarters covered by the lobbying totals tables."""
     end_date = "2022-12-31" if train_only else "2023-12-31" #changed from 2024-03-31
-    out.index = pd.period_range(start=2013, end=end_date, freq="Q").to_timestamp()
+    return pd.period_range(start=2013, end=end_date, freq="Q").to_timestamp()
+
+
+@instrumented("lobbying_groupby")
+def _lobbying_metrics(all_issues, keys):
+    """Sum lobbying income, expenses, variances and filing counts.
+    
+    Args:
+      all_issues (pd.DataFrame): Filings with "income", "expenses" and
+        "spending_variance" columns.
+      keys (str or list of str): Columns to group by.
+        
+    Returns:
+      A DataFrame of lobbying_* totals indexed by keys.
+    """
+    record(rows=len(all_issues))
+    out = all_issues.groupby(keys)[["income", "expenses"]].sum()
+    out["income_variance"]=all_issues[all_issues.income>0].groupby(keys)["spending_variance"].sum() #Rahul: added these columns to compute sums of variances
+    out["expenses_variance"]=all_issues[all_issues.expenses>0].groupby(keys)["spending_variance"].sum()
+    out["spending_variance"]=all_issues.groupby(keys)["spending_variance"].sum()
+    out["num_income"]=all_issues[all_issues.income>0].groupby(keys)["income"].count() #Rahul: added counts for numbers of filings
+    out["num_expenses"]=all_issues[all_issues.expenses>0].groupby(keys)["expenses"].count()
+    out["num"]=out["num_income"]+out["num_expenses"]
         
     out.rename(columns=lambda x: "lobbying_"+x, inplace=True)
         
     out["lobbying_total"] = out["lobbying_income"] + out["lobbying_expenses"]
     return out
+
+
+def file_signature(paths):
+    """Fingerprint a set of input files by name, size and modification time."""
+    digest = hashlib.sha1()
+    for path in paths:
+        stat = Path(path).stat()
+        digest.update(f"{Path(path).name}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return digest.hexdigest()[:16]
+
+
+def _cube_partitions(train_only):
+    """Map each partition of the lobbying input data to its fingerprint.
     
+    With the Parquet store, every quarter is its own partition, so changing one
+    quarter only invalidates that quarter's totals. Without it, the
+    by_issue_code files are treated as a single partition.
+    """
+    if store_exists():
+        return {
+            quarter: file_signature(files)
+            for quarter, files in list_quarters().items()
+            if not (train_only and quarter > TRAIN_END_QUARTER)
+        }
+    return {"by_issue_code": file_signature(sorted((LOBBYING_PATH / "by_issue_code").glob("*.csv")))}
+
+
+@instrumented("read_cube_partitions")
+def _read_cube_partitions(labels):
+    """Read the filings of some partitions of the lobbying input data."""
+    columns = ["period_start", "issue_codes", "income", "expenses", "spending_variance"]
+    if store_exists():
+        if enabled():
+            quarter_files = list_quarters()
+            record(bytes_read=file_sizes([fname for label in labels for fname in quarter_files[label]]))
+        filings = read_filings(columns=columns, train_only=False, quarters=labels)
+        record(rows=len(filings))
+        return filings
+    fnames = sorted((LOBBYING_PATH / "by_issue_code").glob("*.csv"))
+    all_issues = pd.concat([
+        pd.read_csv(fname, parse_dates=["dt_posted", "period_start", "period_end"])
+        for fname in fnames
+    ])
+    if enabled():
+        record(rows=len(all_issues), bytes_read=file_sizes(fnames))
+    return all_issues.drop_duplicates()[columns]
+
+
+@instrumented("code_filing_pairs")
+def _code_filing_pairs(filings, adjust_for_num_codes):
+    """Expand filings to one row per (filing, distinct issue code) pair."""
+    record(rows=len(filings))
+    code_index = IssueCodeIndex.from_strings(filings["issue_codes"])
+    width = max(len(code_index.vocabulary), 1)
+    rows, code_ids = np.divmod(np.unique(code_index.row_ids() * width + code_index.indices), width)
+    pairs = pd.DataFrame({
+        "issue_code": code_index.vocabulary[code_ids],
+        "period_start": filings["period_start"].to_numpy()[rows],
+    })
+    num_codes = code_index.num_codes()[rows]
+    for col in ["income", "expenses", "spending_variance"]:
+        values = filings[col].to_numpy()[rows]
+        pairs[col] = values / num_codes if adjust_for_num_codes else values
+    return pairs
+
+
+def _evict_cube_pieces(label, mode):
+    """Drop the cube pieces of a partition computed from earlier versions of
+    its input files, on disk and in memory."""
+    prefix = f"{label}-{mode}-"
+    for fname in TOTALS_CACHE_PATH.glob(f"{prefix}*.pkl"):
+        fname.unlink()
+    for key in [key for key in totals_cube_pieces if key.startswith(prefix)]:
+        del totals_cube_pieces[key]
+
+
+@instrumented()
+def lobbying_totals_cube(train_only=True, adjust_for_num_codes=False):
+    """Compute the quarterly lobbying totals of every issue code at once.
     
+    The cube is computed in one pass over the filings, and memoized both in
+    memory and on disk (under lobbying_data/cache/totals), keyed on a
+    fingerprint of the input files. Only partitions whose input files changed
+    are recomputed, and their superseded pieces are removed.
+    
+    Args:
+      train_only (bool, default True): Whether to only use training data (data
+        from before 2023).
+      adjust_for_num_codes (bool, default False): If True, lobbying income or
+        expenses of $D over a list of C codes will only count as $D/C spent per
+        code.
+        
+    Returns:
+      A DataFrame indexed by (issue_code, period_start) with the same lobbying_*
+      columns as lobbying_totals.
+    """
+    mode = "adjusted" if adjust_for_num_codes else "raw"
+    pieces = {}
+    missing = []
+    for label, signature in _cube_partitions(train_only).items():
+        key = f"{label}-{mode}-{signature}"
+        if key not in totals_cube_pieces and (TOTALS_CACHE_PATH / f"{key}.pkl").exists():
+            totals_cube_pieces[key] = pd.read_pickle(TOTALS_CACHE_PATH / f"{key}.pkl")
+        if key in totals_cube_pieces:
+            cache_hit("totals_cube")
+            pieces[label] = totals_cube_pieces[key]
+        else:
+            cache_miss("totals_cube")
+            missing.append((label, key))
+            
+    if missing:
+        filings = _read_cube_partitions([label for label, _ in missing])
+        cube = _lobbying_metrics(
+            _code_filing_pairs(filings, adjust_for_num_codes), ["issue_code", "period_start"]
+        )
+        starts = cube.index.get_level_values("period_start")
+        TOTALS_CACHE_PATH.mkdir(parents=True, exist_ok=True)
+        for label, key in missing:
+            if label == "by_issue_code":
+                piece = cube
+            else:
+                piece = cube[starts == pd.Period(label, freq="Q").start_time]
+            _evict_cube_pieces(label, mode)
+            piece.to_pickle(TOTALS_CACHE_PATH / f"{key}.pkl")
+            totals_cube_pieces[key] = pieces[label] = piece
+            
+    cube = pd.concat([pieces[label] for label in sorted(pieces)]).sort_index()
+    if train_only:
+        cube = cube[cube.index.get_level_values("period_start").year < 2023]
+    return cube
+
+
+def invalidate_lobbying_caches(quarters, lobbying_path=None):
+    """Drop the cached results that depend on some quarters of lobbying data,
+    on disk and in memory. Results for other quarters are kept.
+    
+    Args:
+      quarters (list of str): Quarter labels whose data changed, e.g. "2024Q1".
+      lobbying_path (str or pathlike, optional): Lobbying data directory whose
+        cache files are removed. Defaults to LOBBYING_PATH.
+        
+    Returns:
+      List of the cache files removed.
+    """
+    global lobbying_data, lobbying_code_index, lobbying_name_index
+    global lobbying_name_code_counts, lobbying_descriptions
+    # Cube pieces are per quarter with the store, and a single by_issue_code
+    # piece without it
+    labels = set(quarters) | {"by_issue_code"}
+    lobbying_path = LOBBYING_PATH if lobbying_path is None else Path(lobbying_path)
+    totals_path = lobbying_path / TOTALS_CACHE_PATH.relative_to(LOBBYING_PATH)
+    removed = [
+        fname for fname in totals_path.glob("*.pkl")
+        if fname.name.split("-", 1)[0] in labels
+    ]
+    for key in list(totals_cube_pieces):
+        if key.split("-", 1)[0] in labels:
+            del totals_cube_pieces[key]
+    # The description side files cover every quarter
+    removed += list((lobbying_path / "cache").glob("descriptions-*"))
+    for fname in removed:
+        fname.unlink()
+    lobbying_data = lobbying_code_index = lobbying_name_index = None
+    lobbying_name_code_counts = lobbying_descriptions = None
+    return removed
+
+
+@instrumented()
+def all_lobbying_totals(train_only=True, adjust_for_num_codes=False):
+    """Form the wide table of quarterly lobbying totals for every issue code.
+    
+    Args:
+      train_only (bool, default True): Whether to only use training data (data
+        from before 2023).
+      adjust_for_num_codes (bool, default False): See lobbying_totals.
+        
+    Returns:
+      A DataFrame indexed by quarter, with columns "{code}_lobbying_income",
+      "{code}_lobbying_expenses", etc. for every code.
+    """
+    cube = lobbying_totals_cube(train_only, adjust_for_num_codes)
+    wide = cube.unstack(level="issue_code").reindex(_lobbying_quarters(train_only))
+    wide = wide.swaplevel(axis=1).sort_index(axis=1, level=0, sort_remaining=False)
+    wide.columns = [f"{code}_{col}" for code, col in wide.columns]
+    return wide
+    
+    
+@instrumented()
 def stock_and_lobbying_totals(issue_codes, stock_industries, train_only=True,
                               adjust_for_num_codes=False):
     """Form DataFrame with quarterly totals for a given set of issue codes and
@@ -198,9 +918,10 @@ def stock_and_lobbying_totals(issue_codes, stock_industries, train_only=True,
     """
     lobbying_df = lobbying_totals(issue_codes, train_only, adjust_for_num_codes)
     stock_df = stock_totals(stock_industries, train_only)
-    return lobbying_df.merge(
-        stock_df, how="outer", left_index=True, right_index=True
-    ).fillna(0)
+    with stage("merge_totals"):
+        return lobbying_df.merge(
+            stock_df, how="outer", left_index=True, right_index=True
+        ).fillna(0)
 
 
 def print_lobbying_summary(row):
@@ -212,11 +933,18 @@ def print_lobbying_summary(row):
     print(row["period_start"].date())
     print("Registrant: ", row["registrant"])
     print("Client: ", row["client"])
-    print("Issue codes lobbied: ", ", ".join(eval(row["issue_codes"])))
+    print("Issue codes lobbied: ", ", ".join(parse_code_list(row["issue_codes"])))
     if row["income"] > 0:
         print("Income: ", row["income"])
     elif row["expenses"] > 0:
         print("Expenses: ", row["expenses"])
     else:
         print("No income or expenses")
-    print("\n\n".join(eval(row["lobbying_description"])))
+    if "lobbying_description" in row:
+        descriptions = row["lobbying_description"]
+    else:
+        # Compact frames leave the description text on disk
+        descriptions = get_description(row["filing_uuid"])
+    if isinstance(descriptions, str):
+        descriptions = ast.literal_eval(descriptions)
+    print("\n\n".join(descriptions))
@@ -0,0 +1,98 @@
+"""Memory-mapped side file for the lobbying description text.
+
+The lobbying_description column holds most of the bytes of the lobbying tables
+but is only needed when reading individual filings. The compact load mode of
+``scripts.data_extraction`` keeps it out of memory; the text is written once to
+a side file and looked up lazily by filing id.
+
+A store at ``path`` consists of three files:
+  path.bin: the UTF-8 encoded descriptions, concatenated.
+  path.ids.npy: the filing ids, sorted.
+  path.spans.npy: (start, end) byte offsets into path.bin, aligned with the
+    sorted ids.
+"""
+import ast
+from pathlib import Path
+
+import numpy as np
+
+
+def _paths(path):
+    path = Path(path)
+    return (path.with_name(path.name + ".bin"),
+            path.with_name(path.name + ".ids.npy"),
+            path.with_name(path.name + ".spans.npy"))
+
+
+class DescriptionWriter:
+    """Accumulate descriptions chunk by chunk, then write a DescriptionStore."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._data_path = _paths(self.path)[0].with_suffix(".bin.tmp")
+        self._data = open(self._data_path, "wb")
+        self._ids = []
+        self._lengths = []
+
+    def add(self, filing_ids, descriptions):
+        """Append a chunk of filing ids and their (stringified) descriptions."""
+        for filing_id, description in zip(filing_ids, descriptions):
+            encoded = str(description).encode("utf-8")
+            self._data.write(encoded)
+            self._ids.append(filing_id)
+            self._lengths.append(len(encoded))
+
+    def close(self):
+        """Sort the ids, write the index files and open the finished store."""
+        self._data.close()
+        data_path, ids_path, spans_path = _paths(self.path)
+        ids = np.array(self._ids, dtype="S")
+        ends = np.cumsum(np.asarray(self._lengths, dtype=np.int64))
+        spans = np.stack([ends - np.asarray(self._lengths, dtype=np.int64), ends], axis=1)
+        order = np.argsort(ids, kind="stable")
+        np.save(ids_path, ids[order])
+        np.save(spans_path, spans[order])
+        self._data_path.replace(data_path)
+        return DescriptionStore(self.path)
+
+
+class DescriptionStore:
+    """Read-only, memory-mapped lookup of descriptions by filing id."""
+
+    def __init__(self, path):
+        data_path, ids_path, spans_path = _paths(path)
+        self._ids = np.load(ids_path, mmap_mode="r")
+        self._spans = np.load(spans_path, mmap_mode="r")
+        size = data_path.stat().st_size
+        self._data = np.memmap(data_path, dtype=np.uint8, mode="r") if size else np.empty(0, np.uint8)
+
+    @staticmethod
+    def exists(path):
+        """Whether a finished store exists at path."""
+        return all(p.exists() for p in _paths(path))
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, filing_id):
+        return self._position(filing_id) is not None
+
+    def _position(self, filing_id):
+        key = str(filing_id).encode("utf-8")
+        i = int(np.searchsorted(self._ids, key))
+        if i < len(self._ids) and self._ids[i] == key:
+            return i
+        return None
+
+    def get_raw(self, filing_id):
+        """Get the stored (stringified) description of a filing."""
+        i = self._position(filing_id)
+        if i is None:
+            raise KeyError(filing_id)
+        start, end = self._spans[i]
+        return bytes(self._data[start:end]).decode("utf-8")
+
+    def get(self, filing_id):
+        """Get the description of a filing as a list of strings."""
+        return ast.literal_eval(self.get_raw(filing_id))
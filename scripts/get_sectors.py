@@ -1,8 +1,19 @@
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
 import pandas as pd
 import yfinance as yf
 from tqdm import tqdm
 from preprocess_stocks import preprocess_stock_data
 
+CACHE_PATH = Path("../trading_data/cache/yf_info.json")
+CACHE_TTL = 30 * 24 * 3600  # seconds
+NOT_FOUND = "Not Found"
+
 
 def query_yf(ticker_symbol, keys):
     """Try to extract keys from Yahoo Finance information on ticker symbol.
@@ -30,14 +41,143 @@ def query_yf(ticker_symbol, keys):
             results.append(info[key])
     return results
 
+
+def yahoo_info(ticker_symbol):
+    """Fetch the Yahoo Finance information dict of a ticker symbol."""
+    return yf.Ticker(ticker_symbol).info
+
+
+class RateLimiter:
+    """Space out calls from any number of threads to at most rate per second."""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        time.sleep(start - now)
+
+
+def load_cache(cache_path=None):
+    """Load the ticker cache: symbol -> {"fetched": timestamp, "info": {...}}."""
+    cache_path = CACHE_PATH if cache_path is None else Path(cache_path)
+    if not cache_path.exists():
+        return {}
+    with open(cache_path) as f:
+        return json.load(f)
+
+
+def save_cache(cache, cache_path=None):
+    """Write the ticker cache (atomically)."""
+    cache_path = CACHE_PATH if cache_path is None else Path(cache_path)
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_name(cache_path.name + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(cache, f, indent=1, sort_keys=True, default=str)
+    tmp_path.replace(cache_path)
+
+
+def _fetch_with_retries(fetch, ticker_symbol, limiter, retries, backoff):
+    """Call fetch(ticker_symbol), retrying with exponential backoff."""
+    for attempt in range(retries + 1):
+        limiter.wait()
+        try:
+            return fetch(ticker_symbol)
+        except Exception:
+            if attempt == retries:
+                raise
+            time.sleep(backoff * 2**attempt * (1 + random.random()))
+
+
+def resolve_symbols(ticker_symbols, keys, fetch=yahoo_info, cache_path=None, ttl=CACHE_TTL,
+                    max_workers=8, rate=4, retries=3, backoff=1.0, progress=True):
+    """Look up keys of the information on many ticker symbols concurrently.
+
+    Results are cached on disk by ticker symbol, so only symbols that are new,
+    or whose cache entry is older than ttl or lacks one of keys, are fetched.
+    The cache is saved as results come in, so an interrupted run keeps what it
+    fetched. When a lookup still fails after the retries, the stale cache
+    entry is used if there is one (and kept as is, so it's refetched next
+    time); otherwise the lookup gives "Not Found" and isn't cached.
+
+    Args:
+      ticker_symbols (iterable of str): Ticker symbols to look up.
+      keys (str or list of str): Key or list of keys to obtain.
+      fetch (callable, default yahoo_info): Function from a ticker symbol to
+        its information dict. Pass a stub to work offline.
+      cache_path (str or pathlike, optional): Defaults to CACHE_PATH.
+      ttl (float, default CACHE_TTL): Maximum age of cache entries, in seconds.
+      max_workers (int, default 8): Number of worker threads.
+      rate (float, default 4): Maximum number of fetches per second.
+      retries (int, default 3): Number of retries of a failed fetch.
+      backoff (float, default 1.0): Initial wait between retries, in seconds;
+        doubled on every retry.
+      progress (bool, default True): Whether to show a progress bar.
+
+    Returns:
+      Dict from ticker symbol to a list of results, of the same length as that
+      of keys.
+    """
+    if isinstance(keys, str):
+        keys = [keys]
+    cache = load_cache(cache_path)
+    now = time.time()
+    symbols = list(dict.fromkeys(ticker_symbols))
+    stale = [
+        symbol for symbol in symbols
+        if symbol not in cache
+        or now - cache[symbol]["fetched"] > ttl
+        or any(key not in cache[symbol]["info"] for key in keys)
+    ]
+
+    results = {}
+    limiter = RateLimiter(rate)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(_fetch_with_retries, fetch, symbol, limiter, retries, backoff): symbol
+            for symbol in stale
+        }
+        done = as_completed(futures)
+        if progress:
+            done = tqdm(done, total=len(futures))
+        for i, future in enumerate(done):
+            symbol = futures[future]
+            try:
+                info = future.result()
+            except Exception as e:
+                cached_info = cache.get(symbol, {}).get("info")
+                if cached_info is None:
+                    print(f"{symbol}: {e}")
+                    results[symbol] = [NOT_FOUND for _ in keys]
+                else:
+                    print(f"{symbol}: {e} (using the cached information)")
+                    results[symbol] = [cached_info.get(key, NOT_FOUND) for key in keys]
+                continue
+            cached_info = cache.get(symbol, {}).get("info", {})
+            cache[symbol] = {
+                "fetched": now,
+                "info": {**cached_info, **{key: info.get(key, NOT_FOUND) for key in keys}},
+            }
+            if (i + 1) % 50 == 0:
+                save_cache(cache, cache_path)
+    if stale:
+        save_cache(cache, cache_path)
+
+    for symbol in symbols:
+        if symbol not in results:
+            results[symbol] = [cache[symbol]["info"][key] for key in keys]
+    return results
+
+
 if __name__ == "__main__":
     stocks = pd.read_excel("../trading_data/congress-trading-all.xlsx")
     stocks = preprocess_stock_data(stocks)
-    symbol2sector = {}
-    for ticker_symbol in tqdm(stocks.Ticker.unique(), total=len(stocks.Ticker.unique())):
-        symbol2sector[ticker_symbol] = query_yf(
-            ticker_symbol, ["sector", "industry", "quoteType"]
-        )
+    symbol2sector = resolve_symbols(stocks.Ticker.unique(), ["sector", "industry", "quoteType"])
     sectors_df = pd.DataFrame.from_dict(
         symbol2sector, orient="index", columns=["Sector", "Industry", "YFQuoteType"]
     )
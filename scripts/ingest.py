@@ -0,0 +1,224 @@
+"""Incremental refresh of the lobbying data layouts from filings_all.csv.
+
+split_filings rewrites every by_quarter and by_issue_code file. A refresh
+usually only brings in a new quarter or a few amendments, so this records a
+watermark per quarter in lobbying_data/watermarks.json: the number of filings,
+the latest dt_posted and a hash of the quarter's rows (before amendments are
+resolved). On the next run only the quarters whose hash changed are rewritten,
+together with the issue-code files listing filings of those quarters, the
+matching partitions of the Parquet store and the cached results depending on
+them. Amendments are resolved per quarter as in split_filings, and the files
+are byte-identical to the ones split_filings writes from the same source.
+
+Run it from the repository root with
+
+    python -m scripts.ingest
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+
+import pandas as pd
+
+from scripts.data_extraction import invalidate_lobbying_caches
+from scripts.lobbying_store import STORE_PATH, build_store, store_exists
+from scripts.split_filings import (
+    CHUNKSIZE, SOURCE_PATH, issue_code_file, ordered_map, partition_header, prepare_chunk,
+    quarter_file, read_chunks, read_text, render_issue_codes, render_quarters, resolve_quarter_file,
+    write_rendered,
+)
+
+LOBBYING_PATH = Path("lobbying_data")
+WATERMARKS_PATH = LOBBYING_PATH / "watermarks.json"
+
+
+def load_watermarks(path=None):
+    """Load the per-quarter watermarks, or {} before the first ingestion."""
+    path = WATERMARKS_PATH if path is None else Path(path)
+    if not path.exists():
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_watermarks(watermarks, path=None):
+    """Write the per-quarter watermarks (atomically)."""
+    path = WATERMARKS_PATH if path is None else Path(path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(watermarks, f, indent=1, sort_keys=True)
+    tmp_path.replace(path)
+
+
+def _quarter_chunk(chunk):
+    """Render the quarters of a chunk and the latest dt_posted of each."""
+    chunk, quarters = prepare_chunk(chunk)
+    rendered = render_quarters(chunk, quarters)
+    latest = chunk["dt_posted"].groupby(quarters).max()
+    return {
+        fname: (rows, text, latest[fname.stem[8:]])
+        for fname, (rows, text) in rendered.items()
+    }
+
+
+def spool_quarters(source, spool_path, chunksize=CHUNKSIZE, max_workers=None):
+    """Write the by_quarter files of source under spool_path and compute their
+    watermarks, in one streaming pass.
+
+    Returns:
+      Dict from quarter label to its watermark: {"rows": ..., "dt_posted": ...,
+      "sha1": ...}.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    (spool_path / "by_quarter").mkdir(parents=True)
+    header = partition_header(source)
+    handles, digests, watermarks = {}, {}, {}
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            chunks = read_chunks(source, chunksize)
+            for rendered in ordered_map(pool, _quarter_chunk, chunks, 2 * max_workers):
+                for fname, (rows, text, latest) in rendered.items():
+                    quarter = fname.stem[8:]
+                    if fname not in handles:
+                        handles[fname] = open(spool_path / fname, "w", newline="")
+                        handles[fname].write(header)
+                        digests[quarter] = hashlib.sha1(header.encode())
+                        watermarks[quarter] = {"rows": 0, "dt_posted": latest}
+                    handles[fname].write(text)
+                    digests[quarter].update(text.encode())
+                    watermarks[quarter]["rows"] += rows
+                    watermarks[quarter]["dt_posted"] = max(watermarks[quarter]["dt_posted"], latest)
+    finally:
+        for handle in handles.values():
+            handle.close()
+    for quarter, digest in digests.items():
+        watermarks[quarter]["sha1"] = digest.hexdigest()
+    return watermarks
+
+
+def resolve_quarter(lobbying_path, spool_path, quarter):
+    """Resolve the amendments of a spooled by_quarter file in place, and render
+    the by_issue_code rows of its filings, reading each version of the quarter
+    once (module level so that it can be sent to a process pool).
+
+    Returns:
+      (rendered, codes): render_issue_codes of the resolved filings, and the
+      set of issue codes whose rows differ from those of the by_quarter file
+      under lobbying_path.
+    """
+    rendered = render_issue_codes(resolve_quarter_file(spool_path / quarter_file(quarter)))
+    old_fname = lobbying_path / quarter_file(quarter)
+    old_rendered = render_issue_codes(read_text(old_fname)) if old_fname.exists() else {}
+    return rendered, {
+        fname.stem[8:] for fname in rendered.keys() | old_rendered.keys()
+        if rendered.get(fname) != old_rendered.get(fname)
+    }
+
+
+def update_issue_code_file(code, quarters, lobbying_path, spool_path):
+    """Rewrite the rows of some quarters in one by_issue_code file.
+
+    Args:
+      code (str): Issue code.
+      quarters (list of str): Quarters whose rows are replaced; rows of other
+        quarters are kept from the existing file.
+      lobbying_path (Path): Lobbying data directory.
+      spool_path (Path): Directory with the by_issue_code rows of those
+        quarters, in quarter order, as written by ingest.
+    """
+    fname = lobbying_path / issue_code_file(code)
+    starts = {str(pd.Period(quarter, freq="Q").start_time.date()) for quarter in quarters}
+    pieces = []
+    if fname.exists():
+        existing = read_text(fname)
+        pieces.append(existing[~existing["period_start"].isin(starts)])
+    if (spool_path / issue_code_file(code)).exists():
+        pieces.append(read_text(spool_path / issue_code_file(code)))
+    updated = pd.concat(pieces, ignore_index=True) if pieces else pd.DataFrame()
+    if updated.empty:
+        fname.unlink(missing_ok=True)
+        return
+    # Rows in quarter order, and in the order of their quarter file within
+    # each quarter, as split_filings writes them
+    updated = updated.sort_values("period_start", kind="stable")
+    tmp_fname = fname.with_name(fname.name + ".tmp")
+    updated.to_csv(tmp_fname, index=False)
+    tmp_fname.replace(fname)
+
+
+def ingest(source=None, lobbying_path=None, chunksize=CHUNKSIZE, max_workers=None):
+    """Bring the lobbying data layouts up to date with the source.
+
+    Quarters missing from the source are left as they are.
+
+    Args:
+      source (str or pathlike, optional): Defaults to SOURCE_PATH.
+      lobbying_path (str or pathlike, optional): Lobbying data directory.
+        Defaults to LOBBYING_PATH.
+      chunksize (int, default CHUNKSIZE): Rows per chunk.
+      max_workers (int, optional): Size of the process pool.
+
+    Returns:
+      Dict with the sorted lists of changed "quarters", updated "issue_codes"
+      and "removed_cache_files".
+    """
+    source = SOURCE_PATH if source is None else Path(source)
+    lobbying_path = LOBBYING_PATH if lobbying_path is None else Path(lobbying_path)
+    max_workers = max_workers or os.cpu_count() or 1
+    watermarks_path = lobbying_path / WATERMARKS_PATH.name
+    spool_path = lobbying_path / ".ingest.tmp"
+    shutil.rmtree(spool_path, ignore_errors=True)
+
+    old_watermarks = load_watermarks(watermarks_path)
+    new_watermarks = spool_quarters(source, spool_path, chunksize, max_workers)
+    changed = sorted(
+        quarter for quarter, watermark in new_watermarks.items()
+        if old_watermarks.get(quarter, {}).get("sha1") != watermark["sha1"]
+        or not (lobbying_path / quarter_file(quarter)).exists()
+    )
+
+    # The changed quarters are resolved and their issue-code rows spooled,
+    # quarter after quarter
+    codes = set()
+    (spool_path / "by_issue_code").mkdir()
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        resolved = ordered_map(
+            pool, partial(resolve_quarter, lobbying_path, spool_path), changed, 2 * max_workers
+        )
+
+        def issue_code_pieces():
+            for rendered, affected in resolved:
+                codes.update(affected)
+                yield rendered
+
+        write_rendered(spool_path, partition_header(source), issue_code_pieces())
+
+    (lobbying_path / "by_quarter").mkdir(parents=True, exist_ok=True)
+    (lobbying_path / "by_issue_code").mkdir(parents=True, exist_ok=True)
+    for quarter in changed:
+        (spool_path / quarter_file(quarter)).replace(lobbying_path / quarter_file(quarter))
+    for code in sorted(codes):
+        update_issue_code_file(code, changed, lobbying_path, spool_path)
+    shutil.rmtree(spool_path)
+
+    store_path = lobbying_path / STORE_PATH.name
+    if changed and store_exists(store_path):
+        build_store(lobbying_path, store_path, quarters=changed)
+    removed = invalidate_lobbying_caches(changed, lobbying_path) if changed else []
+    save_watermarks({**old_watermarks, **new_watermarks}, watermarks_path)
+    return {"quarters": changed, "issue_codes": sorted(codes), "removed_cache_files": removed}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--source", default=SOURCE_PATH)
+    parser.add_argument("--chunksize", type=int, default=CHUNKSIZE)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    result = ingest(args.source, chunksize=args.chunksize, max_workers=args.workers)
+    print(f"Updated {len(result['quarters'])} quarters and {len(result['issue_codes'])} issue codes")
@@ -0,0 +1,296 @@
+"""Opt-in instrumentation of the data and modeling scripts.
+
+Functions in data_extraction, preprocess_stocks and model_evaluation mark their
+stages (reading CSV files, parsing issue codes, groupbys, merges, model fits,
+...) with instrumented or stage, report the rows and bytes they read with
+record, and count cache hits and misses with cache_hit and cache_miss. All of
+these do nothing unless recording is on, so they cost a single check when it
+is off.
+
+Recording is switched on either for a block of code,
+
+    with instrument("report.json"):
+        stock_and_lobbying_totals("DEF", "Aerospace & Defense")
+
+or for a whole run by setting the LOBBYING_INSTRUMENT environment variable: to
+a .json path to write the report there at exit, or to 1 for REPORT_PATH.
+
+The report holds per-stage totals (calls, wall time, rows, bytes read and the
+peak RSS of the process when the stage ended) and cache counts, which can be
+compared between runs with compare_reports, and every stage as a trace event
+that chrome://tracing or Perfetto can display. Stages running in worker
+processes aren't recorded.
+"""
+import atexit
+import functools
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+ENV_VAR = "LOBBYING_INSTRUMENT"
+REPORT_PATH = Path("instrumentation.json")
+# The active Recorder, or None when recording is off
+_recorder = None
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MB (None where the
+    resource module isn't available, e.g. on Windows)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in kilobytes elsewhere
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+class Stage:
+    """A timed stage, used as a context manager. Stages nest per thread."""
+
+    __slots__ = ("recorder", "name", "rows", "bytes_read", "start")
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+        self.rows = 0
+        self.bytes_read = 0
+
+    def add(self, rows=0, bytes_read=0):
+        self.rows += rows
+        self.bytes_read += bytes_read
+
+    def __enter__(self):
+        self.recorder.stack().append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        end = time.perf_counter()
+        self.recorder.stack().pop()
+        self.recorder.finish(self, end)
+        return False
+
+
+class _NullStage:
+    """Stand-in for Stage when recording is off."""
+
+    def add(self, rows=0, bytes_read=0):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_STAGE = _NullStage()
+
+
+class Recorder:
+    """Collects the stages and cache counts of one recording."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.caches = {}
+        self.events = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def stack(self):
+        """Open stages of the calling thread, innermost last."""
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def finish(self, stage, end):
+        rss = peak_rss_mb()
+        with self._lock:
+            totals = self.stages.setdefault(
+                stage.name, {"calls": 0, "seconds": 0.0, "rows": 0, "bytes_read": 0, "peak_rss_mb": rss}
+            )
+            totals["calls"] += 1
+            totals["seconds"] += end - stage.start
+            totals["rows"] += stage.rows
+            totals["bytes_read"] += stage.bytes_read
+            if rss is not None:
+                totals["peak_rss_mb"] = max(totals["peak_rss_mb"], rss)
+            self.events.append({
+                "name": stage.name, "ph": "X", "pid": os.getpid(), "tid": threading.get_ident(),
+                "ts": (stage.start - self.start) * 1e6, "dur": (end - stage.start) * 1e6,
+                "args": {"rows": stage.rows, "bytes_read": stage.bytes_read, "peak_rss_mb": rss},
+            })
+
+    def count(self, name, hit):
+        with self._lock:
+            counts = self.caches.setdefault(name, {"hits": 0, "misses": 0})
+            counts["hits" if hit else "misses"] += 1
+
+    def report(self):
+        """The recording as a dict, in the Chrome trace event format (the
+        summary is carried in extra keys, which trace viewers ignore)."""
+        with self._lock:
+            return {
+                "wall_seconds": time.perf_counter() - self.start,
+                "peak_rss_mb": peak_rss_mb(),
+                "stages": {name: dict(totals) for name, totals in sorted(self.stages.items())},
+                "caches": {name: dict(counts) for name, counts in sorted(self.caches.items())},
+                "traceEvents": list(self.events),
+                "displayTimeUnit": "ms",
+            }
+
+    def write(self, path):
+        """Write the report as JSON (atomically)."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.report(), f, indent=1)
+        tmp_path.replace(path)
+
+
+def enabled():
+    """Whether recording is on."""
+    return _recorder is not None
+
+
+def stage(name):
+    """Context manager timing a stage of work, e.g.
+
+        with stage("groupby") as s:
+            ...
+            s.add(rows=len(df))
+    """
+    if _recorder is None:
+        return NULL_STAGE
+    return Stage(_recorder, name)
+
+
+def instrumented(name=None):
+    """Decorator recording every call of a function as a stage (named after
+    the function by default)."""
+    def decorator(func):
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _recorder is None:
+                return func(*args, **kwargs)
+            with Stage(_recorder, label):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record(rows=0, bytes_read=0):
+    """Add rows processed and bytes read to the innermost open stage of the
+    calling thread."""
+    if _recorder is None:
+        return
+    stack = _recorder.stack()
+    if stack:
+        stack[-1].add(rows, bytes_read)
+
+
+def file_sizes(paths):
+    """Total size of some files in bytes, for record(bytes_read=...). Only
+    worth calling when enabled()."""
+    return sum(Path(path).stat().st_size for path in paths)
+
+
+def cache_hit(name):
+    """Count a hit of the named cache."""
+    if _recorder is not None:
+        _recorder.count(name, True)
+
+
+def cache_miss(name):
+    """Count a miss of the named cache."""
+    if _recorder is not None:
+        _recorder.count(name, False)
+
+
+class instrument:
+    """Context manager switching recording on for a block of code.
+
+    Args:
+      path (str or pathlike, optional): Where to write the report on exit.
+
+    The Recorder is returned by __enter__, so its report() can be read
+    directly.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.recorder = Recorder()
+
+    def __enter__(self):
+        global _recorder
+        self.previous = _recorder
+        _recorder = self.recorder
+        return self.recorder
+
+    def __exit__(self, *exc_info):
+        global _recorder
+        _recorder = self.previous
+        if self.path is not None:
+            self.recorder.write(self.path)
+        return False
+
+
+def compare_reports(old, new):
+    """Compare the stage totals of two reports.
+
+    Args:
+      old, new (dict or str or pathlike): Reports, or paths of report files.
+
+    Returns:
+      DataFrame indexed by stage with the old and new seconds, calls, rows
+      and bytes read, and the ratio of seconds.
+    """
+    frames = []
+    for report in [old, new]:
+        if not isinstance(report, dict):
+            with open(report) as f:
+                report = json.load(f)
+        frames.append(pd.DataFrame.from_dict(report["stages"], orient="index"))
+    columns = ["seconds", "calls", "rows", "bytes_read"]
+    out = frames[0][columns].join(frames[1][columns], how="outer", lsuffix="_old", rsuffix="_new")
+    out["seconds_ratio"] = out["seconds_new"] / out["seconds_old"]
+    return out.sort_values("seconds_new", ascending=False)
+
+
+def _write_at_exit(recorder, path):
+    # Worker processes inherit the environment; only the main process reports
+    if multiprocessing.parent_process() is None:
+        recorder.write(path)
+
+
+def _enable_from_environment():
+    global _recorder
+    value = os.environ.get(ENV_VAR, "")
+    if value.lower() in ("", "0", "false", "no"):
+        return
+    _recorder = Recorder()
+    atexit.register(_write_at_exit, _recorder, Path(value) if value.endswith(".json") else REPORT_PATH)
+
+
+_enable_from_environment()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        raise SystemExit("usage: python -m scripts.instrumentation OLD_REPORT NEW_REPORT")
+    with pd.option_context("display.width", 200, "display.max_columns", None):
+        print(compare_reports(sys.argv[1], sys.argv[2]).round(4).to_string())
@@ -0,0 +1,139 @@
+"""Compact index of the issue codes listed on each lobbying filing.
+
+The lobbying tables store the codes of each filing as a stringified list, e.g.
+"['AGR', 'FOO']". Rather than running eval on every row, the codes are decoded
+once into an integer vocabulary and a CSR (compressed sparse row) array, so that
+per-filing and per-code counts are plain NumPy operations.
+"""
+import re
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+
+CODE_PATTERN = re.compile(r"'([^']*)'")
+
+
+def parse_code_list(codes):
+    """Parse a single stringified list of codes, e.g. "['AGR', 'FOO']".
+
+    Args:
+      codes (str or list of str): Stringified list (or an already parsed list).
+
+    Returns:
+      List of codes.
+    """
+    if isinstance(codes, str):
+        return CODE_PATTERN.findall(codes)
+    return list(codes)
+
+
+class IssueCodeIndex:
+    """Issue codes of a sequence of filings in CSR form.
+
+    Attributes:
+      vocabulary (np.ndarray of str): Sorted distinct codes. Code ids index into
+        this array.
+      indptr (np.ndarray of int64): The code ids of filing i are
+        indices[indptr[i]:indptr[i + 1]].
+      indices (np.ndarray of int16): Code ids, in the order listed on each
+        filing.
+    """
+
+    def __init__(self, vocabulary, indptr, indices):
+        self.vocabulary = vocabulary
+        self.indptr = indptr
+        self.indices = indices
+        self._code_to_id = {code: i for i, code in enumerate(vocabulary)}
+
+    @classmethod
+    def from_strings(cls, issue_codes):
+        """Build the index from a column of stringified code lists.
+
+        Args:
+          issue_codes (pd.Series or sequence): Stringified lists of codes, as
+            stored in the lobbying tables. Already parsed lists also work.
+
+        Returns:
+          An IssueCodeIndex with one row per element of issue_codes.
+        """
+        issue_codes = pd.Series(issue_codes, copy=False)
+        if isinstance(issue_codes.dtype, pd.CategoricalDtype):
+            # Decode each distinct list once, then expand to the rows
+            categories = cls.from_strings(issue_codes.cat.categories.to_series())
+            return categories.take(issue_codes.cat.codes.to_numpy())
+        if len(issue_codes) and not isinstance(issue_codes.iloc[0], str):
+            num_listed = issue_codes.map(len).to_numpy(dtype=np.int64)
+            flat = list(chain.from_iterable(issue_codes))
+        else:
+            # One regex pass over all rows at once; each code is wrapped in a
+            # pair of quotes, so the quote count gives the codes per row
+            num_listed = (issue_codes.str.count("'") // 2).to_numpy(dtype=np.int64)
+            flat = CODE_PATTERN.findall("\n".join(issue_codes))
+        vocabulary, code_ids = np.unique(np.asarray(flat, dtype=str), return_inverse=True)
+        indptr = np.zeros(len(num_listed) + 1, dtype=np.int64)
+        np.cumsum(num_listed, out=indptr[1:])
+        return cls(vocabulary, indptr, code_ids.reshape(-1).astype(np.int16))
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def take(self, rows):
+        """Get the index of a selection of the rows (in the given order)."""
+        rows = np.asarray(rows, dtype=np.int64)
+        lengths = np.diff(self.indptr)[rows]
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        # Position of every entry within its new row, shifted to the old row
+        positions = np.arange(indptr[-1]) + np.repeat(self.indptr[rows] - indptr[:-1], lengths)
+        return IssueCodeIndex(self.vocabulary, indptr, self.indices[positions])
+
+    def code_ids(self, codes):
+        """Get the ids of codes, skipping codes that never occur."""
+        if isinstance(codes, str):
+            codes = [codes]
+        return np.array(
+            [self._code_to_id[code] for code in set(codes) if code in self._code_to_id],
+            dtype=np.int16,
+        )
+
+    def row_ids(self):
+        """Get the filing (row) number of each entry of indices."""
+        return np.repeat(np.arange(len(self), dtype=np.int64), np.diff(self.indptr))
+
+    def codes_of(self, i):
+        """Get the codes listed on filing i."""
+        return self.vocabulary[self.indices[self.indptr[i]:self.indptr[i + 1]]].tolist()
+
+    def num_codes(self):
+        """Number of codes listed on each filing."""
+        return np.diff(self.indptr)
+
+    def num_relevant(self, codes):
+        """Number of distinct codes of each filing that are among codes."""
+        hits = np.isin(self.indices, self.code_ids(codes))
+        width = max(len(self.vocabulary), 1)
+        # A code listed twice on one filing only counts once
+        keys = np.unique(self.row_ids()[hits] * width + self.indices[hits])
+        return np.bincount(keys // width, minlength=len(self))
+
+    def contains_any(self, codes):
+        """Boolean mask of the filings listing at least one of codes."""
+        return self.num_relevant(codes) > 0
+
+    def code_counts(self, mask=None):
+        """Count how many times each code is listed.
+
+        Args:
+          mask (np.ndarray of bool, optional): Only count these filings.
+
+        Returns:
+          A Series of counts indexed by code, restricted to codes with a
+          positive count.
+        """
+        indices = self.indices
+        if mask is not None:
+            indices = indices[np.repeat(np.asarray(mask, dtype=bool), np.diff(self.indptr))]
+        counts = np.bincount(indices, minlength=len(self.vocabulary))
+        counts = pd.Series(counts, index=self.vocabulary, name="count")
+        return counts[counts > 0]
@@ -0,0 +1,171 @@
+"""Cleaning steps for the LDA filings, vectorized over whole tables.
+
+These are the scripts-level versions of the per-row helpers in
+1_Preliminary_cleaning.ipynb (filing_period, update_filings etc.).
+"""
+import numpy as np
+import pandas as pd
+
+# Quarterly report types, e.g. for the second quarter "Q2", "Q2Y", "2T" and
+# "2TY", and their amendments "2A", "2AY", "2@" and "2@Y". The suffixes are in
+# the order update_filings looks at them.
+FILING_SUFFIXES = ["", "Y", "T", "TY"]
+AMENDMENT_SUFFIXES = ["A", "AY", "@", "@Y"]
+
+
+def _filing_type_name(quarter, suffix):
+    """Filing type as reported, e.g. (2, "") -> "Q2", (2, "T") -> "2T"."""
+    if suffix in ("", "Y"):
+        return f"Q{quarter}{suffix}"
+    return f"{quarter}{suffix}"
+
+
+# Lookup table from filing type to the quarter it covers, the position of its
+# suffix in FILING_SUFFIXES, and whether it is an amendment
+FILING_TYPES = pd.DataFrame(
+    [
+        (_filing_type_name(quarter, suffixes[i]), quarter, i, amended)
+        for quarter in range(1, 5)
+        for amended, suffixes in ((False, FILING_SUFFIXES), (True, AMENDMENT_SUFFIXES))
+        for i in range(len(suffixes))
+    ],
+    columns=["filing_type", "quarter", "suffix", "amended"],
+).set_index("filing_type")
+
+# Amounts on LDA reports are rounded to the nearest $10,000, so the rounding
+# error is uniform on a $10,000 interval. Amounts under $5,000 are reported as
+# a placeholder of 1, with the true amount uniform on [0, 5000).
+ROUNDING_VARIANCE = 10000**2 / 12
+PLACEHOLDER_VARIANCE = 5000**2 / 12
+
+
+def filing_quarter_numbers(filing_types):
+    """Get the quarter (1-4) a report covers from its filing type.
+
+    Filing types that aren't quarterly reports or their amendments (see
+    FILING_TYPES) get 0.
+
+    Args:
+      filing_types (pd.Series of str): Filing types, e.g. filings["filing_type"].
+
+    Returns:
+      Series of ints.
+    """
+    return filing_types.map(FILING_TYPES["quarter"]).fillna(0).astype(np.int64)
+
+
+def filing_quarters(filings):
+    """Get the quarter label (e.g. "2013Q1") of each filing.
+
+    The year is taken from the "filing_year" column, or from "period_start"
+    if the filings were already assigned to quarters.
+
+    Args:
+      filings (pd.DataFrame): Filings with a "filing_type" column and either
+        "filing_year" or "period_start".
+
+    Returns:
+      Series of quarter labels, with NaN for filings that aren't quarterly
+      reports.
+    """
+    if "filing_year" in filings:
+        years = pd.to_numeric(filings["filing_year"], errors="coerce")
+        quarters = filing_quarter_numbers(filings["filing_type"])
+    elif "period_start" in filings:
+        starts = pd.to_datetime(filings["period_start"], errors="coerce")
+        years = starts.dt.year
+        quarters = starts.dt.quarter
+    else:
+        raise ValueError("Filings need a filing_year or period_start column.")
+    years = years.astype("Int64")
+    quarters = quarters.astype("Int64").fillna(0)
+    labels = years.astype(str) + "Q" + quarters.astype(str)
+    return labels.where(years.notna() & (quarters > 0))
+
+
+def period_bounds(quarters):
+    """Get the first and last day of each quarter label as ISO date strings.
+
+    Args:
+      quarters (pd.Series of str): Quarter labels, e.g. "2013Q1".
+
+    Returns:
+      (period_start, period_end) Series.
+    """
+    # Only the distinct quarters are converted, then mapped back to the rows
+    distinct = pd.PeriodIndex(quarters.dropna().unique(), freq="Q")
+    starts = dict(zip(distinct.astype(str), distinct.start_time.strftime("%Y-%m-%d")))
+    ends = dict(zip(distinct.astype(str), distinct.end_time.strftime("%Y-%m-%d")))
+    return quarters.map(starts), quarters.map(ends)
+
+
+def spending_variance(filings):
+    """Get the variance of the true spending of each filing.
+
+    Reported spending is income plus expenses, one of which is 0. Its
+    variance comes from the rounding model above: PLACEHOLDER_VARIANCE for
+    the placeholder amount 1, and ROUNDING_VARIANCE otherwise. If the filings
+    already have a spending_variance column, its values are kept where
+    present.
+
+    Args:
+      filings (pd.DataFrame): Filings with "income" and "expenses" columns.
+
+    Returns:
+      Series of floats.
+    """
+    income = pd.to_numeric(filings["income"], errors="coerce").fillna(0)
+    expenses = pd.to_numeric(filings["expenses"], errors="coerce").fillna(0)
+    variance = pd.Series(
+        np.where(income + expenses == 1, PLACEHOLDER_VARIANCE, ROUNDING_VARIANCE),
+        index=filings.index,
+    )
+    if "spending_variance" in filings:
+        source = pd.to_numeric(filings["spending_variance"], errors="coerce")
+        variance = source.fillna(variance)
+    return variance
+
+
+def resolve_amendments(filings):
+    """Keep one filing per registrant, client and quarter, applying amendments.
+
+    Vectorized version of update_filings from 1_Preliminary_cleaning.ipynb,
+    for any number of quarters at once. For each registrant and client in a
+    quarter, only the last filing of each type counts. Each report type
+    (suffix) is replaced by its amendment if there is one, and then:
+      - amendments without a report of their own type win, the one with the
+        earliest suffix first;
+      - otherwise the (amended) report with the earliest suffix is kept.
+
+    Args:
+      filings (pd.DataFrame): Filings with "filing_type", "reg_id", "cl_id"
+        and "dt_posted" columns, and "filing_year" if they span several
+        years. Filing types other than quarterly reports are dropped.
+
+    Returns:
+      DataFrame of the resolved filings, sorted by dt_posted.
+    """
+    types = FILING_TYPES.reindex(filings["filing_type"].to_numpy())
+    df = filings.assign(
+        _quarter=types["quarter"].to_numpy(),
+        _suffix=types["suffix"].to_numpy(),
+        _amended=types["amended"].to_numpy(),
+    )
+    df = df[df["_quarter"].notna()]
+    keys = [col for col in ["filing_year"] if col in df] + ["_quarter", "reg_id", "cl_id"]
+    df = df.drop_duplicates(subset=keys + ["_suffix", "_amended"], keep="last")
+
+    amended = df["_amended"].astype(bool)
+    by_suffix = amended.groupby([df[col] for col in keys + ["_suffix"]])
+    has_report = ~by_suffix.transform("min").astype(bool)
+    has_amendment = by_suffix.transform("max").astype(bool)
+    # The amendment replaces the report of its own type
+    candidates = df[amended | ~has_amendment].assign(
+        _priority=np.where((amended & ~has_report)[amended | ~has_amendment], 0, 1)
+    )
+    resolved = (
+        candidates.sort_values(["_priority", "_suffix"], kind="stable")
+        .drop_duplicates(subset=keys, keep="first")
+        .sort_values("dt_posted", kind="stable")
+    )
+    return resolved.drop(columns=["_quarter", "_suffix", "_amended", "_priority"]).reset_index(drop=True)
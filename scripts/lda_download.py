@@ -0,0 +1,259 @@
+"""Download LDA filings from the Senate lobbying disclosure API.
+
+This is the download loop of 0_Getting_the_data.ipynb as a resumable command.
+The pages of a year are fetched concurrently over one pooled HTTP session, with
+retries (honoring Retry-After on 429s). Every finished page is written as its
+own gzipped NDJSON part, so an interrupted download resumes with the missing
+pages only. Pages are requested in dt_posted order (ties broken by
+filing_uuid), so filings posted in the meantime don't shift the pages already
+downloaded. Once all pages are in, the parts are joined in page order into a
+single LDA_data/Filings_{year}/filings_{year}.ndjson.gz (gzip members can be
+concatenated as they are).
+
+The API key is read from the LDA_API_KEY environment variable, and the API
+location from LDA_API_URL (defaults to the public API). Run it with
+
+    python -m scripts.lda_download 2023 2024
+"""
+import argparse
+import gzip
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+LDA_URL = os.environ.get("LDA_API_URL", "https://lda.senate.gov/api/v1/")
+DOWNLOAD_PATH = Path("LDA_data")
+PAGE_SIZE = 25
+# Filings posted later come last, so new filings only change the last pages;
+# filing_uuid makes the order of filings posted at the same time stable
+ORDERING = "dt_posted,filing_uuid"
+
+
+def make_session(concurrency=8, retries=5, backoff=1.0, api_key=None):
+    """Create an HTTP session with a connection pool and retries.
+
+    Args:
+      concurrency (int, default 8): Size of the connection pool.
+      retries (int, default 5): Number of retries of failed requests.
+      backoff (float, default 1.0): Backoff factor between retries, in seconds.
+      api_key (str, optional): Defaults to the LDA_API_KEY environment
+        variable. Requests are anonymous (and more rate limited) without one.
+    """
+    session = requests.Session()
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    api_key = os.environ.get("LDA_API_KEY") if api_key is None else api_key
+    if api_key:
+        session.headers["Authorization"] = f"Token {api_key}"
+    return session
+
+
+def get_page(session, year, page, base_url=None, timeout=60):
+    """Fetch one page of the filings of a year.
+
+    Returns:
+      The decoded response, with "count" and "results" keys.
+    """
+    base_url = LDA_URL if base_url is None else base_url
+    params = {
+        "filing_year": str(year), "ordering": ORDERING, "page": str(page), "page_size": str(PAGE_SIZE),
+    }
+    response = session.get(base_url.rstrip("/") + "/filings/", params=params, timeout=timeout)
+    response.raise_for_status()
+    return response.json()
+
+
+def _write_part(path, results):
+    """Write one page of results as a gzipped NDJSON file (atomically)."""
+    tmp_path = path.with_name(path.name + ".tmp")
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        for record in results:
+            f.write(json.dumps(record) + "\n")
+    tmp_path.replace(path)
+
+
+def _read_part(path):
+    """Lines of a part, one JSON record per line."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return f.read().splitlines()
+
+
+def _page_signature(results):
+    """First and last filing (uuid and posting time) of a page of results."""
+    return [(record["filing_uuid"], record["dt_posted"]) for record in results[:1] + results[-1:]]
+
+
+def _first_changed_page(parts, num_pages, fetch_page):
+    """Find the first downloaded page whose filings changed on the server.
+
+    Filings are only added or removed (an amended filing is replaced by one
+    posted later), which shifts every later page, so pages are compared by
+    their first and last filings, and the changed pages are those from some
+    page on. Nothing changed if the last part is unchanged; otherwise the first
+    changed page is found by bisection.
+
+    Args:
+      parts (dict): Map from page number to the path of its part.
+      num_pages (int): Current number of pages.
+      fetch_page (callable): Function from a page number to its results.
+
+    Returns:
+      The first changed page, or None if all parts are unchanged.
+    """
+    def unchanged(page):
+        stored = [json.loads(line) for line in _read_part(parts[page])]
+        return page <= num_pages and _page_signature(stored) == _page_signature(fetch_page(page))
+
+    pages = sorted(parts)
+    if not pages or unchanged(pages[-1]):
+        return None
+    lo, hi = 0, len(pages) - 1
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if unchanged(pages[mid]):
+            lo = mid + 1
+        else:
+            hi = mid
+    return pages[lo]
+
+
+def year_path(year, download_path=None):
+    """Path of the downloaded filings of a year."""
+    download_path = DOWNLOAD_PATH if download_path is None else Path(download_path)
+    return download_path / f"Filings_{year}" / f"filings_{year}.ndjson.gz"
+
+
+def download_year(year, download_path=None, base_url=None, concurrency=8, session=None,
+                  progress=True):
+    """Download all filings of a year, resuming an interrupted download.
+
+    Progress is checkpointed in a parts directory next to the output: a
+    checkpoint.json with the filing count, and one part per finished page.
+    The parts are checked against the server by their first and last filings
+    (even if the filing count is the same, as a filing may have been replaced),
+    and the pages from the first one that changed on are fetched again, while
+    the earlier ones are kept.
+
+    Args:
+      year (int): Filing year.
+      download_path (str or pathlike, optional): Defaults to DOWNLOAD_PATH.
+      base_url (str, optional): API location. Defaults to LDA_URL.
+      concurrency (int, default 8): Number of pages fetched at once.
+      session (requests.Session, optional): Defaults to make_session().
+      progress (bool, default True): Whether to print progress.
+
+    Returns:
+      Path of the gzipped NDJSON file with all filings of the year.
+    """
+    out_path = year_path(year, download_path)
+    parts_path = out_path.with_name(f"filings_{year}.parts")
+    parts_path.mkdir(parents=True, exist_ok=True)
+    session = make_session(concurrency) if session is None else session
+
+    def part(page):
+        return parts_path / f"p{page:05d}.ndjson.gz"
+
+    first = get_page(session, year, 1, base_url)
+    count = first["count"]
+    num_pages = max(-(-count // PAGE_SIZE), 1)
+    # Pages fetched while checking the parts, written once they're checked
+    fetched = {1: first["results"]}
+
+    def fetch_page(page):
+        if page not in fetched:
+            fetched[page] = get_page(session, year, page, base_url)["results"]
+        return fetched[page]
+
+    checkpoint_path = parts_path / "checkpoint.json"
+    if checkpoint_path.exists():
+        with open(checkpoint_path) as f:
+            checkpoint = json.load(f)
+        if checkpoint.get("ordering") != ORDERING:
+            # Parts from before pages were ordered
+            shutil.rmtree(parts_path)
+            parts_path.mkdir(parents=True)
+        else:
+            parts = {int(fname.name[1:6]): fname for fname in parts_path.glob("p*.ndjson.gz")}
+            changed = _first_changed_page(parts, num_pages, fetch_page)
+            if changed is not None:
+                if progress:
+                    print(f"{year}: filings changed since the last run ({checkpoint['count']} then, "
+                          f"{count} now), fetching again from page {changed}")
+                for page, fname in parts.items():
+                    if page >= changed:
+                        fname.unlink()
+    with open(checkpoint_path, "w") as f:
+        json.dump({"year": year, "count": count, "pages": num_pages, "ordering": ORDERING}, f)
+
+    for page, results in fetched.items():
+        if not part(page).exists():
+            _write_part(part(page), results)
+    missing = [page for page in range(2, num_pages + 1) if not part(page).exists()]
+    if progress:
+        print(f"{year}: {count} filings, {num_pages} pages, {len(missing)} to fetch")
+
+    # Keep every page that comes in, so that a rerun only fetches the failed ones
+    failed = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = {pool.submit(get_page, session, year, page, base_url): page for page in missing}
+        for i, future in enumerate(as_completed(futures)):
+            if future.exception() is not None:
+                failed[futures[future]] = future.exception()
+                continue
+            _write_part(part(futures[future]), future.result()["results"])
+            if progress and (i + 1) % 100 == 0:
+                print(f"{year}: {i + 1}/{len(missing)} pages")
+    if failed:
+        raise RuntimeError(
+            f"{year}: failed to fetch pages {sorted(failed)}; rerun to resume the download"
+        ) from failed[min(failed)]
+
+    tmp_path = out_path.with_name(out_path.name + ".tmp")
+    with open(tmp_path, "wb") as out:
+        for page in range(1, num_pages + 1):
+            with open(part(page), "rb") as f:
+                shutil.copyfileobj(f, out)
+    tmp_path.replace(out_path)
+    shutil.rmtree(parts_path)
+    return out_path
+
+
+def read_year(year, download_path=None, filing_types=None):
+    """Load the downloaded filings of a year into a DataFrame in one read.
+
+    Args:
+      year (int): Filing year.
+      download_path (str or pathlike, optional): Defaults to DOWNLOAD_PATH.
+      filing_types (list of str, optional): Only keep these filing types.
+    """
+    filings = pd.read_json(year_path(year, download_path), lines=True, compression="gzip")
+    if filing_types is not None:
+        filings = filings[filings["filing_type"].isin(filing_types)]
+    return filings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("years", type=int, nargs="+")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--base-url", default=None)
+    args = parser.parse_args()
+    session = make_session(args.concurrency)
+    for year in args.years:
+        path = download_year(year, base_url=args.base_url, concurrency=args.concurrency, session=session)
+        print(f"Wrote {path}")
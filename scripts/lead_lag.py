@@ -0,0 +1,220 @@
+"""Screen every lobbying issue code against every stock industry for lead-lag
+relationships.
+
+Rather than looking at stock_and_lobbying_totals one pair at a time, the
+quarterly lobbying totals of all codes and the stock totals of all industries
+are put into two matrices, and the lagged cross-correlations and Granger
+causality F tests of all pairs are computed with batched least squares. The
+p-values are corrected for multiple testing across all pairs and lags with the
+Benjamini-Hochberg procedure.
+"""
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from scripts.data_extraction import TRADING_PATH, all_lobbying_totals, all_stock_totals, cognate_industries
+
+
+def lobbying_matrix(column="lobbying_total", train_only=True, adjust_for_num_codes=False):
+    """Get one lobbying total for every issue code.
+
+    Args:
+      column (str, default "lobbying_total"): Column of lobbying_totals to use.
+      train_only (bool, default True): Whether to only use training data (data
+        from before 2023).
+      adjust_for_num_codes (bool, default False): See lobbying_totals.
+
+    Returns:
+      DataFrame indexed by quarter with one column per issue code.
+    """
+    wide = all_lobbying_totals(train_only, adjust_for_num_codes)
+    suffix = f"_{column}"
+    matrix = wide[[col for col in wide.columns if col.endswith(suffix)]]
+    return matrix.rename(columns=lambda col: col[:-len(suffix)]).fillna(0)
+
+
+def stock_matrix(column="stocks_gross", industries=None, train_only=True):
+    """Get one stock trading total for every industry.
+
+    Args:
+      column (str, default "stocks_gross"): Column of stock_totals to use.
+      industries (list of str, optional): Defaults to every industry in
+        sector2lobbyingcode.csv.
+      train_only (bool, default True): Whether to only use training data (data
+        from before 2023).
+
+    Returns:
+      DataFrame indexed by quarter with one column per industry.
+    """
+    if industries is None:
+        industries = sorted(pd.read_csv(TRADING_PATH / "sector2lobbyingcode.csv")["Industry"].unique())
+    totals = all_stock_totals({industry: [industry] for industry in industries}, train_only)
+    return totals[column].unstack(level="group")[list(industries)]
+
+
+def prepare(matrix, log=True, difference=True):
+    """Transform totals before testing: log1p to tame the heavy tails, and
+    differencing to remove trends, which would otherwise make unrelated
+    series look correlated."""
+    if log:
+        matrix = np.log1p(matrix.clip(lower=0))
+    if difference:
+        matrix = matrix.diff().iloc[1:]
+    return matrix
+
+
+def _standardize(A):
+    """Center and scale the columns of A (constant columns become NaN)."""
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (A - A.mean(axis=0)) / A.std(axis=0)
+
+
+def cross_correlations(X, Y, max_lag=4):
+    """Correlation of every column of X, lagged, with every column of Y.
+
+    Args:
+      X (np.ndarray): (time, a) matrix of the leading series.
+      Y (np.ndarray): (time, b) matrix of the following series.
+      max_lag (int, default 4): Largest lag.
+
+    Returns:
+      (max_lag + 1, a, b) array: entry [l, i, j] is the correlation of
+      X[t - l, i] with Y[t, j].
+    """
+    T = X.shape[0]
+    out = np.empty((max_lag + 1, X.shape[1], Y.shape[1]))
+    for lag in range(max_lag + 1):
+        Xl = _standardize(X[:T - lag])
+        Yl = _standardize(Y[lag:])
+        out[lag] = Xl.T @ Yl / (T - lag)
+    return out
+
+
+def correlation_pvalues(r, n):
+    """Two-sided p-values of correlations r over n observations."""
+    with np.errstate(invalid="ignore", divide="ignore"):
+        t = r * np.sqrt((n - 2) / (1 - r**2))
+    return 2 * stats.t.sf(np.abs(t), n - 2)
+
+
+def _lags(A, p):
+    """(time - p, columns, p) array of the lags 1..p of each column of A."""
+    T = A.shape[0]
+    return np.stack([A[p - k:T - k] for k in range(1, p + 1)], axis=-1)
+
+
+def granger_tests(X, Y, max_lag=4):
+    """Granger causality F tests of every column of X for every column of Y.
+
+    For each lag order p, the restricted model regresses y_t on a constant and
+    y_{t-1..t-p}, and the unrestricted one adds x_{t-1..t-p}. The restricted
+    fit is shared by all x, and the extra explained sum of squares of each x
+    comes from regressing the restricted residuals on the residualized lags of
+    x (Frisch-Waugh-Lovell), batched over all pairs.
+
+    Args:
+      X (np.ndarray): (time, a) matrix of the candidate causes.
+      Y (np.ndarray): (time, b) matrix of the responses.
+      max_lag (int, default 4): Largest lag order.
+
+    Returns:
+      (F, pvalues), each a (max_lag, a, b) array; index p - 1 holds the tests
+      of lag order p.
+    """
+    T = X.shape[0]
+    F = np.full((max_lag, X.shape[1], Y.shape[1]), np.nan)
+    for p in range(1, max_lag + 1):
+        n = T - p
+        dof = n - 2 * p - 1
+        if dof <= 0:
+            break
+        # Restricted design for every y: (b, n, p + 1)
+        Z = np.concatenate([np.ones((Y.shape[1], n, 1)), _lags(Y, p).transpose(1, 0, 2)], axis=2)
+        # Residual maker M = I - Z Z^+ for every y: (b, n, n)
+        M = np.eye(n) - Z @ np.linalg.pinv(Z)
+        y_resid = np.einsum("bst,tb->bs", M, Y[p:])
+        rss_restricted = (y_resid**2).sum(axis=1)
+        # Residualized lags of every x, for every y: (b, n, a, p)
+        x_resid = np.einsum("bst,tap->bsap", M, _lags(X, p))
+        gram = np.einsum("bsap,bsaq->bapq", x_resid, x_resid)
+        moment = np.einsum("bsap,bs->bap", x_resid, y_resid)
+        coef = np.einsum("bapq,baq->bap", np.linalg.pinv(gram), moment)
+        explained = np.einsum("bap,bap->ba", coef, moment)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            F[p - 1] = ((explained / p) / ((rss_restricted[:, None] - explained) / dof)).T
+    dofs = np.array([T - 3 * p - 1 for p in range(1, max_lag + 1)])[:, None, None]
+    pvalues = stats.f.sf(F, np.arange(1, max_lag + 1)[:, None, None], np.maximum(dofs, 1))
+    return F, pvalues
+
+
+def benjamini_hochberg(pvalues):
+    """Benjamini-Hochberg adjusted p-values (q-values), ignoring NaNs."""
+    pvalues = np.asarray(pvalues, dtype=np.float64)
+    qvalues = np.full(pvalues.shape, np.nan)
+    valid = ~np.isnan(pvalues)
+    p = pvalues[valid]
+    order = np.argsort(p)
+    ranked = p[order] * len(p) / np.arange(1, len(p) + 1)
+    # Enforce monotonicity from the largest p-value down
+    ranked = np.minimum.accumulate(ranked[::-1])[::-1]
+    q = np.empty_like(p)
+    q[order] = np.minimum(ranked, 1)
+    qvalues[valid] = q
+    return qvalues
+
+
+def lead_lag_screen(max_lag=4, lobbying_column="lobbying_total", stock_column="stocks_gross",
+                    log=True, difference=True, train_only=True, adjust_for_num_codes=False):
+    """Test whether lobbying on each issue code leads trading in each industry.
+
+    Args:
+      max_lag (int, default 4): Largest lag (in quarters) to test.
+      lobbying_column (str, default "lobbying_total"): Column of
+        lobbying_totals to use.
+      stock_column (str, default "stocks_gross"): Column of stock_totals to
+        use.
+      log (bool, default True): Whether to test log1p of the totals.
+      difference (bool, default True): Whether to test quarter-on-quarter
+        changes.
+      train_only (bool, default True): Whether to only use training data (data
+        from before 2023).
+      adjust_for_num_codes (bool, default False): See lobbying_totals.
+
+    Returns:
+      DataFrame with one row per (issue_code, industry, lag), with the lagged
+      correlation ("ccf", its "ccf_pvalue" and "ccf_qvalue"), the Granger test
+      of that lag order ("granger_F", "granger_pvalue" and "granger_qvalue";
+      NaN at lag 0), and whether the industry is associated with the code in
+      sector2lobbyingcode.csv ("cognate"). Sorted by granger_qvalue.
+    """
+    lobbying = lobbying_matrix(lobbying_column, train_only, adjust_for_num_codes)
+    stocks = stock_matrix(stock_column, train_only=train_only)
+    # Only quarters with both lobbying and trading data
+    quarters = lobbying.index.intersection(stocks.index)
+    X = prepare(lobbying.loc[quarters], log, difference).to_numpy(dtype=np.float64)
+    Y = prepare(stocks.loc[quarters], log, difference).to_numpy(dtype=np.float64)
+
+    ccf = cross_correlations(X, Y, max_lag)
+    num_obs = (X.shape[0] - np.arange(max_lag + 1))[:, None, None]
+    ccf_pvalues = correlation_pvalues(ccf, num_obs)
+    F, granger_pvalues = granger_tests(X, Y, max_lag)
+    F = np.concatenate([np.full((1,) + F.shape[1:], np.nan), F])
+    granger_pvalues = np.concatenate([np.full((1,) + F.shape[1:], np.nan), granger_pvalues])
+
+    lags, codes, industries = np.meshgrid(
+        np.arange(max_lag + 1), lobbying.columns, stocks.columns, indexing="ij"
+    )
+    cognate = {(code, industry) for code, group in cognate_industries().items() for industry in group}
+    out = pd.DataFrame({
+        "issue_code": codes.ravel(),
+        "industry": industries.ravel(),
+        "lag": lags.ravel(),
+        "ccf": ccf.ravel(),
+        "ccf_pvalue": ccf_pvalues.ravel(),
+        "ccf_qvalue": benjamini_hochberg(ccf_pvalues.ravel()),
+        "granger_F": F.ravel(),
+        "granger_pvalue": granger_pvalues.ravel(),
+        "granger_qvalue": benjamini_hochberg(granger_pvalues.ravel()),
+    })
+    out["cognate"] = [pair in cognate for pair in zip(out["issue_code"], out["industry"])]
+    return out.sort_values(["granger_qvalue", "ccf_qvalue"], kind="stable").reset_index(drop=True)
@@ -0,0 +1,234 @@
+"""Partitioned Parquet store for the lobbying filings.
+
+The CSV layouts in ``lobbying_data/by_quarter`` and ``lobbying_data/by_issue_code``
+hold the same filings twice, and every read re-parses text and dates. The store
+holds each filing once, partitioned by quarter (``quarter=2013Q1``, ...), with
+a typed period_start and an ``issue_code_set`` membership column of the form
+``",AGR,FOO,"`` so that issue-code filters can be pushed down to the reader.
+
+Build it once from the repository root with
+
+    python -m scripts.lobbying_store
+
+and ``scripts.data_extraction`` will use it automatically.
+"""
+import shutil
+from pathlib import Path
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+LOBBYING_PATH = Path("lobbying_data")
+STORE_PATH = LOBBYING_PATH / "store"
+PARTITION_KEY = "quarter"
+TRAIN_END_QUARTER = "2022Q4"
+# Read with the same dtypes in every quarter, whatever values a quarter holds
+# (ids are nullable, as a few filings lack them)
+LOBBYING_DTYPES = {
+    "income": "float64", "expenses": "float64", "spending_variance": "float64",
+    "reg_id": "Int64", "cl_id": "Int64",
+}
+
+
+def quarter_of_file(fname):
+    """Get the quarter label (e.g. "2013Q1") of a by_quarter CSV file."""
+    return Path(fname).stem[8:]
+
+
+def pyarrow_available():
+    """Whether pyarrow could be imported."""
+    return pa is not None
+
+
+def store_exists(store_path=None):
+    """Whether the Parquet store has been built (and pyarrow is available)."""
+    store_path = STORE_PATH if store_path is None else Path(store_path)
+    return pa is not None and store_path.is_dir() and any(store_path.glob(f"{PARTITION_KEY}=*"))
+
+
+def _issue_code_set(issue_codes):
+    """Convert stringified lists of codes to ",CODE1,CODE2," membership strings."""
+    return "," + issue_codes.str.findall(r"'([^']*)'").str.join(",") + ","
+
+
+def _variance_lookup(lobbying_path):
+    """Map filing_uuid to spending_variance using the by_issue_code files."""
+    pieces = []
+    for fname in sorted((lobbying_path / "by_issue_code").glob("*.csv")):
+        pieces.append(pd.read_csv(fname, usecols=["filing_uuid", "spending_variance"]))
+    if not pieces:
+        return pd.Series(dtype="float64")
+    lookup = pd.concat(pieces).drop_duplicates(subset="filing_uuid")
+    return lookup.set_index("filing_uuid")["spending_variance"]
+
+
+def prepare_quarter(df, quarter, variance_lookup=None):
+    """Attach the derived columns stored alongside a quarter of filings.
+
+    Args:
+      df (pd.DataFrame): Filings for one quarter, as read from by_quarter.
+      quarter (str): Quarter label, e.g. "2013Q1".
+      variance_lookup (pd.Series, optional): filing_uuid -> spending_variance,
+        used when the quarter file doesn't carry spending_variance itself.
+
+    Returns:
+      The DataFrame with period_start, period_end and issue_code_set columns.
+      dt_posted and period_end are kept as the strings of the CSV files, as
+      the CSV readers return them.
+    """
+    period = pd.Period(quarter, freq="Q")
+    df["period_start"] = period.start_time
+    if "period_end" not in df:
+        df["period_end"] = str(period.end_time.date())
+    if "spending_variance" not in df and variance_lookup is not None:
+        df["spending_variance"] = df["filing_uuid"].map(variance_lookup).fillna(0)
+    df["issue_code_set"] = _issue_code_set(df["issue_codes"])
+    return df
+
+
+def write_quarter(df, quarter, store_path=None):
+    """Replace a single quarter partition of the store with df."""
+    store_path = STORE_PATH if store_path is None else Path(store_path)
+    part_dir = store_path / f"{PARTITION_KEY}={quarter}"
+    tmp_dir = store_path / f".{PARTITION_KEY}={quarter}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    pq.write_table(table, tmp_dir / "part-0.parquet", compression="zstd")
+    shutil.rmtree(part_dir, ignore_errors=True)
+    tmp_dir.rename(part_dir)
+
+
+def build_store(lobbying_path=None, store_path=None, quarters=None):
+    """Build (or rebuild) the Parquet store from the by_quarter CSV files.
+
+    Args:
+      lobbying_path (str or pathlike, optional): Lobbying data directory.
+        Defaults to LOBBYING_PATH.
+      store_path (str or pathlike, optional): Where to write the store.
+        Defaults to STORE_PATH.
+      quarters (list of str, optional): Only rebuild these quarters.
+
+    Returns:
+      List of the quarters written.
+    """
+    if pa is None:
+        raise ImportError("Building the lobbying store requires pyarrow.")
+    lobbying_path = LOBBYING_PATH if lobbying_path is None else Path(lobbying_path)
+    store_path = STORE_PATH if store_path is None else Path(store_path)
+
+    variance_lookup = None
+    written = []
+    for fname in sorted((lobbying_path / "by_quarter").glob("*.csv")):
+        quarter = quarter_of_file(fname)
+        if quarters is not None and quarter not in quarters:
+            continue
+        df = pd.read_csv(fname, dtype=LOBBYING_DTYPES)
+        if "spending_variance" not in df and variance_lookup is None:
+            variance_lookup = _variance_lookup(lobbying_path)
+        write_quarter(prepare_quarter(df, quarter, variance_lookup), quarter, store_path)
+        written.append(quarter)
+    return written
+
+
+def _quarter_label(date):
+    return str(pd.Period(date, freq="Q"))
+
+
+def filing_filter(train_only=True, start=None, end=None, issue_codes=None,
+                  quarters=None):
+    """Build a pyarrow filter expression for the store.
+
+    Args:
+      train_only (bool, default True): Only keep quarters before 2023.
+      start, end (date-like, optional): Only keep quarters overlapping
+        [start, end].
+      issue_codes (str or list of str, optional): Only keep filings listing at
+        least one of these codes.
+      quarters (list of str, optional): Only keep these quarters.
+
+    Returns:
+      A pyarrow.compute.Expression, or None if nothing is filtered.
+    """
+    conditions = []
+    if quarters is not None:
+        conditions.append(pc.field(PARTITION_KEY).isin(list(quarters)))
+    if train_only:
+        conditions.append(pc.field(PARTITION_KEY) <= TRAIN_END_QUARTER)
+    if start is not None:
+        conditions.append(pc.field(PARTITION_KEY) >= _quarter_label(start))
+    if end is not None:
+        conditions.append(pc.field(PARTITION_KEY) <= _quarter_label(end))
+    if issue_codes is not None:
+        if isinstance(issue_codes, str):
+            issue_codes = [issue_codes]
+        code_condition = None
+        for code in issue_codes:
+            this_code = pc.match_substring(pc.field("issue_code_set"), f",{code},")
+            code_condition = this_code if code_condition is None else code_condition | this_code
+        conditions.append(code_condition if code_condition is not None else pc.scalar(False))
+    filt = None
+    for condition in conditions:
+        filt = condition if filt is None else filt & condition
+    return filt
+
+
+def open_store(store_path=None):
+    """Open the store as a pyarrow dataset."""
+    store_path = STORE_PATH if store_path is None else Path(store_path)
+    partitioning = ds.partitioning(pa.schema([(PARTITION_KEY, pa.string())]), flavor="hive")
+    return ds.dataset(store_path, format="parquet", partitioning=partitioning)
+
+
+def list_quarters(store_path=None):
+    """Map each quarter in the store to its Parquet files."""
+    store_path = STORE_PATH if store_path is None else Path(store_path)
+    return {
+        part_dir.name.split("=", 1)[1]: sorted(part_dir.glob("*.parquet"))
+        for part_dir in sorted(store_path.glob(f"{PARTITION_KEY}=*"))
+    }
+
+
+def read_filings(columns=None, train_only=True, start=None, end=None,
+                 issue_codes=None, quarters=None, store_path=None):
+    """Read filings from the store, pushing column and row filters down.
+
+    Args:
+      columns (list of str, optional): Columns to read. Defaults to all stored
+        columns except the partition key and issue_code_set.
+      train_only (bool, default True): Whether to only get training data (data
+        from before 2023).
+      start, end (date-like, optional): Restrict to quarters in this range.
+      issue_codes (str or list of str, optional): Restrict to filings listing
+        at least one of these codes.
+      quarters (list of str, optional): Restrict to these quarters.
+      store_path (str or pathlike, optional): Defaults to STORE_PATH.
+
+    Returns:
+      A DataFrame with one row per filing.
+    """
+    dataset = open_store(store_path)
+    if columns is None:
+        columns = [
+            name for name in dataset.schema.names
+            if name not in (PARTITION_KEY, "issue_code_set")
+        ]
+    table = dataset.to_table(
+        columns=list(columns),
+        filter=filing_filter(train_only, start, end, issue_codes, quarters),
+    )
+    df = table.to_pandas()
+    # Arrow gives float64 for integer columns with nulls
+    return df.astype({col: dtype for col, dtype in LOBBYING_DTYPES.items() if col in df})
+
+
+if __name__ == "__main__":
+    quarters = build_store()
+    print(f"Wrote {len(quarters)} quarters to {STORE_PATH}")
@@ -1,4 +1,13 @@
 """Tools for model evaluation."""
+import hashlib
+import inspect
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+
+import numpy as np
 import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
@@ -8,7 +17,16 @@ from sklearn.model_selection import TimeSeriesSplit
 
 from darts import TimeSeries
 from darts.metrics import mse
-   
+
+from scripts.instrumentation import cache_hit, cache_miss, instrumented, record, stage
+
+CV_CACHE_PATH = Path("darts_logs") / "cv_cache"
+# Errors of models that can't be fit on a fold, e.g. on a series too short for
+# their lags, or singular (numpy's LinAlgError is a ValueError). Other
+# exceptions are bugs, and are raised rather than scored as NaN.
+FIT_ERRORS = (ValueError,)
+
+@instrumented()
 def cross_validate(model, col, plot=True, test_size=4, n_cv=5, metric=mse):
     """Cross-validate a model across a time-series split, and optionally plot
     forecasts.
@@ -41,8 +59,11 @@ def cross_validate(model, col, plot=True, test_size=4, n_cv=5, metric=mse):
         col_train = TimeSeries.from_series(col.iloc[train_idx])
         col_valid = TimeSeries.from_series(col.iloc[valid_idx])
 
-        model.fit(col_train)
-        y_pred = model.predict(4)
+        with stage("fit") as s:
+            model.fit(col_train)
+            s.add(rows=len(train_idx))
+        with stage("predict"):
+            y_pred = model.predict(4)
         score += metric(col_valid, y_pred)
 
         if plot:
@@ -54,4 +75,178 @@ def cross_validate(model, col, plot=True, test_size=4, n_cv=5, metric=mse):
         ax.legend(labels = ["observed", "forecast"], handles=[true_line, forecast_line])
         ax.set_title(col.name + f": score {score:0.3e}")
         
-    return score
\ No newline at end of file
+    return score
+
+
+def _to_timeseries(data):
+    """Convert a Series (univariate) or DataFrame (multivariate) to a TimeSeries."""
+    if isinstance(data, pd.DataFrame):
+        return TimeSeries.from_dataframe(data)
+    return TimeSeries.from_series(data)
+
+
+def _score(metric, valid, pred, train):
+    """Score a forecast. Metrics with an insample argument (e.g. darts' msse)
+    are also given the training series."""
+    if "insample" in inspect.signature(metric).parameters:
+        return metric(valid, pred, insample=train)
+    return metric(valid, pred)
+
+
+def _name(obj):
+    """Importable name of a module-level function or class.
+
+    Lambdas, nested functions and callable objects are rejected: two of them
+    can share a name (or have none), and would get each other's cached scores.
+    """
+    module = getattr(obj, "__module__", None)
+    qualname = getattr(obj, "__qualname__", None)
+    if module is None or qualname is None or "<" in qualname:
+        raise TypeError(
+            f"{obj!r} can't be part of a cache key, as it isn't defined at module level; "
+            "define it at module level, or pass cache=False"
+        )
+    return f"{module}.{qualname}"
+
+
+def _json_key(value, what):
+    """JSON text of value, refusing objects that JSON can't represent (their
+    repr may differ between runs, e.g. with a memory address, or be shared by
+    different objects)."""
+    try:
+        return json.dumps(value, sort_keys=True)
+    except TypeError as e:
+        raise TypeError(f"{what} can't be part of a cache key: {e}; pass cache=False") from e
+
+
+def series_hash(data):
+    """Fingerprint a series (or frame of series): index, values and names."""
+    digest = hashlib.sha1()
+    digest.update(pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+    names = list(data.columns) if isinstance(data, pd.DataFrame) else [data.name]
+    digest.update(repr(names).encode())
+    return digest.hexdigest()
+
+
+def spec_key(spec):
+    """Describe a model spec (model_class, kwargs) as a stable string. The
+    kwargs must be JSON serializable."""
+    model_class, kwargs = spec
+    return f"{_name(model_class)}({_json_key(kwargs, f'kwargs of {_name(model_class)}')})"
+
+
+def metric_key(metric):
+    """Describe a metric as a stable string: the name of a module-level
+    function, or for a functools.partial of one, the name and the bound
+    arguments (which must be JSON serializable)."""
+    if isinstance(metric, partial):
+        func = metric_key(metric.func)
+        args = _json_key([list(metric.args), metric.keywords], f"arguments bound to {func}")
+        return f"partial({func}, {args})"
+    return _name(metric)
+
+
+def _fit_fold(job):
+    """Fit one model spec on one fold of one series and score its forecast.
+
+    Module level so that it can be sent to a process pool.
+    """
+    data, spec, train_idx, valid_idx, metric = job
+    model_class, kwargs = spec
+    train = _to_timeseries(data.iloc[train_idx])
+    valid = _to_timeseries(data.iloc[valid_idx])
+    try:
+        model = model_class(**kwargs)
+        model.fit(train)
+        pred = model.predict(len(valid_idx))
+        return float(_score(metric, valid, pred, train)), None
+    except FIT_ERRORS as e:
+        return np.nan, f"{type(e).__name__}: {e}"
+
+
+@instrumented()
+def cross_validate_grid(series, specs, test_size=4, n_cv=5, metric=mse, max_workers=None,
+                        cache=True):
+    """Cross-validate many model specs on many series in a process pool.
+    
+    Every (series, spec, fold) fit is a separate job. Fold scores are cached
+    on disk under CV_CACHE_PATH, keyed on the series contents, the model spec,
+    the fold and the metric, so rerunning after changing a few series or specs
+    only fits what changed. Fits that fail with one of FIT_ERRORS get a NaN
+    score and their error, and aren't cached (nor are NaN scores); other
+    exceptions are raised.
+    With the cache, the model classes and the metric must be defined at
+    module level (or the metric be a functools.partial of such a function)
+    and the kwargs must be JSON serializable, otherwise a TypeError is
+    raised: objects that can't be named reliably could be given another
+    model's cached scores.
+    
+    Class attributes set on a model class (e.g. VARIMA.min_train_series_length)
+    reach the workers only when processes are forked, as on Linux.
+    
+    Args:
+      series (dict): Map from a name to a pd.Series, or a pd.DataFrame to fit
+        a multivariate model on. A DataFrame of series may be passed instead
+        of a dict, one series per column.
+      specs (dict): Map from a model name to a (model_class, kwargs) pair,
+        e.g. {"VARIMA(1, 1, 0)": (VARIMA, {"p": 1, "d": 1, "q": 0})}. The
+        model is built as model_class(**kwargs) for every fold.
+      test_size (int, default 4): Number of quarters of data to include in each
+        validation set.
+      n_cv (int, default 5): Number of validation sets to use.
+      metric (callable, default mse): Metric used to score, a callable of
+        signature (y_true, y_pred), or (y_true, y_pred, insample) like msse.
+      max_workers (int, optional): Size of the process pool.
+      cache (bool, default True): Whether to read and write cached scores.
+      
+    Returns:
+      DataFrame with columns "series", "model", "fold", "score" and "error",
+      one row per fit. The mean score over folds (the score reported by
+      cross_validate) is scores.groupby(["series", "model"])["score"].mean().
+    """
+    if isinstance(series, pd.DataFrame):
+        series = {name: series[name] for name in series.columns}
+    kf = TimeSeriesSplit(n_cv, test_size=test_size)
+    if cache:
+        metric_name = metric_key(metric)
+        spec_keys = {model_name: spec_key(spec) for model_name, spec in specs.items()}
+    
+    rows = []
+    jobs = []
+    for series_name, data in series.items():
+        data_hash = series_hash(data)
+        for fold, (train_idx, valid_idx) in enumerate(kf.split(data)):
+            for model_name, spec in specs.items():
+                row = {"series": series_name, "model": model_name, "fold": fold,
+                       "score": np.nan, "error": None}
+                cache_file = None
+                if cache:
+                    key = hashlib.sha1(json.dumps(
+                        [data_hash, spec_keys[model_name], fold, n_cv, test_size, metric_name]
+                    ).encode()).hexdigest()
+                    cache_file = CV_CACHE_PATH / f"{key}.json"
+                if cache and cache_file.exists():
+                    cache_hit("cv_scores")
+                    with open(cache_file) as f:
+                        row["score"] = json.load(f)["score"]
+                else:
+                    if cache:
+                        cache_miss("cv_scores")
+                    jobs.append((row, cache_file, (data, spec, train_idx, valid_idx, metric)))
+                rows.append(row)
+    
+    if jobs:
+        if cache:
+            CV_CACHE_PATH.mkdir(parents=True, exist_ok=True)
+        max_workers = max_workers or os.cpu_count() or 1
+        with stage("fit_folds"), ProcessPoolExecutor(max_workers=max_workers) as pool:
+            record(rows=len(jobs))
+            results = pool.map(_fit_fold, [job for _, _, job in jobs], chunksize=4)
+            for (row, cache_file, _), (score, error) in zip(jobs, results):
+                row["score"], row["error"] = score, error
+                if cache and error is None and np.isfinite(score):
+                    with open(cache_file, "w") as f:
+                        json.dump({"score": score, "series": row["series"],
+                                   "model": row["model"], "fold": row["fold"]}, f)
+    
+    return pd.DataFrame(rows, columns=["series", "model", "fold", "score", "error"])
@@ -0,0 +1,164 @@
+"""Inverted index over lobbying client and registrant names.
+
+Searching the lobbying tables with ``client.str.contains`` scans every filing.
+Names repeat heavily across filings, so the index works on the distinct names:
+substring queries are answered from a trigram inverted index and then verified,
+regex queries run over the distinct names only, and approximate queries rank
+names by trigram similarity after normalization.
+"""
+import re
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+REGEX_METACHARACTERS = set(".^$*+?{}[]\\|()")
+LEGAL_SUFFIXES = {
+    "inc", "incorporated", "llc", "llp", "lp", "ltd", "limited", "corp",
+    "corporation", "co", "company", "plc", "the",
+}
+
+
+def normalize_name(name):
+    """Normalize an organization name for approximate matching: lower case,
+    punctuation removed, and legal suffixes such as "Inc." dropped."""
+    tokens = re.sub(r"[^0-9a-z]+", " ", name.lower()).split()
+    return " ".join(token for token in tokens if token not in LEGAL_SUFFIXES)
+
+
+def trigrams(text):
+    """Get the set of character trigrams of text."""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _postings(documents):
+    """Build a trigram -> sorted array of document ids inverted index."""
+    postings = defaultdict(list)
+    for i, text in enumerate(documents):
+        for trigram in trigrams(text):
+            postings[trigram].append(i)
+    return {trigram: np.array(ids, dtype=np.int32) for trigram, ids in postings.items()}
+
+
+class NameIndex:
+    """Search index over a column of names.
+
+    Attributes:
+      names (np.ndarray of str): Distinct names. Name ids index into this array.
+      codes (np.ndarray of int32): Name id of every row of the indexed column
+        (-1 for missing names).
+    """
+
+    def __init__(self, names, codes=None):
+        self.names = np.asarray(names, dtype=object)
+        self.codes = codes
+        self._folded = [name.lower() for name in self.names]
+        self._postings = _postings(self._folded)
+        self._normalized = None
+        self._fuzzy_postings = None
+        self._fuzzy_sizes = None
+
+    @classmethod
+    def from_series(cls, column):
+        """Index a column of names, e.g. the "client" column of the filings."""
+        codes, names = pd.factorize(column)
+        return cls(names, codes.astype(np.int32))
+
+    def __len__(self):
+        return len(self.names)
+
+    def search(self, query, regex=False):
+        """Find the names containing query, ignoring case.
+
+        Matches the same names as ``str.contains(query, case=False, regex=regex)``.
+
+        Args:
+          query (str): Substring (or regular expression) to search for.
+          regex (bool, default False): Whether query is a regular expression.
+            Regular expressions without metacharacters are searched as
+            substrings.
+
+        Returns:
+          Sorted array of name ids.
+        """
+        if regex and REGEX_METACHARACTERS.intersection(query):
+            matches = pd.Series(self.names).str.contains(query, case=False, regex=True, na=False)
+            return np.flatnonzero(matches.to_numpy())
+
+        query = query.lower()
+        query_trigrams = trigrams(query)
+        if not query_trigrams:
+            candidates = range(len(self))
+        else:
+            postings = sorted(
+                (self._postings.get(trigram, np.empty(0, dtype=np.int32)) for trigram in query_trigrams),
+                key=len,
+            )
+            candidates = postings[0]
+            for posting in postings[1:]:
+                if not len(candidates):
+                    break
+                candidates = np.intersect1d(candidates, posting, assume_unique=True)
+        return np.array([i for i in candidates if query in self._folded[i]], dtype=np.int32)
+
+    def _build_fuzzy(self):
+        self._normalized = [f" {normalize_name(name)} " for name in self.names]
+        self._fuzzy_postings = _postings(self._normalized)
+        self._fuzzy_sizes = np.array([len(trigrams(text)) for text in self._normalized])
+
+    def fuzzy_search(self, query, threshold=0.5, limit=None):
+        """Find names similar to query after normalization.
+
+        Similarity is the Jaccard index of the sets of character trigrams of
+        the normalized names.
+
+        Args:
+          query (str): Name to look up.
+          threshold (float, default 0.5): Minimum similarity to report.
+          limit (int, optional): Maximum number of matches to report.
+
+        Returns:
+          DataFrame with columns "name_id", "name" and "score", best first.
+        """
+        if self._fuzzy_postings is None:
+            self._build_fuzzy()
+        query_trigrams = trigrams(f" {normalize_name(query)} ")
+        hits = [self._fuzzy_postings[trigram] for trigram in query_trigrams if trigram in self._fuzzy_postings]
+        overlap = np.bincount(
+            np.concatenate(hits) if hits else np.empty(0, dtype=np.int32), minlength=len(self)
+        )
+        with np.errstate(invalid="ignore", divide="ignore"):
+            scores = overlap / (len(query_trigrams) + self._fuzzy_sizes - overlap)
+        ids = np.flatnonzero(scores >= threshold)
+        ids = ids[np.argsort(-scores[ids], kind="stable")][:limit]
+        return pd.DataFrame({"name_id": ids, "name": self.names[ids], "score": scores[ids]})
+
+    def search_many(self, queries, regex=False, fuzzy=False, threshold=0.5):
+        """Look up many names at once.
+
+        Args:
+          queries (iterable of str): Names to look up.
+          regex (bool, default False): Whether queries are regular expressions.
+          fuzzy (bool, default False): Whether to do approximate matching
+            (see fuzzy_search) instead of substring search.
+          threshold (float, default 0.5): Minimum similarity for fuzzy matches.
+
+        Returns:
+          Dict from each query to a sorted array of matching name ids.
+        """
+        results = {}
+        for query in queries:
+            if query in results:
+                continue
+            if fuzzy:
+                results[query] = np.sort(self.fuzzy_search(query, threshold)["name_id"].to_numpy())
+            else:
+                results[query] = self.search(query, regex=regex)
+        return results
+
+    def row_mask(self, name_ids):
+        """Boolean mask of the indexed rows whose name is among name_ids."""
+        hit = np.zeros(len(self) + 1, dtype=bool)
+        hit[np.asarray(name_ids, dtype=np.int64)] = True
+        # Missing names have code -1, which maps to the always-False last slot
+        return hit[self.codes]
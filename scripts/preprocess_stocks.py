@@ -1,57 +1,113 @@
+import hashlib
+import json
 from pathlib import Path
+
+import numpy as np
 import pandas as pd
 
-def normalize_name(name):
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+try:
+    from scripts.instrumentation import cache_hit, cache_miss, instrumented, record, stage
+except ImportError:
+    # Imported from within the scripts folder, as get_sectors.py does
+    from instrumentation import cache_hit, cache_miss, instrumented, record, stage
+
+SOURCE_NAME = "congress-trading-all.xlsx"
+CLEANED_NAME = "stocks_cleaned.csv"
+# Cached copies of the Excel source and the stamp of stocks_cleaned.csv
+CACHE_DIR = "cache"
+
+def normalize_names(names):
     """Convert names in "Lastname, Firstname" format to "Firstname Lastname",
-    and remove titles."""
-    if "," in name:
-        name = name.split(",")[1].strip() + " " + name.split(",")[0].strip()
-    name = name.strip()
-    if name.startswith("Mr.") or name.startswith("Ms.") or name.startswith("Dr."):
-        name = name[3:].strip()
-    if name.startswith("Mrs."):
-        name = name[4:].strip()
-    return name
+    and remove titles, over a Series of names."""
+    parts = names.str.split(",")
+    names = names.where(
+        ~names.str.contains(",", regex=False),
+        parts.str[1].str.strip() + " " + parts.str[0].str.strip(),
+    ).str.strip()
+    titled = names.str.startswith(("Mr.", "Ms.", "Dr."))
+    names = names.where(~titled, names.str[3:].str.strip())
+    titled = names.str.startswith("Mrs.")
+    return names.where(~titled, names.str[4:].str.strip())
+
+
+def normalize_ticker_symbols(symbols):
+    """Remove suffixes for classes of stock, foreign stocks, etc. over a
+    Series of ticker symbols: keep everything before the first "$" or "."."""
+    return symbols.str.extract(r"^([^$.]*)", expand=False)
+
+
+def min_trade_sizes(sizes):
+    """Extract minimum value of trade size ranges, over a Series of them."""
+    low = sizes.where(
+        ~sizes.str.contains("-", regex=False), sizes.str.split("-").str[0].str.strip()
+    )
+    return low.str.replace(r"[$,]", "", regex=True).astype(np.float64)
+
+
+def max_trade_sizes(sizes):
+    """Extract maximum value of trade size ranges, over a Series of them."""
+    high = sizes.where(
+        ~sizes.str.contains("-", regex=False), sizes.str.split("-").str[1].str.strip().str.strip(".")
+    )
+    return high.str.replace(r"[$,]", "", regex=True).astype(np.float64)
+
+
+def all_codes(frame):
+    """Assemble all of lobbying codes for each row of the
+    sector2lobbyingcode data, column by column. Presented as strings so we can
+    use pandas string methods.
+    """
+    codes = pd.Series("", index=frame.index)
+    started = np.zeros(len(frame), dtype=bool)
+    for i in range(1, 4):
+        cat = frame["Category" + str(i)]
+        present = cat.notna().to_numpy()
+        joined = codes + np.where(started, ",", "") + cat.where(present, "")
+        codes = codes.where(~present, joined)
+        started |= present
+    return codes
+
+
+def normalize_name(name):
+    """normalize_names of a single name."""
+    return normalize_names(pd.Series([name])).iloc[0]
 
 
 def normalize_ticker_symbol(symbol):
-    """Remove suffixes for classes of stock, foreign stocks, etc."""
-    if "$" in symbol:
-        symbol = symbol[:symbol.find("$")]
-    if "." in symbol:
-        symbol = symbol[:symbol.find(".")]
-    return symbol
+    """normalize_ticker_symbols of a single ticker symbol."""
+    return normalize_ticker_symbols(pd.Series([symbol])).iloc[0]
 
 
 def min_trade_size(size):
-    """Extract minimum value of trade size range."""
-    if "-" in size:
-        size = size.split("-")[0].strip()
-    size = size.replace("$", "").replace(",", "")
-    return float(size)
+    """min_trade_sizes of a single trade size range."""
+    return min_trade_sizes(pd.Series([size])).iloc[0]
 
 
 def max_trade_size(size):
-    """Extract maximum value of trade size range."""
-    if "-" in size:
-        size = size.split("-")[1].strip().strip(".")
-    size = size.replace("$", "").replace(",", "")
-    return float(size)
+    """max_trade_sizes of a single trade size range."""
+    return max_trade_sizes(pd.Series([size])).iloc[0]
 
 
 def get_all_codes(row):
-    """Assemble all of lobbying codes for each row of the
-    sector2lobbyingcode data. Presented as a string so we can use pandas
-    string methods.
-    """
-    cats = []
-    for i in range(1, 4):
-        cat = row["Category" + str(i)]
-        if not pd.isna(cat):
-            cats.append(cat)
-    return ",".join(cats)
+    """all_codes of a single row of the sector2lobbyingcode data."""
+    return all_codes(row.to_frame().T).iloc[0]
 
 
+def _by_unique(func, values):
+    """Apply a Series function to the distinct values only, and spread the
+    results back. The trading columns have few distinct values, so this is
+    much cheaper than working on every row."""
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    out = func(pd.Series(uniques))
+    return pd.Series(out.take(codes).to_numpy(), index=values.index, name=values.name)
+
+
+@instrumented()
 def preprocess_stock_data(stocks):
     """Some cleaning and preprocessing for the stocks data.
     
@@ -61,6 +117,7 @@ def preprocess_stock_data(stocks):
     Returns:
       cleaned copy of stocks.
     """
+    record(rows=len(stocks))
     # Parse dates
     for datetime_col in ["Traded", "Filed", "Quiver_Upload_Time", "last_modified"]:
         stocks[datetime_col] = pd.to_datetime(stocks[datetime_col])
@@ -71,11 +128,11 @@ def preprocess_stock_data(stocks):
     stocks = stocks.drop(9565, axis=0)
 
     # Parse trade sizes
-    stocks["Min_Trade_Size"] = stocks.Trade_Size_USD.map(min_trade_size)
-    stocks["Max_Trade_Size"] = stocks.Trade_Size_USD.map(max_trade_size)
+    stocks["Min_Trade_Size"] = _by_unique(min_trade_sizes, stocks.Trade_Size_USD)
+    stocks["Max_Trade_Size"] = _by_unique(max_trade_sizes, stocks.Trade_Size_USD)
     
     # Normalize names
-    stocks["Name"] = stocks.Name.map(normalize_name)
+    stocks["Name"] = _by_unique(normalize_names, stocks.Name)
 
     # Drop useless columns
     stocks.drop([
@@ -88,7 +145,7 @@ def preprocess_stock_data(stocks):
     ])].index, axis=0, inplace=True)
     
     # Clean up ticker symbols
-    stocks["Ticker"] = stocks.Ticker.map(normalize_ticker_symbol)
+    stocks["Ticker"] = _by_unique(normalize_ticker_symbols, stocks.Ticker)
     
     # Renamed ticker symbols: Meta, Raytheon, ...
     stocks["Ticker"] = stocks.Ticker.replace(
@@ -109,6 +166,58 @@ def preprocess_stock_data(stocks):
     return stocks
 
 
+def file_hash(fname):
+    """SHA-1 of the contents of a file."""
+    digest = hashlib.sha1()
+    with open(fname, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+@instrumented()
+def read_trading_source(data_dir):
+    """Load congress-trading-all.xlsx, through a cached copy.
+
+    Reading the Excel file is slow, so the first read of every version of it
+    is saved under data_dir/cache, keyed by the hash of the file: as Parquet
+    if pyarrow is available (and can store every column), and pickled
+    otherwise. Copies of other versions are removed.
+
+    Args:
+      data_dir (str or pathlike): Directory where data tables are stored.
+
+    Returns:
+      The DataFrame read from the Excel file.
+    """
+    data_dir = Path(data_dir)
+    source = data_dir / SOURCE_NAME
+    stem = f"{source.stem}-{file_hash(source)[:16]}"
+    cache_dir = data_dir / CACHE_DIR
+    for cache_file in [cache_dir / f"{stem}.parquet", cache_dir / f"{stem}.pkl"]:
+        if cache_file.exists():
+            cache_hit("trading_source")
+            record(bytes_read=cache_file.stat().st_size)
+            return pd.read_parquet(cache_file) if cache_file.suffix == ".parquet" else pd.read_pickle(cache_file)
+
+    cache_miss("trading_source")
+    record(bytes_read=source.stat().st_size)
+    stocks = pd.read_excel(source, parse_dates=["Traded", "Filed", "Quiver_Upload_Time"])
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    for old_file in cache_dir.glob(f"{source.stem}-*"):
+        old_file.unlink()
+    if pyarrow is not None:
+        try:
+            stocks.to_parquet(cache_dir / f"{stem}.parquet")
+            return stocks
+        except pyarrow.ArrowException:
+            # Columns of mixed types can't be stored as Parquet
+            (cache_dir / f"{stem}.parquet").unlink(missing_ok=True)
+    stocks.to_pickle(cache_dir / f"{stem}.pkl")
+    return stocks
+
+
+@instrumented()
 def merge_and_clean_stock_data(data_dir):
     """Clean the stock data, filter down so that only stocks are represented,
     and merge with sector/lobbying code info.
@@ -120,24 +229,61 @@ def merge_and_clean_stock_data(data_dir):
       A DataFrame holding all the data.
     """
     data_dir = Path(data_dir)
-    stocks = pd.read_excel(data_dir/"congress-trading-all.xlsx",
-                           parse_dates=["Traded", "Filed", "Quiver_Upload_Time"])
+    stocks = read_trading_source(data_dir)
     stocks = preprocess_stock_data(stocks)
     
-    symbol2sector = pd.read_csv(data_dir/"symbol2sector.csv")
-    stocks = pd.merge(stocks, symbol2sector, on="Ticker", how="left")
-    # Filter to stocks for which Yahoo Finance could find sector/industry data
-    stocks.drop(stocks[stocks.YFQuoteType != "EQUITY"].index, axis=0, inplace=True)
-    
-    sector2code = pd.read_csv(data_dir/"sector2lobbyingcode.csv")
-    stocks = pd.merge(stocks, sector2code, on="Industry", how="left")
-    stocks["Codes"] = stocks.apply(get_all_codes, axis=1)
+    with stage("merge_sectors"):
+        symbol2sector = pd.read_csv(data_dir/"symbol2sector.csv")
+        stocks = pd.merge(stocks, symbol2sector, on="Ticker", how="left")
+        # Filter to stocks for which Yahoo Finance could find sector/industry data
+        stocks.drop(stocks[stocks.YFQuoteType != "EQUITY"].index, axis=0, inplace=True)
+        
+        sector2code = pd.read_csv(data_dir/"sector2lobbyingcode.csv")
+        stocks = pd.merge(stocks, sector2code, on="Industry", how="left")
+    stocks["Codes"] = all_codes(stocks)
     stocks.loc[:, "Codes"] = stocks.Codes.fillna("")
     
     return stocks
 
+def write_cleaned_stock_data(data_dir, force=False):
+    """Write stocks_cleaned.csv, unless it is up to date.
+
+    The hashes of the input tables and of this script are recorded in a stamp
+    under data_dir/cache, and the file is only rebuilt when one of them
+    changed (or force is set).
+
+    Args:
+      data_dir (str or pathlike): Directory where data tables are stored.
+      force (bool, default False): Whether to rebuild in any case.
+
+    Returns:
+      Whether stocks_cleaned.csv was rebuilt.
+    """
+    data_dir = Path(data_dir)
+    out_file = data_dir / CLEANED_NAME
+    stamp_file = data_dir / CACHE_DIR / f"{out_file.stem}.stamp.json"
+    inputs = [data_dir / SOURCE_NAME, data_dir / "symbol2sector.csv",
+              data_dir / "sector2lobbyingcode.csv", Path(__file__)]
+    stamp = {fname.name: file_hash(fname) for fname in inputs}
+    if not force and out_file.exists() and stamp_file.exists():
+        with open(stamp_file) as f:
+            if json.load(f) == stamp:
+                cache_hit("stocks_cleaned")
+                return False
+
+    cache_miss("stocks_cleaned")
+    stocks = merge_and_clean_stock_data(data_dir)
+    with stage("write_stocks_csv") as s:
+        stocks.to_csv(out_file, index=False)
+        s.add(rows=len(stocks))
+    stamp_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(stamp_file, "w") as f:
+        json.dump(stamp, f, indent=1)
+    return True
+
+
 if __name__ == "__main__":
-    stocks = merge_and_clean_stock_data("trading_data")
-    
-    stocks.to_csv("trading_data/stocks_cleaned.csv", index=False)
-    print("Wrote cleaned stock data.")
\ No newline at end of file
+    if write_cleaned_stock_data("trading_data"):
+        print("Wrote cleaned stock data.")
+    else:
+        print("Cleaned stock data is up to date.")
\ No newline at end of file
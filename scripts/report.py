@@ -0,0 +1,238 @@
+"""Render the lobbying vs. stock trading figure of every category in one batch.
+
+Calling plot_lobbying_vs_stocks once per category recomputes the totals every
+time. render_report computes the totals of all categories at once (the
+lobbying totals cube and one all_stock_totals call), and draws the figures in
+a process pool with the non-interactive Agg backend, as PNG and SVG files with
+an index.html page linking them.
+
+A manifest records a hash of the totals (and of the plotting code) behind each
+figure, so figures whose inputs didn't change since the last run are skipped.
+"""
+import argparse
+import hashlib
+import html
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+from scripts.data_extraction import all_stock_totals, cognate_industries, lobbying_totals, lobbying_totals_cube
+from scripts.instrumentation import cache_hit, cache_miss, instrumented, stage
+
+REPORT_PATH = Path("reports") / "lobbying_vs_stocks"
+FORMATS = ("png", "svg")
+DPI = 100
+VISUALIZATION_PATH = Path(__file__).with_name("visualization.py")
+
+
+def default_categories(train_only=True):
+    """Every issue code with lobbying filings, with its cognate industries (see
+    cognate_industries).
+
+    Returns:
+      Dict from category name to (issue codes, industries).
+    """
+    codes = set(lobbying_totals_cube(train_only).index.get_level_values("issue_code"))
+    return {
+        code: ([code], industries) for code, industries in sorted(cognate_industries().items())
+        if code in codes
+    }
+
+
+@instrumented()
+def category_totals(categories, train_only=True, adjust_for_num_codes=False):
+    """stock_and_lobbying_totals for many categories, computed together.
+
+    Args:
+      categories (dict): Map from category name to (issue codes, industries).
+      train_only (bool, default True): Whether to only use training data (data
+        from before 2023).
+      adjust_for_num_codes (bool, default False): See lobbying_totals.
+
+    Returns:
+      Dict from category name to its totals DataFrame.
+    """
+    stocks = all_stock_totals(
+        {name: industries for name, (_, industries) in categories.items()}, train_only
+    )
+    out = {}
+    for name, (issue_codes, _) in categories.items():
+        # Single codes are slices of the cached lobbying totals cube
+        lobbying_df = lobbying_totals(issue_codes, train_only, adjust_for_num_codes)
+        stock_df = stocks.xs(name, level="group")
+        out[name] = lobbying_df.merge(stock_df, how="outer", left_index=True, right_index=True).fillna(0)
+    return out
+
+
+def _source_hash():
+    """Hash of the plotting code, so that figures are redrawn when it changes."""
+    return hashlib.sha1(VISUALIZATION_PATH.read_bytes()).hexdigest()
+
+
+def figure_hash(totals, title, source_hash=None):
+    """Fingerprint of everything a figure is drawn from."""
+    digest = hashlib.sha1()
+    digest.update(f"{title};{DPI};{source_hash or _source_hash()};".encode())
+    digest.update(",".join(totals.columns).encode())
+    digest.update(pd.util.hash_pandas_object(totals, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def file_stem(name):
+    """File name for a category (anything but letters, digits, - and _ is
+    replaced)."""
+    return re.sub(r"[^A-Za-z0-9_-]+", "_", name)
+
+
+def _use_agg():
+    """Process pool initializer: draw without a display."""
+    import matplotlib
+    matplotlib.use("Agg", force=True)
+
+
+def _render_figure(totals, title, out_dir, stem, formats):
+    """Draw one figure and save it in each format (module level so that it can
+    be sent to a process pool).
+
+    Returns:
+      List of the file names written.
+    """
+    import matplotlib.pyplot as plt
+
+    from scripts.visualization import plot_totals
+
+    fig = plot_totals(totals, title)
+    written = []
+    try:
+        for fmt in formats:
+            fname = Path(out_dir) / f"{stem}.{fmt}"
+            tmp_name = fname.with_name(fname.name + ".tmp")
+            # No creation date in the metadata and fixed SVG element ids, so
+            # unchanged figures give identical files
+            metadata = {"Date": None} if fmt == "svg" else None
+            with plt.rc_context({"svg.hashsalt": stem}):
+                fig.savefig(tmp_name, format=fmt, dpi=DPI, metadata=metadata)
+            tmp_name.replace(fname)
+            written.append(fname.name)
+    finally:
+        plt.close(fig)
+    return written
+
+
+def _write_index(out_dir, categories, manifest):
+    """Write index.html with every figure of the report."""
+    sections = []
+    for name, (issue_codes, industries) in categories.items():
+        files = manifest[name]["files"]
+        image = next((f for f in files if f.endswith(".png")), files[0])
+        links = " ".join(f'<a href="{html.escape(f)}">{html.escape(f.rsplit(".", 1)[1].upper())}</a>' for f in files)
+        sections.append(
+            f'<section id="{html.escape(file_stem(name))}">\n'
+            f"<h2>{html.escape(name)}</h2>\n"
+            f"<p>Issue codes: {html.escape(', '.join(issue_codes))}<br>"
+            f"Industries: {html.escape(', '.join(industries))}<br>{links}</p>\n"
+            f'<img src="{html.escape(image)}" alt="{html.escape(name)}" loading="lazy" width="500">\n'
+            "</section>"
+        )
+    contents = "\n".join(f'<li><a href="#{html.escape(file_stem(name))}">{html.escape(name)}</a></li>'
+                         for name in categories)
+    page = (
+        "<!DOCTYPE html>\n<html>\n<head>\n<meta charset=\"utf-8\">\n"
+        "<title>Lobbying vs. stock trading</title>\n</head>\n<body>\n"
+        f"<h1>Lobbying vs. stock trading</h1>\n<ul>\n{contents}\n</ul>\n"
+        + "\n".join(sections)
+        + "\n</body>\n</html>\n"
+    )
+    tmp_path = Path(out_dir) / "index.html.tmp"
+    tmp_path.write_text(page)
+    tmp_path.replace(Path(out_dir) / "index.html")
+
+
+@instrumented()
+def render_report(categories=None, out_dir=None, train_only=True, adjust_for_num_codes=False,
+                  formats=FORMATS, max_workers=None, force=False):
+    """Render the figure of every category, and an index page.
+
+    Args:
+      categories (dict, optional): Map from category name to (issue codes,
+        industries). Defaults to default_categories().
+      out_dir (str or pathlike, optional): Defaults to REPORT_PATH.
+      train_only (bool, default True): Whether to only use training data (data
+        from before 2023).
+      adjust_for_num_codes (bool, default False): See lobbying_totals.
+      formats (tuple of str, default ("png", "svg")): File formats to save.
+      max_workers (int, optional): Size of the process pool.
+      force (bool, default False): Whether to redraw unchanged figures too.
+
+    Returns:
+      (rendered, unchanged): lists of the category names drawn and skipped.
+    """
+    if categories is None:
+        categories = default_categories(train_only)
+    out_dir = REPORT_PATH if out_dir is None else Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = out_dir / "manifest.json"
+    old_manifest = {}
+    if manifest_path.exists():
+        with open(manifest_path) as f:
+            old_manifest = json.load(f)
+
+    totals = category_totals(categories, train_only, adjust_for_num_codes)
+    source_hash = _source_hash()
+    formats = list(formats)
+    manifest, stale = {}, []
+    for name in categories:
+        stem = file_stem(name)
+        files = [f"{stem}.{fmt}" for fmt in formats]
+        manifest[name] = {"hash": figure_hash(totals[name], name, source_hash), "files": files}
+        old = old_manifest.get(name)
+        if (not force and old == manifest[name]
+                and all((out_dir / fname).exists() for fname in files)):
+            cache_hit("report_figure")
+        else:
+            cache_miss("report_figure")
+            stale.append(name)
+
+    if stale:
+        max_workers = min(max_workers or os.cpu_count() or 1, len(stale))
+        with stage("render_figures"), ProcessPoolExecutor(max_workers=max_workers, initializer=_use_agg) as pool:
+            futures = [
+                pool.submit(_render_figure, totals[name], name, out_dir, file_stem(name), formats)
+                for name in stale
+            ]
+            for future in futures:
+                future.result()
+
+    # Remove the files of categories or formats no longer in the report
+    current = {fname for entry in manifest.values() for fname in entry["files"]}
+    for entry in old_manifest.values():
+        for fname in set(entry["files"]) - current:
+            (out_dir / fname).unlink(missing_ok=True)
+    _write_index(out_dir, categories, manifest)
+    tmp_path = manifest_path.with_name(manifest_path.name + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=1)
+    tmp_path.replace(manifest_path)
+    return stale, [name for name in categories if name not in stale]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--out-dir", default=None)
+    parser.add_argument("--all-quarters", action="store_true", help="include data after 2022")
+    parser.add_argument("--adjust-for-num-codes", action="store_true")
+    parser.add_argument("--formats", nargs="+", default=list(FORMATS))
+    parser.add_argument("--max-workers", type=int, default=None)
+    parser.add_argument("--force", action="store_true", help="redraw unchanged figures too")
+    args = parser.parse_args()
+    rendered, unchanged = render_report(
+        out_dir=args.out_dir, train_only=not args.all_quarters,
+        adjust_for_num_codes=args.adjust_for_num_codes, formats=args.formats,
+        max_workers=args.max_workers, force=args.force,
+    )
+    out_dir = REPORT_PATH if args.out_dir is None else Path(args.out_dir)
+    print(f"Rendered {len(rendered)} figures ({len(unchanged)} unchanged); see {out_dir / 'index.html'}")
@@ -0,0 +1,269 @@
+"""Split lobbying_data/filings_all.csv into the by_quarter and by_issue_code files.
+
+The source is read in chunks and appended to the by_quarter files, so memory
+stays bounded by the chunk size (and then by the size of a quarter) whatever
+the size of the source. An amendment can be in a different chunk than the
+report it amends, so a second pass resolves the amendments of each quarter
+file as a whole (see lda_cleaning.resolve_amendments, which keeps the latest
+report per registrant, client and quarter, as update_filings did in
+1_Preliminary_cleaning.ipynb) and writes the by_issue_code files from the
+resolved quarters. Both passes run in a process pool and write in a fixed
+order (source order within a quarter, then sorted by dt_posted; quarters in
+order in the by_issue_code files), so the output is byte-identical across
+runs. Every value from the source is passed through as text; only the derived
+columns period_start, period_end and spending_variance are computed (see
+scripts/lda_cleaning.py).
+
+Run it from the repository root with
+
+    python -m scripts.split_filings
+"""
+import argparse
+import os
+import shutil
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+from scripts.issue_codes import IssueCodeIndex
+from scripts.lda_cleaning import filing_quarters, period_bounds, resolve_amendments, spending_variance
+
+LOBBYING_PATH = Path("lobbying_data")
+SOURCE_PATH = LOBBYING_PATH / "filings_all.csv"
+DERIVED_COLUMNS = ["period_start", "period_end", "spending_variance"]
+CHUNKSIZE = 50000
+
+
+def output_columns(source_columns):
+    """Columns of the partition files for a source with source_columns."""
+    return [col for col in source_columns if col not in DERIVED_COLUMNS] + DERIVED_COLUMNS
+
+
+def partition_header(source):
+    """Header line of the partition files for a source file."""
+    return pd.DataFrame(columns=output_columns(pd.read_csv(source, nrows=0).columns)).to_csv(index=False)
+
+
+def quarter_file(quarter):
+    return Path("by_quarter") / f"filings_{quarter}.csv"
+
+
+def issue_code_file(code):
+    return Path("by_issue_code") / f"filings_{code}.csv"
+
+
+def prepare_chunk(chunk):
+    """Assign a chunk of filings to quarters and attach the derived columns.
+
+    Filings that aren't quarterly reports are dropped.
+
+    Args:
+      chunk (pd.DataFrame): Filings read as strings.
+
+    Returns:
+      (chunk, quarters): the filings with the columns of the partition files,
+      and their quarter labels, both with a fresh index.
+    """
+    quarters = filing_quarters(chunk)
+    keep = quarters.notna().to_numpy()
+    chunk, quarters = chunk[keep], quarters[keep]
+    chunk = chunk.assign(spending_variance=spending_variance(chunk))
+    chunk["period_start"], chunk["period_end"] = period_bounds(quarters)
+    chunk = chunk[output_columns(chunk.columns)].reset_index(drop=True)
+    return chunk, quarters.reset_index(drop=True)
+
+
+def render_quarters(chunk, quarters):
+    """Render the rows of each quarter as CSV text without a header.
+
+    Returns:
+      Dict from by_quarter file to (number of rows, CSV text).
+    """
+    return {
+        quarter_file(quarter): (len(rows), rows.to_csv(index=False, header=False))
+        for quarter, rows in chunk.groupby(quarters, sort=True)
+    }
+
+
+def render_issue_codes(chunk):
+    """Render the rows listing each issue code as CSV text without a header.
+
+    Returns:
+      Dict from by_issue_code file to (number of rows, CSV text).
+    """
+    rendered = {}
+    codes = IssueCodeIndex.from_strings(chunk["issue_codes"])
+    row_ids = codes.row_ids()
+    for code_id, code in enumerate(codes.vocabulary):
+        # A code listed twice on a filing still gives a single row
+        rows = pd.unique(row_ids[codes.indices == code_id])
+        rendered[issue_code_file(code)] = (len(rows), chunk.iloc[rows].to_csv(index=False, header=False))
+    return rendered
+
+
+def split_chunk(chunk):
+    """Assign a chunk of filings to quarters and render them as CSV.
+
+    Args:
+      chunk (pd.DataFrame): Filings read as strings.
+
+    Returns:
+      Dict from by_quarter file (relative to the lobbying data directory) to
+      (number of rows, CSV text without a header), rows in source order.
+    """
+    chunk, quarters = prepare_chunk(chunk)
+    return render_quarters(chunk, quarters)
+
+
+def read_text(fname):
+    """Read a partition file with every value as text."""
+    return pd.read_csv(fname, dtype=str, keep_default_na=False)
+
+
+def resolve_quarter_file(fname):
+    """Resolve the amendments of a by_quarter file in place.
+
+    Args:
+      fname (pathlike): by_quarter file holding every quarterly report of its
+        quarter, in source order.
+
+    Returns:
+      The resolved filings (as text), as written back to fname.
+    """
+    fname = Path(fname)
+    resolved = resolve_amendments(read_text(fname))
+    tmp_fname = fname.with_name(fname.name + ".tmp")
+    resolved.to_csv(tmp_fname, index=False)
+    tmp_fname.replace(fname)
+    return resolved
+
+
+def _resolve_and_render(fname):
+    """Resolve a by_quarter file and render its by_issue_code rows (module
+    level so that it can be sent to a process pool).
+
+    Returns:
+      (number of resolved rows, render_issue_codes of the resolved rows).
+    """
+    resolved = resolve_quarter_file(fname)
+    return len(resolved), render_issue_codes(resolved)
+
+
+def ordered_map(pool, fn, items, window):
+    """Like pool.map, but with at most window items in flight, so that items
+    are only read from the iterable as results are consumed."""
+    pending = deque()
+    for item in items:
+        pending.append(pool.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def read_chunks(source, chunksize=CHUNKSIZE):
+    """Iterate over chunks of the source, read as text so that values are
+    written back unchanged."""
+    return pd.read_csv(source, chunksize=chunksize, dtype=str, keep_default_na=False)
+
+
+def write_rendered(root, header, pieces):
+    """Append rendered rows to their files under root, starting each file
+    with header.
+
+    Args:
+      root (Path): Directory the files are relative to.
+      header (str): CSV header line.
+      pieces (iterable of dict): Dicts from file to (number of rows, CSV
+        text without a header), appended in order.
+
+    Returns:
+      Dict from each file to its number of rows.
+    """
+    handles = {}
+    num_rows = {}
+    try:
+        for rendered in pieces:
+            for fname, (rows, text) in rendered.items():
+                if fname not in handles:
+                    handles[fname] = open(root / fname, "w", newline="")
+                    handles[fname].write(header)
+                    num_rows[fname] = 0
+                handles[fname].write(text)
+                num_rows[fname] += rows
+    finally:
+        for handle in handles.values():
+            handle.close()
+    return num_rows
+
+
+def _replace_dir(new_dir, target):
+    """Move new_dir to target, replacing what was there."""
+    old_dir = target.with_name(f".{target.name}.old")
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if target.exists():
+        target.rename(old_dir)
+    new_dir.rename(target)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def split_filings(source=None, lobbying_path=None, chunksize=CHUNKSIZE, max_workers=None):
+    """Write the by_quarter and by_issue_code files from filings_all.csv.
+
+    The files are written to a temporary directory, which replaces the
+    existing by_quarter and by_issue_code directories once complete.
+    Amendments are resolved, so there is one filing per registrant, client
+    and quarter.
+
+    Args:
+      source (str or pathlike, optional): Defaults to SOURCE_PATH.
+      lobbying_path (str or pathlike, optional): Directory to write the
+        layouts into. Defaults to LOBBYING_PATH.
+      chunksize (int, default CHUNKSIZE): Rows per chunk.
+      max_workers (int, optional): Size of the process pool.
+
+    Returns:
+      Dict from each written file to its number of rows.
+    """
+    source = SOURCE_PATH if source is None else Path(source)
+    lobbying_path = LOBBYING_PATH if lobbying_path is None else Path(lobbying_path)
+    max_workers = max_workers or os.cpu_count() or 1
+    tmp_path = lobbying_path / ".split.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    (tmp_path / "by_quarter").mkdir(parents=True)
+    (tmp_path / "by_issue_code").mkdir(parents=True)
+
+    chunks = read_chunks(source, chunksize)
+    header = partition_header(source)
+    num_rows = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        # Every quarterly report, appended to its quarter
+        write_rendered(tmp_path, header, ordered_map(pool, split_chunk, chunks, 2 * max_workers))
+        # Amendments resolved per quarter, and the issue codes of the
+        # resolved filings, quarter after quarter
+        quarter_files = sorted((tmp_path / "by_quarter").glob("*.csv"))
+        resolved = ordered_map(pool, _resolve_and_render, quarter_files, 2 * max_workers)
+
+        def issue_code_pieces():
+            for fname, (rows, rendered) in zip(quarter_files, resolved):
+                num_rows[fname.relative_to(tmp_path)] = rows
+                yield rendered
+
+        num_rows.update(write_rendered(tmp_path, header, issue_code_pieces()))
+
+    for layout in ("by_quarter", "by_issue_code"):
+        _replace_dir(tmp_path / layout, lobbying_path / layout)
+    shutil.rmtree(tmp_path)
+    return num_rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--source", default=SOURCE_PATH)
+    parser.add_argument("--chunksize", type=int, default=CHUNKSIZE)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    num_rows = split_filings(args.source, chunksize=args.chunksize, max_workers=args.workers)
+    print(f"Wrote {len(num_rows)} files to {LOBBYING_PATH}")
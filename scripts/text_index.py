@@ -0,0 +1,467 @@
+"""On-disk inverted index over the lobbying description text.
+
+Finding the filings that mention a bill, company or ticker with
+``lobbying_description.str.contains`` scans all of the description text. This
+index tokenizes the descriptions once (lower case, runs of letters and digits)
+and stores, for every token, the filings it occurs in with its positions, so
+that term and phrase queries only read the postings of their tokens. Results
+are ranked with BM25, and can be filtered by quarter, issue code and client.
+
+Words written in upper case are also indexed as written, at the same
+position. Search ignores case, but mention counts match the upper-case words
+of an entity (e.g. tickers such as IT, ON or ALL) only where the description
+has them in upper case, and not as ordinary words.
+
+The index has one segment per quarter, a directory under TEXT_INDEX_PATH
+holding memory-mapped arrays:
+  terms.npy: the sorted distinct tokens (in lower case, and upper-case words
+    as written).
+  term_ptr.npy: the postings of terms[i] are entries term_ptr[i]:term_ptr[i+1].
+  docs.npy: the filing (row of filings.pkl) of each posting.
+  pos_ptr.npy: the positions of posting k are positions[pos_ptr[k]:pos_ptr[k+1]].
+  positions.npy: token positions within each filing.
+  doc_lens.npy: the number of tokens of each filing.
+  filings.pkl: filing_uuid, client and issue_codes of each filing.
+Segments are rebuilt only when the data of their quarter changes (or the
+index layout, see INDEX_VERSION).
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from scripts.data_extraction import (
+    LOBBYING_PATH, file_signature, lobbying_sources, quarter_overlaps, read_quarter,
+)
+from scripts.instrumentation import cache_hit, cache_miss, instrumented, record
+from scripts.issue_codes import IssueCodeIndex
+from scripts.lobbying_store import TRAIN_END_QUARTER
+
+TEXT_INDEX_PATH = LOBBYING_PATH / "cache" / "text_index"
+# Segments built with another version are rebuilt
+INDEX_VERSION = 2
+SEGMENT_ARRAYS = ["terms", "term_ptr", "docs", "pos_ptr", "positions", "doc_lens"]
+# Descriptions are stringified lists; the separators between list items (and
+# "|") count as a position without a token, so phrases don't span items
+ITEM_SEPARATOR = r"""['"],\s*['"]"""
+TOKEN_PATTERN = r"[0-9A-Za-z]+|\|"
+PHRASE_PATTERN = re.compile(r'"([^"]*)"|(\S+)')
+text_index_cache = None
+
+
+def tokenize(text):
+    """Split query text into tokens, as the descriptions are split."""
+    return re.findall(r"[0-9a-z]+", text.lower())
+
+
+def tokenize_cased(text):
+    """Split text into tokens like tokenize, but keep the words written in
+    upper case as they are, e.g. "IT services" -> ["IT", "services"]."""
+    return [token if token.isupper() else token.lower() for token in re.findall(r"[0-9A-Za-z]+", text)]
+
+
+def parse_query(query):
+    """Split a query into clauses: a double-quoted phrase is one clause, and
+    every other token is a clause of its own.
+
+    Returns:
+      List of tuples of tokens, e.g. 'tax "H.R. 1"' -> [("tax",), ("h", "r", "1")].
+    """
+    clauses = []
+    for phrase, word in PHRASE_PATTERN.findall(query):
+        if phrase:
+            tokens = tokenize(phrase)
+            if tokens:
+                clauses.append(tuple(tokens))
+        else:
+            clauses.extend((token,) for token in tokenize(word))
+    return list(dict.fromkeys(clauses))
+
+
+def _tokenize_descriptions(descriptions):
+    """Tokenize a column of descriptions.
+
+    Returns:
+      (tokens, docs, positions, doc_lens): every token in lower case (and
+      once more as written if it is in upper case) with the row it is from
+      and its position there, and the number of tokens of each row.
+    """
+    text = descriptions.fillna("").astype(str)
+    # Escape sequences of the stringified lists, e.g. \\n or \\'
+    text = text.str.replace(r"\\.", " ", regex=True).str.replace(ITEM_SEPARATOR, " | ", regex=True)
+    tokens = text.str.findall(TOKEN_PATTERN).reset_index(drop=True).explode().dropna()
+    docs = tokens.index.to_numpy(dtype=np.int64)
+    positions = tokens.groupby(level=0).cumcount().to_numpy(dtype=np.int64)
+    keep = (tokens != "|").to_numpy()
+    tokens, docs, positions = tokens[keep], docs[keep], positions[keep]
+    doc_lens = np.bincount(docs, minlength=len(descriptions))
+    upper = tokens.str.isupper().to_numpy(dtype=bool)
+    return (
+        np.concatenate([tokens.str.lower().to_numpy(dtype=object), tokens[upper].to_numpy(dtype=object)]),
+        np.concatenate([docs, docs[upper]]),
+        np.concatenate([positions, positions[upper]]),
+        doc_lens,
+    )
+
+
+def write_segment(path, filings):
+    """Index the descriptions of some filings into a segment.
+
+    Args:
+      path (str or pathlike): Directory of the segment (replaced if it exists).
+      filings (pd.DataFrame): Filings with "filing_uuid", "client",
+        "issue_codes" and "lobbying_description" columns.
+    """
+    path = Path(path)
+    record(rows=len(filings))
+    tokens, docs, positions, doc_lens = _tokenize_descriptions(filings["lobbying_description"])
+    # Factorize, then rank the distinct tokens, rather than sort every token
+    codes, uniques = pd.factorize(tokens)
+    terms = np.asarray(uniques, dtype=str)
+    order = np.argsort(terms)
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    term_ids = rank[codes]
+
+    entries = np.lexsort((positions, docs, term_ids))
+    term_ids, docs, positions = term_ids[entries], docs[entries], positions[entries]
+    if len(entries):
+        # One posting per distinct (term, filing)
+        starts = np.flatnonzero(np.r_[True, (np.diff(term_ids) != 0) | (np.diff(docs) != 0)])
+        arrays = {
+            "terms": np.char.encode(terms[order], "utf-8").astype("S"),
+            "term_ptr": np.searchsorted(term_ids[starts], np.arange(len(terms) + 1)).astype(np.int64),
+            "docs": docs[starts].astype(np.int32),
+            "pos_ptr": np.r_[starts, len(entries)].astype(np.int64),
+        }
+    else:
+        # No tokens at all (e.g. every description is "[]"): no terms, and
+        # no postings
+        arrays = {
+            "terms": np.empty(0, "S1"),
+            "term_ptr": np.zeros(1, np.int64),
+            "docs": np.empty(0, np.int32),
+            "pos_ptr": np.zeros(1, np.int64),
+        }
+    arrays["positions"] = positions.astype(np.int32)
+    arrays["doc_lens"] = doc_lens.astype(np.int32)
+    tmp_path = path.with_name(path.name + ".tmp")
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    tmp_path.mkdir(parents=True)
+    for name, values in arrays.items():
+        np.save(tmp_path / f"{name}.npy", values)
+    meta = filings[["filing_uuid", "client", "issue_codes"]].reset_index(drop=True)
+    meta = meta.astype({"filing_uuid": str, "issue_codes": str}).astype({"client": "category"})
+    meta.to_pickle(tmp_path / "filings.pkl")
+    shutil.rmtree(path, ignore_errors=True)
+    tmp_path.replace(path)
+
+
+class Segment:
+    """Read-only, memory-mapped index of the descriptions of one quarter."""
+
+    def __init__(self, path, quarter):
+        self.quarter = quarter
+        for name in SEGMENT_ARRAYS:
+            setattr(self, name, np.load(Path(path) / f"{name}.npy", mmap_mode="r"))
+        self.filings = pd.read_pickle(Path(path) / "filings.pkl")
+        self._issue_codes = None
+
+    def __len__(self):
+        return len(self.doc_lens)
+
+    def _term_range(self, token):
+        """Range of the postings of a token (empty if it never occurs)."""
+        key = token.encode("utf-8")
+        i = int(np.searchsorted(self.terms, key))
+        if i < len(self.terms) and self.terms[i] == key:
+            return int(self.term_ptr[i]), int(self.term_ptr[i + 1])
+        return 0, 0
+
+    def document_frequencies(self, tokens):
+        """Number of filings containing each of tokens, in one lookup."""
+        if not len(self.terms):
+            return np.zeros(len(tokens), dtype=np.int64)
+        keys = [token.encode("utf-8") for token in tokens]
+        # Keys longer than every term can't occur, and would be truncated to
+        # the width of the terms (and could then match a prefix)
+        fits = np.array([len(key) <= self.terms.dtype.itemsize for key in keys], dtype=bool)
+        keys = np.array([key if fit else b"" for key, fit in zip(keys, fits)], dtype=self.terms.dtype)
+        ids = np.minimum(np.searchsorted(self.terms, keys), len(self.terms) - 1)
+        found = (self.terms[ids] == keys) & fits
+        return np.where(found, self.term_ptr[ids + 1] - self.term_ptr[ids], 0)
+
+    def matches(self, clause):
+        """Filings containing a clause (a tuple of consecutive tokens).
+
+        Returns:
+          (docs, counts): sorted filing rows and the number of occurrences in
+          each.
+        """
+        if len(clause) == 1:
+            start, end = self._term_range(clause[0])
+            docs = np.asarray(self.docs[start:end], dtype=np.int64)
+            return docs, np.diff(self.pos_ptr[start:end + 1]) if end > start else np.empty(0, np.int64)
+        keys = None
+        for offset, token in enumerate(clause):
+            start, end = self._term_range(token)
+            if start == end:
+                return np.empty(0, np.int64), np.empty(0, np.int64)
+            lengths = np.diff(self.pos_ptr[start:end + 1])
+            docs = np.repeat(np.asarray(self.docs[start:end], dtype=np.int64), lengths)
+            # Key of the position where the phrase would start
+            starts = self.positions[self.pos_ptr[start]:self.pos_ptr[end]].astype(np.int64) - offset
+            token_keys = (docs << 32) | np.maximum(starts, 0)
+            token_keys = token_keys[starts >= 0]
+            keys = token_keys if keys is None else np.intersect1d(keys, token_keys, assume_unique=True)
+        docs, counts = np.unique(keys >> 32, return_counts=True)
+        return docs, counts
+
+    def mask(self, issue_codes=None, client=None):
+        """Boolean mask of the filings passing the filters (None if there are
+        no filters)."""
+        if issue_codes is None and client is None:
+            return None
+        keep = np.ones(len(self), dtype=bool)
+        if issue_codes is not None:
+            if self._issue_codes is None:
+                self._issue_codes = IssueCodeIndex.from_strings(self.filings["issue_codes"])
+            keep &= self._issue_codes.contains_any(issue_codes)
+        if client is not None:
+            clients = self.filings["client"].cat
+            matching = clients.categories.str.contains(client, case=False, regex=False)
+            codes = clients.codes.to_numpy()
+            keep &= (codes >= 0) & np.r_[matching, False][codes]
+        return keep
+
+
+class TextIndex:
+    """Search the descriptions of the filings of many quarters."""
+
+    def __init__(self, path=None):
+        self.path = TEXT_INDEX_PATH if path is None else Path(path)
+        with open(self.path / "meta.json") as f:
+            self.meta = json.load(f)
+        self.segments = {
+            quarter: Segment(self.path / quarter, quarter) for quarter in sorted(self.meta["segments"])
+        }
+
+    def _select(self, train_only=True, start=None, end=None):
+        return [
+            segment for quarter, segment in self.segments.items()
+            if not (train_only and quarter > TRAIN_END_QUARTER) and quarter_overlaps(quarter, start, end)
+        ]
+
+    @instrumented("text_search")
+    def search(self, query, train_only=True, start=None, end=None, issue_codes=None,
+               client=None, match_all=False, limit=20, k1=1.2, b=0.75):
+        """Rank filings by the BM25 relevance of their description to a query.
+
+        Args:
+          query (str): Words and double-quoted phrases, e.g.
+            'semiconductor "H.R. 4346"'. Every word and phrase is a clause.
+          train_only (bool, default True): Whether to only search training
+            data (data from before 2023).
+          start, end (date-like, optional): Only search the quarters
+            overlapping [start, end].
+          issue_codes (str or list of str, optional): Only return filings
+            listing one of these codes.
+          client (str, optional): Only return filings of clients whose name
+            contains this (ignoring case).
+          match_all (bool, default False): Whether filings must match every
+            clause, rather than any.
+          limit (int, default 20): Number of results (None for all).
+          k1, b (float): BM25 parameters.
+
+        Returns:
+          DataFrame with columns "quarter", "filing_uuid", "client",
+          "issue_codes" and "score", best matches first.
+        """
+        clauses = parse_query(query)
+        segments = self._select(train_only, start, end)
+        num_docs = sum(len(segment) for segment in segments)
+        columns = ["quarter", "filing_uuid", "client", "issue_codes", "score"]
+        if not clauses or not num_docs:
+            return pd.DataFrame(columns=columns)
+        avg_len = sum(int(segment.doc_lens.sum()) for segment in segments) / num_docs
+        matches = [[segment.matches(clause) for clause in clauses] for segment in segments]
+        doc_freqs = np.array([sum(len(m[i][0]) for m in matches) for i in range(len(clauses))])
+        idf = np.log(1 + (num_docs - doc_freqs + 0.5) / (doc_freqs + 0.5))
+
+        results = []
+        for segment, segment_matches in zip(segments, matches):
+            scores = np.zeros(len(segment))
+            num_matched = np.zeros(len(segment), dtype=np.int64)
+            norm = k1 * (1 - b + b * np.asarray(segment.doc_lens) / max(avg_len, 1e-9))
+            for weight, (docs, counts) in zip(idf, segment_matches):
+                scores[docs] += weight * counts * (k1 + 1) / (counts + norm[docs])
+                num_matched[docs] += 1
+            keep = num_matched == len(clauses) if match_all else num_matched > 0
+            mask = segment.mask(issue_codes, client)
+            if mask is not None:
+                keep &= mask
+            rows = np.flatnonzero(keep)
+            if len(rows):
+                found = segment.filings.iloc[rows].assign(quarter=segment.quarter, score=scores[rows])
+                results.append(found.astype({"client": str}))
+        if not results:
+            return pd.DataFrame(columns=columns)
+        out = pd.concat(results, ignore_index=True)[columns]
+        out = out.sort_values("score", ascending=False, kind="stable").reset_index(drop=True)
+        return out if limit is None else out.head(limit)
+
+    @instrumented("text_mention_counts")
+    def mention_counts(self, entities, train_only=True, start=None, end=None, issue_codes=None,
+                       client=None):
+        """Count, per quarter, the filings whose description mentions each
+        entity.
+
+        Args:
+          entities (list of str or dict): Entities to look for, e.g. ticker
+            symbols. Each is searched as a phrase, or, in a dict, as any of a
+            list of phrases, e.g. {"AAPL": ["AAPL", "Apple Inc"]}. Words
+            written in upper case (e.g. "IT") only match where they are in
+            upper case too; other words match in any case.
+          train_only, start, end, issue_codes, client: As in search.
+
+        Returns:
+          DataFrame indexed by quarter (its first day, as in the totals
+          tables), with a column of counts per entity.
+        """
+        if not isinstance(entities, dict):
+            entities = {entity: [entity] for entity in entities}
+        entities = {
+            name: [tuple(tokenize_cased(phrase)) for phrase in ([phrases] if isinstance(phrases, str) else phrases)]
+            for name, phrases in entities.items()
+        }
+        entities = {name: [clause for clause in clauses if clause] for name, clauses in entities.items()}
+        # Entities given by a single token are counted from the document
+        # frequencies alone (without filters)
+        single = [
+            name for name, clauses in entities.items()
+            if issue_codes is None and client is None and len(clauses) == 1 and len(clauses[0]) == 1
+        ]
+        segments = self._select(train_only, start, end)
+        counts = np.zeros((len(segments), len(entities)), dtype=np.int64)
+        columns = {name: j for j, name in enumerate(entities)}
+        for i, segment in enumerate(segments):
+            if single:
+                counts[i, [columns[name] for name in single]] = segment.document_frequencies(
+                    [entities[name][0][0] for name in single]
+                )
+            mask = segment.mask(issue_codes, client)
+            for name, clauses in entities.items():
+                if name in single or not clauses:
+                    continue
+                docs = np.unique(np.concatenate([segment.matches(clause)[0] for clause in clauses]))
+                counts[i, columns[name]] = mask[docs].sum() if mask is not None else len(docs)
+        index = pd.DatetimeIndex([pd.Period(segment.quarter, freq="Q").start_time for segment in segments])
+        return pd.DataFrame(counts, index=index, columns=list(entities))
+
+
+def _build_segment(quarter, files, path):
+    """Read one quarter of filings and index it (module level so that it can
+    be sent to a process pool)."""
+    columns = ["filing_uuid", "client", "issue_codes", "lobbying_description"]
+    write_segment(path, read_quarter(quarter, files, columns))
+
+
+@instrumented()
+def build_text_index(path=None, max_workers=None):
+    """Build the text index of all lobbying filings, or bring it up to date.
+
+    Only the segments of quarters whose data changed since they were indexed
+    are rebuilt, in a process pool.
+
+    Args:
+      path (str or pathlike, optional): Defaults to TEXT_INDEX_PATH.
+      max_workers (int, optional): Size of the process pool.
+
+    Returns:
+      List of the quarters (re)indexed.
+    """
+    path = TEXT_INDEX_PATH if path is None else Path(path)
+    meta_path = path / "meta.json"
+    segments, version = {}, None
+    if meta_path.exists():
+        with open(meta_path) as f:
+            meta = json.load(f)
+        segments, version = meta["segments"], meta.get("version")
+    sources = {quarter: files for quarter, files in lobbying_sources(train_only=False)}
+    signatures = {quarter: file_signature(files) for quarter, files in sources.items()}
+    stale = [
+        quarter for quarter in sources
+        if version != INDEX_VERSION or segments.get(quarter) != signatures[quarter]
+    ]
+
+    path.mkdir(parents=True, exist_ok=True)
+    if stale:
+        max_workers = min(max_workers or os.cpu_count() or 1, len(stale))
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            futures = [pool.submit(_build_segment, q, sources[q], path / q) for q in stale]
+            for future in futures:
+                future.result()
+    for quarter in set(segments) - set(sources):
+        shutil.rmtree(path / quarter, ignore_errors=True)
+    tmp_path = meta_path.with_name(meta_path.name + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump({"version": INDEX_VERSION, "segments": signatures}, f, indent=1, sort_keys=True)
+    tmp_path.replace(meta_path)
+    return stale
+
+
+def text_index(path=None):
+    """Open the text index of the lobbying descriptions, building or updating
+    it first if the lobbying data changed since it was last built.
+
+    Returns:
+      A TextIndex.
+    """
+    global text_index_cache
+    path = TEXT_INDEX_PATH if path is None else Path(path)
+    signatures = {quarter: file_signature(files) for quarter, files in lobbying_sources(train_only=False)}
+    if (text_index_cache is not None and text_index_cache.path == path
+            and text_index_cache.meta["segments"] == signatures):
+        cache_hit("text_index")
+        return text_index_cache
+    cache_miss("text_index")
+    build_text_index(path)
+    text_index_cache = TextIndex(path)
+    return text_index_cache
+
+
+def search_descriptions(query, **kwargs):
+    """Search the lobbying descriptions (see TextIndex.search)."""
+    return text_index().search(query, **kwargs)
+
+
+def ticker_mentions(tickers, **kwargs):
+    """Count the filings mentioning each ticker per quarter (see
+    TextIndex.mention_counts)."""
+    return text_index().mention_counts(tickers, **kwargs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("query", nargs="?", help="words and double-quoted phrases to search for")
+    parser.add_argument("--mentions", nargs="+", metavar="TICKER",
+                        help="count the filings mentioning each ticker per quarter instead")
+    parser.add_argument("--all-quarters", action="store_true", help="include data after 2022")
+    parser.add_argument("--issue-codes", nargs="+")
+    parser.add_argument("--client")
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+    filters = {"train_only": not args.all_quarters, "issue_codes": args.issue_codes, "client": args.client}
+    with pd.option_context("display.width", 200, "display.max_columns", None, "display.max_rows", None):
+        if args.mentions:
+            print(ticker_mentions(args.mentions, **filters).to_string())
+        elif args.query:
+            print(search_descriptions(args.query, limit=args.limit, **filters).to_string())
+        else:
+            print(f"Indexed {len(build_text_index())} quarters.")
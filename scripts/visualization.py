@@ -10,10 +10,31 @@ from scripts.data_extraction import stock_and_lobbying_totals
 
 
 def plot_lobbying_vs_stocks(issue_codes, stock_cats, category_name,
-                            adjust_for_num_codes=False):
-    totals = stock_and_lobbying_totals(issue_codes, stock_cats,
-                                       adjust_for_num_codes=adjust_for_num_codes)
-    
+                            adjust_for_num_codes=False, totals=None):
+    """Plot lobbying spending against stock trading for one category.
+
+    Args:
+      issue_codes (str or list of str): Lobbying issue codes of the category.
+      stock_cats (str or list of str): Stock industries of the category.
+      category_name (str): Title of the figure.
+      adjust_for_num_codes (bool, default False): See lobbying_totals.
+      totals (pd.DataFrame, optional): Precomputed
+        stock_and_lobbying_totals(issue_codes, stock_cats), e.g. from
+        report.category_totals, to avoid computing them again.
+    """
+    if totals is None:
+        totals = stock_and_lobbying_totals(issue_codes, stock_cats,
+                                           adjust_for_num_codes=adjust_for_num_codes)
+    plot_totals(totals, category_name)
+
+
+def plot_totals(totals, category_name):
+    """Draw the 2x2 lobbying vs. stock trading figure from the totals of one
+    category (as returned by stock_and_lobbying_totals).
+
+    Returns:
+      The matplotlib Figure.
+    """
     fig, axs = plt.subplots(2, 2, figsize=(10, 10))
     axs = axs.flatten()
     sns.lineplot(totals.lobbying_total, ax=axs[0])
@@ -24,7 +45,7 @@ def plot_lobbying_vs_stocks(issue_codes, stock_cats, category_name,
     axs[1].set_ylabel("Gross trading (USD)")
     axs[1].set_title(f"Gross stock trading")
     axs[1].tick_params(axis="x", rotation=45)
-    sns.lineplot(totals.stocks_gross, ax=axs[2])
+    sns.lineplot(totals.stocks_net, ax=axs[2])
     axs[2].set_ylabel("Purchases - sales (USD)")
     axs[2].set_title(f"Net stock trading")
     axs[2].tick_params(axis="x", rotation=45)
@@ -34,4 +55,5 @@ def plot_lobbying_vs_stocks(issue_codes, stock_cats, category_name,
     axs[3].tick_params(axis="x", rotation=45)
     fig.suptitle(category_name.upper())
     plt.tight_layout()
+    return fig
     
\ No newline at end of file
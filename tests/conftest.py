@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The scripts package lives at the repository root, which isn't installed
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from scripts.lda_cleaning import resolve_amendments
+
+COLUMNS = ["filing_uuid", "filing_type", "filing_year", "reg_id", "cl_id", "dt_posted"]
+
+
+def notebook_update_filings(filings, quarter):
+    """update_filings from 1_Preliminary_cleaning.ipynb, reading the filings of
+    each type from a frame instead of one CSV file per type, and keeping
+    dt_posted."""
+    filing_suffixes = ['', 'Y', 'T', 'TY']
+    amendment_suffixes = ['A', 'AY', '@', '@Y']
+    fil_2_am = dict(zip(filing_suffixes, amendment_suffixes))
+
+    def of_type(suffix):
+        name = f"Q{quarter}{suffix}" if suffix in ("", "Y") else f"{quarter}{suffix}"
+        return filings[filings.filing_type == name]
+
+    rem_all = pd.DataFrame()
+    filing_all = pd.DataFrame()
+    for suff in filing_suffixes:
+        filing = of_type(suff).drop_duplicates(subset=['reg_id', 'cl_id'], keep='last')
+        filing_am = of_type(fil_2_am[suff]).drop_duplicates(subset=['reg_id', 'cl_id'], keep='last')
+        rem = pd.concat([filing_am, filing, filing]).drop_duplicates(subset=['reg_id', 'cl_id'], keep=False)
+        filing_am_matched = pd.concat([filing_am, rem]).drop_duplicates(subset=['reg_id', 'cl_id'], keep=False)
+        filing = pd.concat([filing, filing_am_matched]).drop_duplicates(subset=['reg_id', 'cl_id'], keep='last')
+        rem_all = pd.concat([rem_all, rem]).drop_duplicates(subset=['reg_id', 'cl_id'], keep='first')
+        filing_all = pd.concat([filing_all, filing]).drop_duplicates(subset=['reg_id', 'cl_id'], keep='first')
+    updated_filings = pd.concat([filing_all, rem_all]).drop_duplicates(
+        subset=['reg_id', 'cl_id'], keep='last'
+    ).sort_values('dt_posted', axis=0)
+    return updated_filings
+
+
+def make_filings(rows, year=2020):
+    """Filings from (filing_type, reg_id, cl_id) triples, posted in order."""
+    posted = pd.Timestamp(f"{year}-05-01") + pd.to_timedelta(np.arange(len(rows)), "s")
+    return pd.DataFrame(
+        [
+            (f"uuid-{i}", filing_type, year, reg_id, cl_id, str(posted[i]))
+            for i, (filing_type, reg_id, cl_id) in enumerate(rows)
+        ],
+        columns=COLUMNS,
+    )
+
+
+def resolved_ids(filings):
+    return resolve_amendments(filings)["filing_uuid"].tolist()
+
+
+@pytest.mark.parametrize("rows, expected", [
+    # A report on its own is kept
+    ([("Q1", 1, 1)], ["uuid-0"]),
+    # An amendment replaces its report
+    ([("Q1", 1, 1), ("1A", 1, 1)], ["uuid-1"]),
+    # Of several reports of the same type, the last one counts
+    ([("Q1", 1, 1), ("Q1", 1, 1)], ["uuid-1"]),
+    # An amendment without a report of its own type is kept
+    ([("1A", 1, 1)], ["uuid-0"]),
+    # A termination report is amended like any other report
+    ([("1T", 1, 1), ("1@", 1, 1)], ["uuid-1"]),
+    # A report and a termination report: the earlier suffix wins
+    ([("1T", 1, 1), ("Q1", 1, 1)], ["uuid-1"]),
+    # An amended report and its amended termination report
+    ([("Q1", 1, 1), ("1T", 1, 1), ("1A", 1, 1), ("1@", 1, 1)], ["uuid-2"]),
+    # A termination amendment without a termination report replaces the report
+    ([("Q1", 1, 1), ("1@", 1, 1)], ["uuid-1"]),
+    # Registrant/client pairs are resolved separately
+    ([("Q1", 1, 1), ("Q1", 1, 2), ("1A", 1, 2)], ["uuid-0", "uuid-2"]),
+    # Other filing types are dropped
+    ([("RR", 1, 1), ("MM", 1, 2), ("Q1", 1, 3)], ["uuid-2"]),
+])
+def test_resolve_amendments_chains(rows, expected):
+    filings = make_filings(rows)
+    assert resolved_ids(filings) == expected
+    assert resolved_ids(filings) == notebook_update_filings(filings, 1)["filing_uuid"].tolist()
+
+
+def test_resolve_amendments_matches_notebook():
+    rng = np.random.default_rng(0)
+    types = ["Q2", "Q2Y", "2T", "2TY", "2A", "2AY", "2@", "2@Y"]
+    rows = [(types[rng.integers(len(types))], rng.integers(5), rng.integers(5)) for _ in range(400)]
+    filings = make_filings(rows)
+    expected = notebook_update_filings(filings, 2)
+    assert resolved_ids(filings) == expected["filing_uuid"].tolist()
+    # dt_posted is kept, unlike in update_filings
+    assert list(resolve_amendments(filings).columns) == COLUMNS
+
+
+def test_resolve_amendments_several_quarters():
+    rng = np.random.default_rng(1)
+    pieces, expected = [], []
+    for year in [2019, 2020]:
+        for quarter in range(1, 5):
+            types = [f"Q{quarter}", f"{quarter}T", f"{quarter}A", f"{quarter}@"]
+            rows = [(types[rng.integers(len(types))], rng.integers(3), rng.integers(3)) for _ in range(40)]
+            filings = make_filings(rows, year).assign(
+                filing_uuid=lambda df, y=year, q=quarter: f"{y}Q{q}-" + df.filing_uuid
+            )
+            pieces.append(filings)
+            expected += notebook_update_filings(filings, quarter)["filing_uuid"].tolist()
+    resolved = resolve_amendments(pd.concat(pieces, ignore_index=True))
+    assert sorted(resolved["filing_uuid"]) == sorted(expected)
+    assert resolved["dt_posted"].is_monotonic_increasing
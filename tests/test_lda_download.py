@@ -0,0 +1,123 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from scripts import lda_download
+from scripts.lda_download import PAGE_SIZE, download_year, make_session, read_year
+
+
+class FakeLDA:
+    """Filings endpoint of the LDA API: pages of a list of filings, in
+    (dt_posted, filing_uuid) order, with some pages failing on request."""
+
+    def __init__(self, num_filings):
+        self.filings = [self.filing(i) for i in range(num_filings)]
+        self.failing = set()
+        self.requested = []
+
+    @staticmethod
+    def filing(i):
+        return {"filing_uuid": f"uuid-{i}", "filing_type": "Q1", "dt_posted": f"2020-04-01T00:{i // 60:02d}:{i % 60:02d}"}
+
+    def page(self, query):
+        assert query["ordering"] == ["dt_posted,filing_uuid"]
+        page = int(query["page"][0])
+        self.requested.append(page)
+        results = sorted(self.filings, key=lambda filing: (filing["dt_posted"], filing["filing_uuid"]))
+        results = results[(page - 1) * PAGE_SIZE:page * PAGE_SIZE]
+        if page in self.failing or (page > 1 and not results):
+            return 404, {"detail": "Invalid page."}
+        return 200, {"count": len(self.filings), "results": results}
+
+
+@pytest.fixture
+def lda():
+    fake = FakeLDA(10 * PAGE_SIZE - 10)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            status, body = fake.page(parse_qs(urlparse(self.path).query))
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(json.dumps(body).encode())
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    fake.url = f"http://127.0.0.1:{server.server_port}/api/v1/"
+    yield fake
+    server.shutdown()
+    thread.join()
+
+
+def download(lda, path, progress=False):
+    session = make_session(concurrency=2, retries=0)
+    return download_year(2020, path, lda.url, concurrency=2, session=session, progress=progress)
+
+
+def downloaded_ids(path):
+    return read_year(2020, path)["filing_uuid"].tolist()
+
+
+def test_resume_after_failed_pages(lda, tmp_path):
+    lda.failing = {4, 10}
+    with pytest.raises(RuntimeError, match=r"pages \[4, 10\]"):
+        download(lda, tmp_path)
+    lda.failing = set()
+    lda.requested = []
+    download(lda, tmp_path)
+    # Besides the failed pages, only the last finished page is checked
+    assert sorted(lda.requested) == [1, 4, 9, 10]
+    assert downloaded_ids(tmp_path) == [filing["filing_uuid"] for filing in lda.filings]
+    assert not lda_download.year_path(2020, tmp_path).with_name("filings_2020.parts").exists()
+
+
+def test_resume_after_new_filings(lda, tmp_path):
+    lda.failing = {4, 10}
+    with pytest.raises(RuntimeError):
+        download(lda, tmp_path)
+    # Filings posted since come last, and fill page 10 and start page 11
+    lda.filings += [FakeLDA.filing(i) for i in range(len(lda.filings), 11 * PAGE_SIZE - 5)]
+    lda.failing = set()
+    lda.requested = []
+    download(lda, tmp_path)
+    # The finished pages are checked by bisection rather than fetched again
+    assert {4, 10, 11} <= set(lda.requested)
+    assert len(lda.requested) < 8
+    assert downloaded_ids(tmp_path) == [filing["filing_uuid"] for filing in lda.filings]
+
+
+def test_resume_after_removed_filing(lda, tmp_path, capsys):
+    lda.failing = {10}
+    with pytest.raises(RuntimeError):
+        download(lda, tmp_path)
+    # A filing removed from page 3 shifts every later page
+    del lda.filings[2 * PAGE_SIZE + 3]
+    lda.failing = set()
+    lda.requested = []
+    download(lda, tmp_path, progress=True)
+    assert "fetching again from page 3" in capsys.readouterr().out
+    assert set(range(3, 11)) <= set(lda.requested)
+    assert downloaded_ids(tmp_path) == [filing["filing_uuid"] for filing in lda.filings]
+
+
+def test_resume_after_replaced_filing(lda, tmp_path):
+    lda.failing = {10}
+    with pytest.raises(RuntimeError):
+        download(lda, tmp_path)
+    # An amendment replaces a filing of page 3 and comes last, so the count is
+    # the same but every page from page 3 on shifted
+    del lda.filings[2 * PAGE_SIZE + 3]
+    lda.filings.append(FakeLDA.filing(10 * PAGE_SIZE))
+    lda.failing = set()
+    lda.requested = []
+    download(lda, tmp_path)
+    assert set(range(3, 11)) <= set(lda.requested)
+    assert downloaded_ids(tmp_path) == [filing["filing_uuid"] for filing in lda.filings]
@@ -0,0 +1,71 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+from darts import TimeSeries
+
+from scripts import model_evaluation
+from scripts.model_evaluation import cross_validate_grid
+
+
+class MeanModel:
+    """Forecast the mean of the training series."""
+
+    def __init__(self, min_length=1):
+        self.min_length = min_length
+
+    def fit(self, series):
+        if len(series) < self.min_length:
+            raise ValueError(f"series of length {len(series)} is too short")
+        self.series = series
+
+    def predict(self, n):
+        index = pd.date_range(self.series.end_time(), periods=n + 1, freq=self.series.freq)[1:]
+        return TimeSeries.from_series(pd.Series(self.series.values().mean(), index=index))
+
+
+class BrokenModel(MeanModel):
+    def fit(self, series):
+        self.series = series.missing_attribute
+
+
+class NanModel(MeanModel):
+    def predict(self, n):
+        return super().predict(n).map(lambda values: values * np.nan)
+
+
+@pytest.fixture
+def series():
+    index = pd.period_range("2013Q1", periods=24, freq="Q").to_timestamp()
+    return {"lobbying": pd.Series(np.arange(24.0) ** 1.5, index=index)}
+
+
+@pytest.fixture(autouse=True)
+def cache_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(model_evaluation, "CV_CACHE_PATH", tmp_path / "cv_cache")
+    return tmp_path / "cv_cache"
+
+
+def test_failed_folds_are_scored_nan_and_not_cached(series, cache_path):
+    specs = {"mean": (MeanModel, {}), "long": (MeanModel, {"min_length": 10}), "nan": (NanModel, {})}
+    scores = cross_validate_grid(series, specs, max_workers=1).set_index(["model", "fold"])
+    assert scores.loc["mean", "score"].notna().all()
+    assert scores.loc["mean", "error"].isna().all()
+    # The first training set has 4 quarters, the second 8
+    assert scores.loc["long", "score"].isna().tolist() == [True, True, False, False, False]
+    assert scores.loc[("long", 0), "error"] == "ValueError: series of length 4 is too short"
+    assert scores.loc["nan", "score"].isna().all()
+
+    cached = [json.loads(fname.read_text()) for fname in cache_path.glob("*.json")]
+    assert sorted((row["model"], row["fold"]) for row in cached) == (
+        [("long", fold) for fold in range(2, 5)] + [("mean", fold) for fold in range(5)]
+    )
+    rerun = cross_validate_grid(series, specs, max_workers=1).set_index(["model", "fold"])
+    pd.testing.assert_frame_equal(rerun, scores)
+
+
+def test_programming_errors_are_raised(series, cache_path):
+    with pytest.raises(AttributeError, match="missing_attribute"):
+        cross_validate_grid(series, {"broken": (BrokenModel, {})}, max_workers=1)
+    assert not list(cache_path.glob("*.json"))
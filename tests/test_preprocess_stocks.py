@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+
+from scripts.preprocess_stocks import all_codes, preprocess_stock_data
+
+
+def row_wise_preprocess_stock_data(stocks):
+    """preprocess_stock_data as it was before the string operations, mapping
+    the row-wise functions below over the columns."""
+    def normalize_name(name):
+        if "," in name:
+            name = name.split(",")[1].strip() + " " + name.split(",")[0].strip()
+        name = name.strip()
+        if name.startswith("Mr.") or name.startswith("Ms.") or name.startswith("Dr."):
+            name = name[3:].strip()
+        if name.startswith("Mrs."):
+            name = name[4:].strip()
+        return name
+
+    def normalize_ticker_symbol(symbol):
+        if "$" in symbol:
+            symbol = symbol[:symbol.find("$")]
+        if "." in symbol:
+            symbol = symbol[:symbol.find(".")]
+        return symbol
+
+    def min_trade_size(size):
+        if "-" in size:
+            size = size.split("-")[0].strip()
+        size = size.replace("$", "").replace(",", "")
+        return float(size)
+
+    def max_trade_size(size):
+        if "-" in size:
+            size = size.split("-")[1].strip().strip(".")
+        size = size.replace("$", "").replace(",", "")
+        return float(size)
+
+    for datetime_col in ["Traded", "Filed", "Quiver_Upload_Time", "last_modified"]:
+        stocks[datetime_col] = pd.to_datetime(stocks[datetime_col])
+    stocks = stocks.drop([44837, 42546, 9565], axis=0)
+    stocks["Min_Trade_Size"] = stocks.Trade_Size_USD.map(min_trade_size)
+    stocks["Max_Trade_Size"] = stocks.Trade_Size_USD.map(max_trade_size)
+    stocks["Name"] = stocks.Name.map(normalize_name)
+    stocks.drop([
+        "Status", "Quiver_Upload_Time", "excess_return", "last_modified", "Trade_Size_USD"
+    ], axis=1, inplace=True)
+    stocks.drop(stocks[stocks.TickerType.isin([
+        'CS', 'GS', 'AB', 'ET', 'HN', 'Corporate Bond', 'PS',
+        'Cryptocurrency', 'OI', 'OL', 'SA'
+    ])].index, axis=0, inplace=True)
+    stocks["Ticker"] = stocks.Ticker.map(normalize_ticker_symbol)
+    stocks["Ticker"] = stocks.Ticker.replace(["FB", "UTX", "RTN", "FISV"], ["META", "RTX", "RTX", "FI"])
+    stocks["TickerType"] = stocks.TickerType.replace(
+        ["Stock", "Stock Option", "Other Securities"], ["ST", "OP", "OT"],
+    )
+    stocks["Quarter"] = pd.PeriodIndex(stocks["Filed"], freq="Q")
+    stocks.sort_values(by="Filed", inplace=True)
+    return stocks
+
+
+def make_trades():
+    names = [
+        "Pelosi, Nancy", "Mr. John Smith", "Mrs. Jane Doe", "Dr. Ann Lee", "  Ms. Kay Roe ",
+        "Doe, John, Jr.", "Smith, Mrs. Jane", "Mr.Tight Space", "Plain Name", "Mrsa Name",
+    ]
+    sizes = [
+        "$1,001 - $15,000", "$15,001 - $50,000.", "1001 - 15000", "$50,000,000", "$1,000,001 -$5,000,000",
+        "$250,001 - $500,000", "15000", "$100,001 - $250,000", "$0 - $1,000", "$1,001 - $15,000",
+    ]
+    tickers = ["AAPL", "BRK.B", "RDS$A", "FB", "UTX", "RTN", "FISV", "XOM", "T.TO$B", "MSFT"]
+    ticker_types = ["ST", "Stock", "OP", "Stock Option", "Other Securities", "CS", "ST", "PS", "ST", "ST"]
+    num_trades = 30
+    index = list(range(num_trades - 3)) + [44837, 42546, 9565]
+    filed = pd.date_range("2020-01-01", periods=num_trades, freq="17D")[::-1]
+    return pd.DataFrame({
+        "Traded": (filed - pd.Timedelta(days=20)).astype(str),
+        "Filed": filed.astype(str),
+        "Quiver_Upload_Time": filed.astype(str),
+        "last_modified": filed.astype(str),
+        "Name": [names[i % len(names)] for i in range(num_trades)],
+        "Trade_Size_USD": [sizes[i * 3 % len(sizes)] for i in range(num_trades)],
+        "Ticker": [tickers[i * 7 % len(tickers)] for i in range(num_trades)],
+        "TickerType": [ticker_types[i // 3 % len(ticker_types)] for i in range(num_trades)],
+        "Status": "New",
+        "excess_return": np.linspace(-1, 1, num_trades),
+    }, index=index)
+
+
+def test_preprocess_stock_data_matches_row_wise():
+    expected = row_wise_preprocess_stock_data(make_trades())
+    cleaned = preprocess_stock_data(make_trades())
+    pd.testing.assert_frame_equal(cleaned, expected)
+    assert {"Jane Smith", "John Doe", "Kay Roe", "Tight Space", "Mrsa Name"} <= set(cleaned["Name"])
+
+
+def test_all_codes_matches_row_wise():
+    frame = pd.DataFrame({
+        "Category1": ["TAX", np.nan, np.nan, "BUD"],
+        "Category2": [np.nan, "ENV", np.nan, "TRD"],
+        "Category3": ["DEF", "CHM", np.nan, np.nan],
+    })
+    expected = [",".join(cat for cat in row if not pd.isna(cat)) for row in frame.itertuples(index=False)]
+    assert all_codes(frame).tolist() == expected == ["TAX,DEF", "ENV,CHM", "", "BUD,TRD"]
@@ -0,0 +1,66 @@
+import pandas as pd
+
+from scripts.ingest import ingest
+from scripts.split_filings import split_filings
+
+COLUMNS = [
+    "filing_uuid", "filing_type", "filing_year", "income", "expenses", "dt_posted", "registrant",
+    "client", "reg_id", "cl_id", "issue_codes", "lobbying_description",
+]
+
+
+def make_source(rows):
+    """filings_all.csv rows from (filing_type, year, reg_id, cl_id, issue codes,
+    dt_posted) tuples."""
+    return pd.DataFrame(
+        [
+            (f"uuid-{i}", filing_type, year, 10000.0 * (i + 1), "", dt_posted, f"REGISTRANT {reg_id}",
+             f"CLIENT {cl_id}", reg_id, cl_id, str(codes), str([f"issues affecting client {cl_id}"]))
+            for i, (filing_type, year, reg_id, cl_id, codes, dt_posted) in enumerate(rows)
+        ],
+        columns=COLUMNS,
+    )
+
+
+BASE = [
+    ("Q1", 2020, 1, 1, ["TAX", "BUD"], "2020-04-10 10:00:00"),
+    ("Q1", 2020, 1, 2, ["TAX"], "2020-04-11 10:00:00"),
+    ("Q2", 2020, 2, 3, ["DEF"], "2020-07-15 10:00:00"),
+    ("1A", 2020, 1, 2, ["TAX", "TRD"], "2020-05-01 10:00:00"),
+    ("RR", 2020, 3, 4, [], "2020-02-01 10:00:00"),
+    ("Q2", 2020, 2, 4, ["ENV", "DEF"], "2020-07-20 10:00:00"),
+]
+# A late amendment of a 2020Q1 report, and a new quarter
+LATER = [
+    ("1A", 2020, 1, 1, ["BUD", "ENV"], "2021-02-01 10:00:00"),
+    ("Q1", 2021, 2, 3, ["DEF", "HCR"], "2021-04-12 10:00:00"),
+]
+
+
+def layout_files(lobbying_path):
+    return {
+        fname.relative_to(lobbying_path).as_posix(): fname.read_bytes()
+        for layout in ("by_quarter", "by_issue_code")
+        for fname in sorted((lobbying_path / layout).glob("*.csv"))
+    }
+
+
+def test_ingest_matches_split_filings(tmp_path):
+    split_path, ingest_path = tmp_path / "split", tmp_path / "ingest"
+    split_path.mkdir()
+    ingest_path.mkdir()
+    base_source, source = tmp_path / "base.csv", tmp_path / "filings_all.csv"
+    make_source(BASE).to_csv(base_source, index=False)
+    make_source(BASE + LATER).to_csv(source, index=False)
+
+    split_filings(source, split_path, chunksize=3, max_workers=1)
+    assert ingest(base_source, ingest_path, chunksize=3, max_workers=1)["quarters"] == ["2020Q1", "2020Q2"]
+    result = ingest(source, ingest_path, chunksize=3, max_workers=1)
+    assert result["quarters"] == ["2020Q1", "2021Q1"]
+    assert result["issue_codes"] == ["BUD", "DEF", "ENV", "HCR", "TAX"]
+    assert layout_files(ingest_path) == layout_files(split_path)
+
+    # The amendment replaced its report
+    quarter = pd.read_csv(split_path / "by_quarter" / "filings_2020Q1.csv")
+    assert sorted(quarter["filing_uuid"]) == ["uuid-3", "uuid-6"]
+    assert ingest(source, ingest_path, chunksize=3, max_workers=1)["quarters"] == []
@@ -0,0 +1,66 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from scripts.text_index import INDEX_VERSION, Segment, TextIndex, tokenize_cased, write_segment
+
+DESCRIPTIONS = [
+    "['Issues affecting IT services', 'Tariffs on ALL imports']",
+    "['It is all about the budget of ON Semiconductor']",
+    "['Information technology: it, all of it']",
+    "['Purchases of AAPL and IT equipment']",
+]
+
+
+def make_filings(descriptions, prefix="uuid"):
+    return pd.DataFrame({
+        "filing_uuid": [f"{prefix}-{i}" for i in range(len(descriptions))],
+        "client": "client",
+        "issue_codes": "TAX",
+        "lobbying_description": descriptions,
+    })
+
+
+@pytest.fixture
+def segment(tmp_path):
+    write_segment(tmp_path / "2020Q1", make_filings(DESCRIPTIONS))
+    return Segment(tmp_path / "2020Q1", "2020Q1")
+
+
+def test_tokenize_cased():
+    assert tokenize_cased("IT services, Apple Inc. (AAPL) 3M") == ["IT", "services", "apple", "inc", "AAPL", "3M"]
+
+
+def test_upper_case_words_only_match_in_upper_case(segment):
+    assert list(segment.document_frequencies(["IT", "ALL", "ON", "AAPL"])) == [2, 1, 1, 1]
+    # Lower case terms match in any case
+    assert list(segment.document_frequencies(["it", "all", "on", "aapl"])) == [4, 3, 2, 1]
+    assert list(segment.matches(("IT", "services"))[0]) == [0]
+    assert list(segment.matches(("it", "services"))[0]) == [0]
+    # Upper case words don't count towards the document lengths
+    assert list(segment.doc_lens) == [8, 9, 6, 6]
+
+
+def test_document_frequencies_of_long_tokens(segment):
+    longest = max(segment.terms, key=len).decode()
+    assert len(longest) == segment.terms.dtype.itemsize
+    # A longer token isn't truncated to a term it starts with
+    assert list(segment.document_frequencies([longest, longest + "s", "x" * 100])) == [1, 0, 0]
+
+
+def test_search_with_an_empty_segment(tmp_path):
+    # No description of 2020Q2 has a token
+    write_segment(tmp_path / "2020Q1", make_filings(DESCRIPTIONS, "q1"))
+    write_segment(tmp_path / "2020Q2", make_filings(["[]", np.nan, "['']"], "q2"))
+    with open(tmp_path / "meta.json", "w") as f:
+        json.dump({"version": INDEX_VERSION, "segments": {"2020Q1": "", "2020Q2": ""}}, f)
+    index = TextIndex(tmp_path)
+    assert len(index.segments["2020Q2"]) == 3
+    assert list(index.segments["2020Q2"].document_frequencies(["it", "IT"])) == [0, 0]
+    found = index.search('"it services" budget', train_only=False, limit=None)
+    assert sorted(found["filing_uuid"]) == ["q1-0", "q1-1"]
+    assert index.search('"it services"', train_only=False, start="2020-04-01").empty
+    counts = index.mention_counts(["IT", "ON Semiconductor"], train_only=False)
+    assert counts.to_dict("list") == {"IT": [2, 0], "ON Semiconductor": [1, 0]}
@@ -0,0 +1,172 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from scripts import data_extraction
+from scripts.benchmark import make_filings
+from scripts.data_extraction import (
+    TOTALS_CACHE_PATH, invalidate_lobbying_caches, lobbying_totals, lobbying_totals_cube, stock_totals,
+)
+from scripts.lobbying_store import build_store, list_quarters, pyarrow_available
+from scripts.split_filings import split_filings
+
+INDUSTRIES = ["Banks", "Oil & Gas", "Software", "Airlines"]
+
+
+def make_stocks(num_trades, rng):
+    """A stocks_cleaned.csv table, with trades outside the quarters covered,
+    without an industry or without an amount."""
+    quarters = pd.period_range("2012Q3", "2024Q2", freq="Q").start_time
+    amounts = rng.choice([8000.5, 32500.5, 75000.5, np.nan], num_trades, p=[0.5, 0.3, 0.15, 0.05])
+    return pd.DataFrame({
+        "Quarter": rng.choice(quarters, num_trades),
+        "Industry": rng.choice(INDUSTRIES + [np.nan], num_trades),
+        "Transaction": rng.choice(["Purchase", "Sale", "Sale (Partial)", "Exchange"], num_trades),
+        "Mean_Trade_Size": amounts,
+        "Variance": amounts ** 2 / 100,
+    })
+
+
+@pytest.fixture(scope="module", params=["csv", "store"])
+def layout(request, tmp_path_factory):
+    if request.param == "store" and not pyarrow_available():
+        pytest.skip("pyarrow is not installed")
+    root = tmp_path_factory.mktemp(request.param)
+    rng = np.random.default_rng(1)
+    lobbying_path, trading_path = root / "lobbying_data", root / "trading_data"
+    lobbying_path.mkdir()
+    trading_path.mkdir()
+    make_filings(4000, rng).to_csv(lobbying_path / "filings_all.csv", index=False)
+    split_filings(lobbying_path / "filings_all.csv", lobbying_path, max_workers=1)
+    if request.param == "store":
+        build_store(lobbying_path, lobbying_path / "store")
+    make_stocks(3000, rng).to_csv(trading_path / "stocks_cleaned.csv", index=False)
+    return root
+
+
+@pytest.fixture
+def data_dir(layout, monkeypatch):
+    monkeypatch.chdir(layout)
+    yield layout
+    shutil.rmtree(layout / TOTALS_CACHE_PATH, ignore_errors=True)
+    shutil.rmtree(layout / "trading_data" / "cache", ignore_errors=True)
+    data_extraction.totals_cube_pieces.clear()
+    data_extraction.stocks_cube = None
+
+
+def direct_lobbying_totals(issue_codes, train_only, adjust_for_num_codes):
+    """lobbying_totals from the by_issue_code files, as computed before the
+    totals cube, with quarters without filings missing."""
+    all_issues = pd.concat([
+        pd.read_csv(f"lobbying_data/by_issue_code/filings_{code}.csv", parse_dates=["period_start"])
+        for code in issue_codes
+    ]).drop_duplicates()
+    if train_only:
+        all_issues = all_issues[all_issues.period_start.dt.year < 2023]
+    if adjust_for_num_codes:
+        codes = all_issues["issue_codes"].map(eval)
+        share = codes.map(lambda these: len(set(these) & set(issue_codes))) / codes.map(len)
+        for col in ["income", "expenses", "spending_variance"]:
+            all_issues[col] = all_issues[col] * share
+    grouped = all_issues.groupby("period_start")
+    out = grouped[["income", "expenses"]].sum()
+    out["income_variance"] = all_issues[all_issues.income > 0].groupby("period_start")["spending_variance"].sum()
+    out["expenses_variance"] = all_issues[all_issues.expenses > 0].groupby("period_start")["spending_variance"].sum()
+    out["spending_variance"] = grouped["spending_variance"].sum()
+    out["num_income"] = all_issues[all_issues.income > 0].groupby("period_start")["income"].count()
+    out["num_expenses"] = all_issues[all_issues.expenses > 0].groupby("period_start")["expenses"].count()
+    out["num"] = out["num_income"] + out["num_expenses"]
+    out = out.rename(columns=lambda x: "lobbying_" + x)
+    out["lobbying_total"] = out["lobbying_income"] + out["lobbying_expenses"]
+    end_date = "2022-12-31" if train_only else "2023-12-31"
+    return out.reindex(pd.period_range(start=2013, end=end_date, freq="Q").to_timestamp())
+
+
+def direct_stock_totals(stock_industries, train_only):
+    """stock_totals from stocks_cleaned.csv, as computed before the stock cube."""
+    end_date = "2022-12-31" if train_only else "2024-03-31"
+    out = pd.DataFrame(index=pd.period_range(start=2013, end=end_date, freq="Q").to_timestamp(), dtype=np.float64)
+    stocks = pd.read_csv("trading_data/stocks_cleaned.csv", parse_dates=["Quarter"])
+    if train_only:
+        stocks = stocks[stocks.Quarter < pd.Timestamp("2023-01-01")]
+    filtered = stocks[stocks.Industry.isin(stock_industries)]
+    purchases = filtered[filtered["Transaction"] == "Purchase"].groupby("Quarter")
+    sales = filtered[filtered["Transaction"].str.startswith("Sale")].groupby("Quarter")
+    out["stocks_purchase"] = purchases.Mean_Trade_Size.sum()
+    out["stocks_sale"] = sales.Mean_Trade_Size.sum()
+    out["stocks_gross"] = filtered.groupby("Quarter").Mean_Trade_Size.sum()
+    out["stocks_net"] = out["stocks_purchase"] - out["stocks_sale"]
+    out["stocks_gross_frac"] = out["stocks_gross"] / stocks.groupby("Quarter")["Mean_Trade_Size"].sum()
+    out["stocks_purchase_variance"] = purchases.Variance.sum()
+    out["stocks_sale_variance"] = sales.Variance.sum()
+    out["stocks_gross_variance"] = filtered.groupby("Quarter").Variance.sum()
+    out["stocks_num_purchase"] = purchases.Mean_Trade_Size.count()
+    out["stocks_num_sale"] = sales.Mean_Trade_Size.count()
+    out["stocks_num"] = out["stocks_num_purchase"] + out["stocks_num_sale"]
+    return out.fillna(0)
+
+
+def assert_totals_equal(actual, expected):
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False, check_freq=False, check_names=False)
+
+
+@pytest.mark.parametrize("train_only", [True, False])
+@pytest.mark.parametrize("adjust_for_num_codes", [False, True])
+def test_lobbying_totals_cube_matches_direct(data_dir, train_only, adjust_for_num_codes):
+    cube = lobbying_totals_cube(train_only, adjust_for_num_codes)
+    codes = sorted(cube.index.get_level_values("issue_code").unique())
+    assert len(codes) > 50
+    for code in codes[::10]:
+        assert_totals_equal(
+            lobbying_totals(code, train_only, adjust_for_num_codes),
+            direct_lobbying_totals([code], train_only, adjust_for_num_codes),
+        )
+    # Several codes are computed directly
+    assert_totals_equal(
+        lobbying_totals(["TAX", "BUD"], train_only, adjust_for_num_codes),
+        direct_lobbying_totals(["TAX", "BUD"], train_only, adjust_for_num_codes),
+    )
+
+
+@pytest.mark.parametrize("train_only", [True, False])
+def test_stock_cube_matches_direct(data_dir, train_only):
+    for industries in [[industry] for industry in INDUSTRIES] + [INDUSTRIES[:2], ["Nothing"]]:
+        assert_totals_equal(stock_totals(industries, train_only), direct_stock_totals(industries, train_only))
+
+
+def cube_piece_files():
+    return {fname.name: fname.stat().st_mtime_ns for fname in TOTALS_CACHE_PATH.glob("*.pkl")}
+
+
+def test_touched_partition_only_invalidates_its_piece(data_dir):
+    if not (data_dir / "lobbying_data" / "store").exists():
+        pytest.skip("without the store, the by_issue_code files are a single partition")
+    expected = lobbying_totals_cube(train_only=False)
+    before = cube_piece_files()
+    assert len(before) == len(list_quarters())
+
+    # A newer modification time changes the fingerprint of the quarter
+    fname = list_quarters()["2015Q2"][0]
+    stat = os.stat(fname)
+    os.utime(fname, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    pd.testing.assert_frame_equal(lobbying_totals_cube(train_only=False), expected)
+    after = cube_piece_files()
+    assert {name for name in before if name not in after} == {
+        name for name in before if name.startswith("2015Q2-")
+    }
+    assert [name for name in after if name not in before] == [
+        name for name in after if name.startswith("2015Q2-")
+    ]
+    assert {name: mtime for name, mtime in after.items() if not name.startswith("2015Q2-")} == {
+        name: mtime for name, mtime in before.items() if not name.startswith("2015Q2-")
+    }
+    assert len([key for key in data_extraction.totals_cube_pieces if key.startswith("2015Q2-")]) == 1
+
+    removed = invalidate_lobbying_caches(["2016Q1"])
+    assert [fname.name.split("-", 1)[0] for fname in removed] == ["2016Q1"]
+    assert not any(key.startswith("2016Q1-") for key in data_extraction.totals_cube_pieces)
+    assert len(cube_piece_files()) == len(before) - 1
+    pd.testing.assert_frame_equal(lobbying_totals_cube(train_only=False), expected)